@@ -0,0 +1,402 @@
+#
+#	THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#	THE 'COPYING' FILE FOR DETAILS
+#
+#	AudioPool.py
+#
+#	This module keeps the audio files imported into projects in a single pool
+#	in the user's data directory, where each file is named after the hash of
+#	its content. Projects reference the pooled files through hard links in
+#	their audio directories, so a file used by many projects is stored once,
+#	and the number of links to it counts the projects still using it.
+#
+#-------------------------------------------------------------------------------
+
+import os, errno
+import hashlib, tempfile
+import threading
+import Globals
+
+""" The directory the pooled audio files are kept in. """
+POOL_PATH = os.path.join(Globals.JOKOSHER_DATA_HOME, "audiopool")
+
+""" The file which remembers the hash of the files added to the pool. """
+MANIFEST_PATH = os.path.join(POOL_PATH, "manifest")
+
+""" The size of the chunks in which files are hashed and copied into the pool. """
+CHUNK_SIZE = 1024 * 1024
+
+# the manifest, by path, of (size, modification time, inode, digest) tuples
+_manifest = None
+_lock = threading.RLock()
+
+#_____________________________________________________________________
+
+def IsEnabled():
+	"""
+	Returns:
+		True if the pool is enabled in the settings, and this platform
+		can share files between the pool and the projects.
+	"""
+	return Globals.settings.general["audiopool"] == "enabled" and hasattr(os, "link")
+
+#_____________________________________________________________________
+
+def AddFile(src, dst):
+	"""
+	Makes dst a reference to the pooled copy of src, adding it to
+	the pool first if no file with the same content is pooled yet.
+	A file which was pooled before is neither read nor copied again.
+
+	Parameters:
+		src -- the path of the file to add.
+		dst -- the path of the reference, in a project's audio directory.
+
+	Returns:
+		True if dst was created, False if the pool cannot be used for
+		these files, in which case the caller should copy src itself.
+
+	Considerations:
+		Raises IOError or OSError if src cannot be read.
+	"""
+	if not IsEnabled():
+		return False
+
+	_lock.acquire()
+	try:
+		digest = GetDigest(src)
+		if digest:
+			pooled = GetPooledPath(digest, src)
+			if not os.path.exists(pooled):
+				digest = None
+
+		if not digest:
+			pooled = _CopyToPool(src)
+			if not pooled:
+				return False
+
+		try:
+			os.link(pooled, dst)
+		except OSError, e:
+			# the project is on another filesystem than the pool
+			Globals.debug("Cannot link %s to the audio pool: %s" % (dst, e))
+			return False
+
+		_Remember(dst, os.path.basename(pooled).split(".")[0])
+		Globals.debug("Added reference to pooled file %s:\n\t%s" % (pooled, dst))
+		return True
+	finally:
+		_lock.release()
+
+#_____________________________________________________________________
+
+def LinkPooledFile(src, dst):
+	"""
+	Creates dst as another reference to the pooled file which src refers to.
+
+	Parameters:
+		src -- the path of an existing reference to a pooled file.
+		dst -- the path of the new reference.
+
+	Returns:
+		True if dst was created, False if src is not in the pool
+		or cannot be linked to.
+	"""
+	if not IsEnabled():
+		return False
+
+	_lock.acquire()
+	try:
+		digest = GetDigest(src, readFile=False)
+		if not digest:
+			return False
+
+		pooled = GetPooledPath(digest, src)
+		try:
+			os.link(pooled, dst)
+		except OSError:
+			return False
+
+		_Remember(dst, digest)
+		return True
+	finally:
+		_lock.release()
+
+#_____________________________________________________________________
+
+def IsPooled(path):
+	"""
+	Parameters:
+		path -- the path of an audio file.
+
+	Returns:
+		True if the file is a reference to a file in the pool.
+	"""
+	_lock.acquire()
+	try:
+		digest = GetDigest(path, readFile=False)
+		return bool(digest) and os.path.exists(GetPooledPath(digest, path))
+	finally:
+		_lock.release()
+
+#_____________________________________________________________________
+
+def GetDigest(path, readFile=True):
+	"""
+	Finds the hash of a file's content. The hash of a file added to the pool
+	is remembered as long as the file's size, modification time and inode
+	are unchanged.
+
+	Parameters:
+		path -- the path of the file.
+		readFile -- False to return None instead of reading unknown files.
+
+	Returns:
+		the hex digest of the file, or None if readFile is False and
+		the file is not known to the pool.
+	"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+
+	_lock.acquire()
+	try:
+		entry = _GetManifest().get(_GetKey(path))
+		if entry and entry[:3] == _GetStatKey(stat):
+			return entry[3]
+	finally:
+		_lock.release()
+
+	if not readFile:
+		return None
+
+	digest = hashlib.sha1()
+	f = open(path, "rb")
+	try:
+		data = f.read(CHUNK_SIZE)
+		while data:
+			digest.update(data)
+			data = f.read(CHUNK_SIZE)
+	finally:
+		f.close()
+	return digest.hexdigest()
+
+#_____________________________________________________________________
+
+def GetPooledPath(digest, filename):
+	"""
+	Parameters:
+		digest -- the hex digest of the file's content.
+		filename -- the name of a file with this content, whose
+					extension is kept so the file type can be guessed.
+
+	Returns:
+		the path of the pooled file with the given digest.
+	"""
+	extension = os.path.splitext(filename)[1]
+	return os.path.join(POOL_PATH, digest[:2], digest + extension)
+
+#_____________________________________________________________________
+
+def GetReferenceCount(path):
+	"""
+	Parameters:
+		path -- the path of a pooled file.
+
+	Returns:
+		the number of references to the pooled file.
+	"""
+	return os.stat(path).st_nlink - 1
+
+#_____________________________________________________________________
+
+def Collect():
+	"""
+	Deletes the pooled files which are no longer referenced by any
+	project, and forgets the references which no longer exist.
+
+	Returns:
+		the number of bytes freed.
+	"""
+	if not os.path.isdir(POOL_PATH):
+		return 0
+
+	freed = 0
+	_lock.acquire()
+	try:
+		for dirname in os.listdir(POOL_PATH):
+			dirpath = os.path.join(POOL_PATH, dirname)
+			if not os.path.isdir(dirpath):
+				continue
+			for filename in os.listdir(dirpath):
+				path = os.path.join(dirpath, filename)
+				stat = os.stat(path)
+				if stat.st_nlink <= 1:
+					Globals.debug("Removing unreferenced pooled file:", path)
+					os.remove(path)
+					freed += stat.st_size
+
+		manifest = _GetManifest()
+		for path, (size, mtime, inode, digest) in manifest.items():
+			if not os.path.exists(path) or not os.path.exists(GetPooledPath(digest, path)):
+				del manifest[path]
+		_WriteManifest()
+	finally:
+		_lock.release()
+
+	return freed
+
+#_____________________________________________________________________
+
+def _CopyToPool(src):
+	"""
+	Copies a file into the pool, hashing it while it is copied.
+
+	Parameters:
+		src -- the path of the file.
+
+	Returns:
+		the path of the pooled file, or None if it could not be created.
+	"""
+	try:
+		os.makedirs(POOL_PATH)
+	except OSError, e:
+		if e.errno != errno.EEXIST:
+			Globals.debug("Cannot create the audio pool:", e)
+			return None
+
+	digest = hashlib.sha1()
+	srcfile = open(src, "rb")
+	try:
+		fd, temp = tempfile.mkstemp(dir=POOL_PATH)
+		dstfile = os.fdopen(fd, "wb")
+		try:
+			try:
+				data = srcfile.read(CHUNK_SIZE)
+				while data:
+					digest.update(data)
+					dstfile.write(data)
+					data = srcfile.read(CHUNK_SIZE)
+			finally:
+				dstfile.close()
+		except EnvironmentError:
+			os.remove(temp)
+			raise
+	finally:
+		srcfile.close()
+
+	digest = digest.hexdigest()
+	pooled = GetPooledPath(digest, src)
+	if os.path.exists(pooled):
+		# the same content was pooled from another file
+		os.remove(temp)
+	else:
+		if not os.path.isdir(os.path.dirname(pooled)):
+			os.mkdir(os.path.dirname(pooled))
+		os.rename(temp, pooled)
+
+	_Remember(src, digest)
+	return pooled
+
+#_____________________________________________________________________
+
+def _GetManifest():
+	"""
+	Returns:
+		the manifest, loading it from disk the first time.
+	"""
+	global _manifest
+	if _manifest is None:
+		_manifest = {}
+		if os.path.exists(MANIFEST_PATH):
+			f = open(MANIFEST_PATH, "rb")
+			try:
+				for line in f:
+					try:
+						digest, size, mtime, inode, path = line.rstrip("\n").split("\t", 4)
+						_manifest[path] = (int(size), float(mtime), int(inode), digest)
+					except ValueError:
+						# a line which was not completely written, or was
+						# written without the inode, in which case the file is hashed again
+						continue
+			finally:
+				f.close()
+	return _manifest
+
+#_____________________________________________________________________
+
+def _Remember(path, digest):
+	"""
+	Adds a file to the manifest, so that its hash does not need to be
+	computed again, and appends it to the manifest file.
+
+	Parameters:
+		path -- the path of the file.
+		digest -- the hex digest of the file's content.
+	"""
+	stat = os.stat(path)
+	path = _GetKey(path)
+	entry = _GetStatKey(stat) + (digest,)
+	_GetManifest()[path] = entry
+
+	try:
+		f = open(MANIFEST_PATH, "ab")
+		try:
+			f.write(_FormatEntry(path, entry))
+		finally:
+			f.close()
+	except IOError, e:
+		Globals.debug("Cannot write the audio pool manifest:", e)
+
+#_____________________________________________________________________
+
+def _WriteManifest():
+	"""
+	Rewrites the manifest file with the current manifest.
+	"""
+	temp = MANIFEST_PATH + "~"
+	f = open(temp, "wb")
+	try:
+		for path, entry in _GetManifest().iteritems():
+			f.write(_FormatEntry(path, entry))
+	finally:
+		f.close()
+	os.rename(temp, MANIFEST_PATH)
+
+#_____________________________________________________________________
+
+def _FormatEntry(path, entry):
+	"""
+	Returns:
+		the line of the manifest file for the given path and entry.
+	"""
+	size, mtime, inode, digest = entry
+	# repr() keeps the full precision of the modification time
+	return "%s\t%d\t%r\t%d\t%s\n" % (digest, size, mtime, inode, path)
+
+#_____________________________________________________________________
+
+def _GetStatKey(stat):
+	"""
+	Parameters:
+		stat -- the result of os.stat() for a file.
+
+	Returns:
+		the (size, modification time, inode) tuple which must be unchanged
+		for the remembered hash of the file to be used.
+	"""
+	return (stat.st_size, float(stat.st_mtime), stat.st_ino)
+
+#_____________________________________________________________________
+
+def _GetKey(path):
+	"""
+	Returns:
+		the absolute path of a file, as it is stored in the manifest.
+	"""
+	if isinstance(path, unicode):
+		path = path.encode("utf-8")
+	return os.path.abspath(path)
+
+#_____________________________________________________________________
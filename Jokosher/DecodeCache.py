@@ -0,0 +1,395 @@
+#
+#	THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#	THE 'COPYING' FILE FOR DETAILS
+#
+#	DecodeCache.py
+#
+#	This module keeps decoded copies of compressed audio files, such as
+#	Ogg Vorbis recordings and imported MP3s, in the user's data directory.
+#	Seeking in an uncompressed file does not decode from the nearest page
+#	again, and playing it takes hardly any CPU, so Events play the decoded
+#	copy of their file once it has been written. The copies are resampled
+#	to the sample rate of the Project, so that they do not have to be
+#	resampled while playing either. The copies are written in the
+#	background, one at a time, by pipelines which are not synchronised
+#	to a clock.
+#
+#-------------------------------------------------------------------------------
+
+import pygst
+pygst.require("0.10")
+import gst, gobject
+import os, hashlib, weakref
+import Globals
+import PlatformUtils
+from elements.singledecodebin import SingleDecodeBin
+
+""" The directory the decoded copies are kept in. """
+CACHE_PATH = os.path.join(Globals.JOKOSHER_DATA_HOME, "decodecache")
+
+""" The encoder of the decoded copies, which keeps the samples as they were decoded. """
+ENCODE_BIN = "audioconvert ! audio/x-raw-float, width=(int)32 ! wavenc"
+
+""" The resampler of the decoded copies, for when they are not kept at the rate of the file. """
+RESAMPLE_BIN = "audioconvert ! audioresample quality=10 ! audio/x-raw-float, rate=(int)%d ! "
+
+""" The extensions of files which are not compressed, and so are never copied. """
+UNCOMPRESSED_EXTENSIONS = (".wav", ".wave", ".aif", ".aiff", ".au", ".snd")
+
+_pending = []		# the (path, rate) of the files waiting to be decoded, in order
+_callbacks = {}		# the functions to call once a file is decoded, by (path, rate)
+_decoder = None		# the Decoder which is running
+_users = weakref.WeakKeyDictionary()	# the decoded copy each object plays, by object (see SetUsedFile())
+
+#_____________________________________________________________________
+
+def IsEnabled():
+	"""
+	Returns:
+		True if the cache is enabled in the settings.
+	"""
+	return Globals.settings.general["decodecache"] == "enabled"
+
+#_____________________________________________________________________
+
+def GetCachedFile(path, callback=None, rate=0, fileRate=0):
+	"""
+	Finds the decoded copy of an audio file, and starts decoding
+	the file in the background if it has no up to date copy yet.
+
+	Parameters:
+		path -- the absolute path of the audio file.
+		callback -- a function to call, with no parameters, once
+					the decoded copy has been written.
+		rate -- the sample rate to keep the copy at, or 0 to
+				keep it at the rate of the file.
+		fileRate -- the sample rate of the file, or 0 if it is not known.
+
+	Returns:
+		the path of the decoded copy, or path itself if the file does not
+		need to be copied or has not been decoded yet. An uncompressed file
+		is only copied when it is known to need resampling.
+	"""
+	if not IsEnabled():
+		return path
+	if os.path.splitext(path)[1].lower() in UNCOMPRESSED_EXTENSIONS:
+		if not rate or not fileRate or rate == fileRate:
+			return path
+
+	cached = GetCachePath(path, rate)
+	if not cached:
+		return path
+
+	if os.path.exists(cached):
+		try:
+			# remember when the copy was last used, for Trim()
+			os.utime(cached, None)
+		except OSError:
+			pass
+		return cached
+
+	Decode(path, callback, rate)
+	return path
+
+#_____________________________________________________________________
+
+def GetCachePath(path, rate=0):
+	"""
+	Parameters:
+		path -- the absolute path of an audio file.
+		rate -- the sample rate of the copy, or 0 for the rate of the file.
+
+	Returns:
+		the path the decoded copy of the file's current content is kept at,
+		or None if the file does not exist. Changing the file changes the
+		path, so an out of date copy is never used.
+	"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+
+	if isinstance(path, unicode):
+		path = path.encode("utf-8")
+	key = "%s\0%d\0%d" % (os.path.abspath(path), stat.st_size, int(stat.st_mtime))
+	if rate:
+		key += "\0%d" % rate
+	return os.path.join(CACHE_PATH, hashlib.sha1(key).hexdigest() + ".wav")
+
+#_____________________________________________________________________
+
+def Decode(path, callback=None, rate=0):
+	"""
+	Adds a file to the files waiting to be decoded.
+
+	Parameters:
+		path -- the absolute path of the audio file.
+		callback -- a function to call, with no parameters, once
+					the decoded copy has been written.
+		rate -- the sample rate to keep the copy at, or 0 to
+				keep it at the rate of the file.
+	"""
+	key = (path, rate)
+	if callback:
+		_callbacks.setdefault(key, []).append(callback)
+	if key not in _pending and not (_decoder and (_decoder.path, _decoder.rate) == key):
+		_pending.append(key)
+	_StartNext()
+
+#_____________________________________________________________________
+
+def Cancel():
+	"""
+	Stops decoding, and forgets the files waiting to be decoded
+	and the functions waiting for them.
+	"""
+	global _decoder
+	del _pending[:]
+	_callbacks.clear()
+	if _decoder:
+		decoder, _decoder = _decoder, None
+		decoder.Cancel()
+
+#_____________________________________________________________________
+
+def SetUsedFile(user, cached):
+	"""
+	Remembers which decoded copy an object, such as an Event, has set up
+	a source to play, so that Trim() does not delete it from under the source.
+
+	Parameters:
+		user -- the object playing the copy.
+		cached -- the path of the decoded copy, or None if the
+				object no longer plays a decoded copy.
+	"""
+	if cached:
+		_users[user] = cached
+	elif user in _users:
+		del _users[user]
+
+#_____________________________________________________________________
+
+def Trim(limit):
+	"""
+	Deletes the least recently used decoded copies, until
+	the cache takes no more than the given space. The copies
+	which are played by a source (see SetUsedFile()) are kept.
+
+	Parameters:
+		limit -- the number of bytes the cache may take.
+
+	Returns:
+		the number of bytes freed.
+	"""
+	if not os.path.isdir(CACHE_PATH):
+		return 0
+
+	used = set(_users.values())
+	files = []
+	for filename in os.listdir(CACHE_PATH):
+		path = os.path.join(CACHE_PATH, filename)
+		if filename.endswith(".wav") and os.path.isfile(path):
+			stat = os.stat(path)
+			files.append((stat.st_mtime, stat.st_size, path))
+	files.sort()
+
+	total = sum([x[1] for x in files])
+	freed = 0
+	for mtime, size, path in files:
+		if total - freed <= limit:
+			break
+		if path in used:
+			continue
+		Globals.debug("Removing decoded copy:", path)
+		os.remove(path)
+		freed += size
+
+	return freed
+
+#_____________________________________________________________________
+
+def _StartNext():
+	"""
+	Starts decoding the next waiting file, unless a file is being decoded.
+	"""
+	global _decoder
+	while not _decoder and _pending:
+		path, rate = _pending.pop(0)
+		cached = GetCachePath(path, rate)
+		if not cached or os.path.exists(cached):
+			_RunCallbacks(path, rate, bool(cached))
+			continue
+
+		if not os.path.isdir(CACHE_PATH):
+			os.makedirs(CACHE_PATH)
+		_decoder = Decoder(path, cached, _DecoderFinished, rate)
+		try:
+			_decoder.Start()
+		except gobject.GError, e:
+			Globals.debug("Cannot decode %s: %s" % (path, e))
+			_decoder = None
+			_RunCallbacks(path, rate, False)
+
+#_____________________________________________________________________
+
+def _DecoderFinished(decoder, success):
+	"""
+	Called when a Decoder has stopped.
+
+	Parameters:
+		decoder -- the Decoder.
+		success -- True if the decoded copy was written.
+	"""
+	global _decoder
+	if decoder is not _decoder:
+		# cancelled
+		return
+	_decoder = None
+
+	if success:
+		Trim(int(Globals.settings.general["decodecachesize"]) * 1024 * 1024)
+	_RunCallbacks(decoder.path, decoder.rate, success and os.path.exists(decoder.cached))
+	_StartNext()
+
+#_____________________________________________________________________
+
+def _RunCallbacks(path, rate, success):
+	"""
+	Calls the functions waiting for a file to be decoded.
+
+	Parameters:
+		path -- the absolute path of the audio file.
+		rate -- the sample rate of the copy, or 0 for the rate of the file.
+		success -- True if the decoded copy exists.
+	"""
+	callbacks = _callbacks.pop((path, rate), [])
+	if success:
+		for callback in callbacks:
+			callback()
+
+#=========================================================================
+
+class Decoder:
+	"""
+	Writes the decoded copy of one audio file.
+	"""
+
+	#_____________________________________________________________________
+
+	def __init__(self, path, cached, finishedCallback, rate=0):
+		"""
+		Creates a new Decoder. Nothing is decoded until Start() is called.
+
+		Parameters:
+			path -- the absolute path of the audio file.
+			cached -- the path to write the decoded copy to.
+			finishedCallback -- a function to call with the Decoder and True if
+								the copy was written, or False if it was not.
+			rate -- the sample rate to resample the copy to, or 0 to
+					keep the rate of the file.
+		"""
+		self.path = path
+		self.rate = rate
+		self.cached = cached
+		self.temp = cached + ".part"
+		self.finishedCallback = finishedCallback
+		self.pipeline = None
+		self.bus = None
+
+	#_____________________________________________________________________
+
+	def Start(self):
+		"""
+		Builds the pipeline and starts decoding.
+
+		Considerations:
+			Raises gobject.GError if the encoder cannot be created.
+		"""
+		description = ENCODE_BIN
+		if self.rate:
+			description = (RESAMPLE_BIN % self.rate) + description
+		encodebin = gst.parse_bin_from_description(description, True)
+		caps = gst.caps_from_string("audio/x-raw-int;audio/x-raw-float")
+		decodebin = SingleDecodeBin(caps=caps, uri=PlatformUtils.pathname2url(self.path))
+		filesink = gst.element_factory_make("filesink")
+		filesink.set_property("location", self.temp)
+		filesink.set_property("sync", False)
+
+		self.pipeline = gst.Pipeline("Decode")
+		self.pipeline.add(decodebin, encodebin, filesink)
+		encodebin.link(filesink)
+
+		def PadAddedCb(decodebin, pad):
+			pad.link(encodebin.get_pad("sink"))
+		decodebin.connect("pad-added", PadAddedCb)
+
+		self.bus = self.pipeline.get_bus()
+		self.bus.add_signal_watch()
+		self.bus.connect("message::eos", self.__BusEosCb)
+		self.bus.connect("message::error", self.__BusErrorCb)
+
+		Globals.debug("Decoding %s to %s" % (self.path, self.cached))
+		self.pipeline.set_state(gst.STATE_PLAYING)
+
+	#_____________________________________________________________________
+
+	def Cancel(self):
+		"""
+		Stops decoding and deletes the unfinished copy.
+		"""
+		if self.pipeline:
+			self.__Finish(False)
+
+	#_____________________________________________________________________
+
+	def __BusEosCb(self, bus, message):
+		"""
+		Moves the copy into place once the whole file has been decoded.
+
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		self.__Finish(True)
+
+	#_____________________________________________________________________
+
+	def __BusErrorCb(self, bus, message):
+		"""
+		Stops decoding when an element of the pipeline fails.
+
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		error, debug = message.parse_error()
+		Globals.debug("Decoding %s failed: %s\n%s" % (self.path, error, debug))
+		self.__Finish(False)
+
+	#_____________________________________________________________________
+
+	def __Finish(self, success):
+		"""
+		Disposes of the pipeline and calls the finished callback.
+
+		Parameters:
+			success -- True if the whole file was decoded.
+		"""
+		self.pipeline.set_state(gst.STATE_NULL)
+		self.bus.remove_signal_watch()
+		self.pipeline = self.bus = None
+
+		try:
+			if success:
+				os.rename(self.temp, self.cached)
+			elif os.path.exists(self.temp):
+				os.remove(self.temp)
+		except OSError, e:
+			Globals.debug("Cannot write decoded copy %s: %s" % (self.cached, e))
+			success = False
+
+		self.finishedCallback(self, success)
+
+	#_____________________________________________________________________
+
+#=========================================================================
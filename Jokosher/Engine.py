@@ -0,0 +1,207 @@
+#
+#	THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#	THE 'COPYING' FILE FOR DETAILS
+#
+#	Engine.py
+#
+#	This module contains the engines that a Project uses to process audio.
+#	The Project, Instruments and Events hold the timeline and all the edits
+#	made to it, while the engine decides whether and how it is played.
+#
+#-------------------------------------------------------------------------------
+
+import pygst
+pygst.require("0.10")
+import gst
+import Globals
+
+""" The caps the Instruments are mixed in, at the sample rate of their Project. """
+MIX_CAPS = "audio/x-raw-float,rate=%d,channels=2,width=32,endianness=(int)BYTE_ORDER"
+
+#=========================================================================
+
+class NullEngine:
+	"""
+	An engine which does not process any audio. A Project using it can be
+	edited, undone, saved and loaded like any other, but it cannot be played,
+	recorded or exported, and the levels of newly added files are not generated.
+	It is meant for tests and for tools which only work on project files,
+	since no pipeline or audio device is ever opened.
+	"""
+
+	""" True if this engine can play, record and export Projects. """
+	canProcessAudio = False
+
+	#_____________________________________________________________________
+
+	def CreateProjectPipeline(self, project):
+		"""
+		Creates the main pipeline of the given Project. This engine has
+		no pipeline, so the Project's GStreamer attributes are left as None.
+
+		Parameters:
+			project -- the Project to create the pipeline for.
+		"""
+		Globals.debug("Project is using the null engine, no pipeline is created")
+
+	#_____________________________________________________________________
+
+#=========================================================================
+
+class GStreamerEngine(NullEngine):
+	"""
+	The engine used for real playback, recording and exporting, through
+	a GStreamer pipeline.
+	"""
+
+	""" True if this engine can play, record and export Projects. """
+	canProcessAudio = True
+
+	#_____________________________________________________________________
+
+	def CreateProjectPipeline(self, project):
+		"""
+		Creates the main pipeline of the given Project: the adder which mixes
+		the Instruments, the master level, the audio sink and the click track.
+		The Instruments are only added to it by Project.BuildPipeline().
+
+		Parameters:
+			project -- the Project to create the pipeline for.
+		"""
+		# CREATE GSTREAMER ELEMENTS AND SET PROPERTIES #
+		project.mainpipeline = gst.Pipeline("timeline")
+		project.playbackbin = gst.Bin("playbackbin")
+		project.adder = gst.element_factory_make("adder")
+		project.postAdderConvert = gst.element_factory_make("audioconvert")
+		project.masterSink = project.MakeProjectSink()
+
+		project.levelElement = gst.element_factory_make("level", "MasterLevel")
+		project.levelElement.set_property("interval", gst.SECOND / 50)
+		project.levelElement.set_property("message", True)
+
+		#Restrict adder's output caps due to adder bug 341431
+		project.levelElementCaps = gst.element_factory_make("capsfilter", "levelcaps")
+		caps = gst.caps_from_string(MIX_CAPS % project.sampleRate)
+		project.levelElementCaps.set_property("caps", caps)
+
+		# ADD ELEMENTS TO THE PIPELINE AND/OR THEIR BINS #
+		project.mainpipeline.add(project.playbackbin)
+		Globals.debug("added project playback bin to the pipeline")
+		for element in [project.adder, project.levelElementCaps, project.postAdderConvert, project.levelElement, project.masterSink]:
+			project.playbackbin.add(element)
+			Globals.debug("added %s to project playbackbin" % element.get_name())
+
+		# LINK GSTREAMER ELEMENTS #
+		project.adder.link(project.levelElementCaps)
+		project.levelElementCaps.link(project.postAdderConvert)
+		project.postAdderConvert.link(project.levelElement)
+		project.levelElement.link(project.masterSink)
+
+		# CONSTRUCT CLICK TRACK BIN #
+		project.clickTrackBin = gst.Bin("Click_Track_Bin")
+		project.clickTrackAudioSrc = gst.element_factory_make("audiotestsrc", "Click_Track_AudioSource")
+		project.clickTrackAudioSrc.set_property("wave", 3)
+		project.clickTrackVolume = gst.element_factory_make("volume", "Click_Track_Volume")
+		project.clickTrackVolume.set_property("mute", True)
+		project.clickTrackConvert = gst.element_factory_make("audioconvert", "Click_Track_Audioconvert")
+
+		project.playbackbin.add(project.clickTrackBin)
+		for element in [project.clickTrackAudioSrc, project.clickTrackVolume, project.clickTrackConvert]:
+			project.clickTrackBin.add(element)
+
+		clickTrackSrc = gst.GhostPad("src", project.clickTrackConvert.get_pad("src"))
+		project.clickTrackBin.add_pad(clickTrackSrc)
+		project.clickTrackController = gst.Controller(project.clickTrackAudioSrc, "volume")
+
+		project.clickTrackAudioSrc.link(project.clickTrackVolume)
+		project.clickTrackVolume.link(project.clickTrackConvert)
+		project.clickTrackBin.link(project.adder)
+
+		project.bus = project.mainpipeline.get_bus()
+		project.bus.add_signal_watch()
+
+	#_____________________________________________________________________
+
+#=========================================================================
+
+def MakeMixQueue(offline=False):
+	"""
+	Creates the queue between an Instrument and the adder which mixes it.
+	The queue starts a streaming thread, so the effects of each Instrument
+	are processed on a thread of their own rather than on the thread which
+	happens to be mixing.
+
+	Parameters:
+		offline -- True for a pipeline which renders to a file (see OfflineRender),
+				where the queue is sized for throughput rather than latency.
+
+	Returns:
+		the queue, or None if the "mixqueues" setting is disabled.
+	"""
+	if Globals.settings.general["mixqueues"] != "enabled":
+		return None
+	return _MakeQueue(offline)
+
+#_____________________________________________________________________
+
+def GetMixBusCount():
+	"""
+	Returns:
+		the number of buses the Instruments are shared between and mixed in
+		before the final mix, or 0 if they are all mixed at once.
+	"""
+	return max(0, int(Globals.settings.general["mixbuses"]))
+
+#_____________________________________________________________________
+
+def MakeMixBus(bin, output, rate, offline=False):
+	"""
+	Creates a bus which mixes some of the Instruments before they are mixed with
+	the others. Each bus has a queue, so the buses mix on threads of their own.
+
+	Parameters:
+		bin -- the bin to add the elements of the bus to.
+		output -- the adder which mixes the bus.
+		rate -- the sample rate of the Project's mix.
+		offline -- True for a pipeline which renders to a file (see OfflineRender).
+
+	Returns:
+		the list of the elements of the bus. The first one is the adder
+		which the Instruments of the bus are linked to.
+	"""
+	adder = gst.element_factory_make("adder")
+	#Restrict adder's output caps due to adder bug 341431
+	caps = gst.element_factory_make("capsfilter")
+	caps.set_property("caps", gst.caps_from_string(MIX_CAPS % rate))
+	elements = [adder, caps, _MakeQueue(offline)]
+
+	for element in elements:
+		bin.add(element)
+	gst.element_link_many(*(elements + [output]))
+	return elements
+
+#_____________________________________________________________________
+
+def _MakeQueue(offline):
+	"""
+	Creates a queue limited only by the time of the audio in it.
+
+	Parameters:
+		offline -- True to use the "mixqueueoffline" setting,
+				False to use the "mixqueuelive" setting.
+
+	Returns:
+		the queue.
+	"""
+	if offline:
+		milliseconds = int(Globals.settings.general["mixqueueoffline"])
+	else:
+		milliseconds = int(Globals.settings.general["mixqueuelive"])
+
+	queue = gst.element_factory_make("queue")
+	queue.set_property("max-size-buffers", 0)
+	queue.set_property("max-size-bytes", 0)
+	queue.set_property("max-size-time", milliseconds * gst.MSECOND)
+	return queue
+
+#_____________________________________________________________________
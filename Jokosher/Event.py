@@ -23,6 +23,7 @@ import Globals
 import gettext
 import urllib
 import PlatformUtils
+import DecodeCache
 
 from elements.singledecodebin import SingleDecodeBin
 _ = gettext.gettext
@@ -112,6 +113,10 @@ class Event(gobject.GObject):
 		self.lastEnd = 0 			# The last length of the loading file - used to minimise redraws
 		self.loadingPipeline = None	# The Gstreamer pipeline used to load the waveform
 		self.bus = None			# The bus to monitor messages on the loadingPipeline
+		self.reportedEnd = 0.0		# The end time in seconds last reported to the Project's cached length
+		self.releasedLevelsFile = None	# The file to reload the levels from, while this Event is in the graveyard
+		self.sampleRate = 0			# The sample rate of the file, or 0 if it is not known yet
+		self.playbackRate = None	# The sample rate of the decoded copy being played instead of the file, if there is one (see DecodeCache)
 		
 		self.CreateFilesource()
 
@@ -154,11 +159,22 @@ class Event(gobject.GObject):
 		Creates a new GStreamer file source with an unique id.
 		It then calls SetProperties() to populate the new object's
 		properties.
+		
+		Considerations:
+			The file source is only created once the Instrument has built
+			its pipeline (see Instrument.BuildPipeline()). While the Instrument
+			plays its frozen file, the file source is kept out of the
+			composition, and added when the Instrument is unfrozen.
 		"""
+		if self.instrument.composition is None:
+			self.SetProperties()
+			return
+		
 		Globals.debug("create file source")
 		if not self.gnlsrc:
 			self.gnlsrc = gst.element_factory_make("gnlsource", "Event_%d"%self.id)
-		if not self.gnlsrc in list(self.instrument.composition.elements()):
+		if self.gnlsrc.get_parent() is not self.instrument.composition and \
+				not self.instrument.frozenSource:
 			self.instrument.composition.add(self.gnlsrc)
 		
 		self.SetProperties()
@@ -169,39 +185,189 @@ class Event(gobject.GObject):
 		"""
 		Removes the Gstreamer file source from the instrument's composition.
 		"""
-		if self.gnlsrc in list(self.instrument.composition.elements()):
+		if self.gnlsrc and self.gnlsrc.get_parent() is self.instrument.composition:
 			self.instrument.composition.remove(self.gnlsrc)
 		
 	#_____________________________________________________________________
+	
+	def ReleaseResources(self, spillLevels=True):
+		"""
+		Frees the GStreamer objects and the levels of this Event, once it has
+		been moved to the graveyard. Only its parameters and fade points are
+		kept, and RestoreResources() brings the rest back if it is resurrected.
+		
+		Parameters:
+			spillLevels -- True to write the levels to a temporary file in the
+					levels directory first. False if the levels file of this
+					Event is known to match its levels, which is the case for
+					Events which have not changed since the Project was loaded.
+		"""
+		self.DestroyFilesource()
+		if self.single_decode_bin:
+			self.single_decode_bin.set_state(gst.STATE_NULL)
+			self.single_decode_bin = None
+		if self.gnlsrc:
+			self.gnlsrc.set_state(gst.STATE_NULL)
+			self.gnlsrc = None
+		DecodeCache.SetUsedFile(self, None)
+		
+		if self.levels_list and not self.isLoading:
+			if spillLevels:
+				# the levels file may be older than the levels in memory, and belongs to the saved Project
+				path = os.path.join(self.instrument.project.levels_path, self.levels_file + ".graveyard")
+				try:
+					self.levels_list.tofile(path)
+				except (IOError, OSError), e:
+					Globals.debug("Cannot write the levels of a deleted event, keeping them in memory:", e)
+					return
+				self.instrument.project.deleteOnCloseAudioFiles.append(path)
+			else:
+				path = self.GetAbsLevelsFile()
+			self.releasedLevelsFile = path
+		
+		self.levels_list = LevelsList.LevelsList()
+		self.fadeLevels = LevelsList.LevelsList()
+	
+	#_____________________________________________________________________
+	
+	def RestoreResources(self):
+		"""
+		Reloads the levels freed by ReleaseResources() when this Event is brought
+		back from the graveyard. The GStreamer objects are created again by
+		CreateFilesource(), and the levels are generated again if they cannot be read.
+		"""
+		path = self.releasedLevelsFile
+		if not path:
+			return
+		self.releasedLevelsFile = None
+		
+		try:
+			self.levels_list.fromfile(path)
+		except (IOError, OSError, LevelsList.CorruptFileError), e:
+			Globals.debug("Cannot reload the levels of event", self.id, e)
+			self.levels_list = LevelsList.LevelsList()
+		
+		del_on_close_list = self.instrument.project.deleteOnCloseAudioFiles
+		if path in del_on_close_list:
+			del_on_close_list.remove(path)
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		
+		self.__UpdateAudioFadePoints()
+	
+	#_____________________________________________________________________
 		
 	def SetProperties(self):
 		"""
 		Sets basic Event properties like location, start, duration, etc.
+		
+		Considerations:
+			During an edit transaction (see Project.BeginUpdate()) this is
+			deferred until the transaction ends.
 		"""
-		if self.file:
+		if self.instrument.project.DeferSetProperties(self):
+			return
+		
+		if self.file and self.gnlsrc:
 			if self.single_decode_bin:
 				self.gnlsrc.remove(self.single_decode_bin)
 				self.single_decode_bin.set_state(gst.STATE_NULL)
 
-			Globals.debug("creating SingleDecodeBin")
-			caps = gst.caps_from_string("audio/x-raw-int;audio/x-raw-float")
-			f = PlatformUtils.pathname2url(self.GetAbsFile())
-			Globals.debug("file uri is:", f)
-			self.single_decode_bin = SingleDecodeBin(caps=caps, uri=f)
-			self.gnlsrc.add(self.single_decode_bin)
-			Globals.debug("setting event properties:")
-			propsDict = {
-					"caps" : caps,
-					"start" : long(self.start * gst.SECOND),
-					"duration" : long(self.duration * gst.SECOND),
-					"media-start" : long(self.offset * gst.SECOND),
-					"media-duration" : long(self.duration * gst.SECOND),
-					"priority" : 2
-					}
-					
-			for prop, value in propsDict.iteritems():
-				self.gnlsrc.set_property(prop, value)
-				Globals.debug("\t", prop, "=", value)
+			self.single_decode_bin = self.ConfigureSource(self.gnlsrc)
+		
+		self.UpdateProjectLength()
+	
+	#_____________________________________________________________________
+	
+	def ConfigureSource(self, gnlsrc):
+		"""
+		Adds a decoder for the file of this Event to a gnlsource, and
+		places the gnlsource where this Event is in its composition.
+		The decoded copy of the file, which is resampled to the rate of
+		the Project, is played instead if there is one (see DecodeCache).
+		
+		Parameters:
+			gnlsrc -- the gnlsource to set up.
+			
+		Returns:
+			the SingleDecodeBin added to gnlsrc.
+		"""
+		Globals.debug("creating SingleDecodeBin")
+		caps = gst.caps_from_string("audio/x-raw-int;audio/x-raw-float")
+		path = self.GetAbsFile()
+		self.playbackRate = None
+		if not self.isRecording and not self.isDownloading:
+			rate = self.instrument.project.sampleRate
+			cached = DecodeCache.GetCachedFile(path, self.__DecodeCacheCb, rate, self.sampleRate)
+			if cached != path:
+				path = cached
+				self.playbackRate = rate
+		# the cache must not delete a copy this source is going to open
+		DecodeCache.SetUsedFile(self, self.playbackRate and path)
+		f = PlatformUtils.pathname2url(path)
+		Globals.debug("file uri is:", f)
+		decodeBin = SingleDecodeBin(caps=caps, uri=f)
+		gnlsrc.add(decodeBin)
+		Globals.debug("setting event properties:")
+		propsDict = {
+				"caps" : caps,
+				"start" : long(self.start * gst.SECOND),
+				"duration" : long(self.duration * gst.SECOND),
+				"media-start" : long(self.offset * gst.SECOND),
+				"media-duration" : long(self.duration * gst.SECOND),
+				"priority" : 2
+				}
+				
+		for prop, value in propsDict.iteritems():
+			gnlsrc.set_property(prop, value)
+			Globals.debug("\t", prop, "=", value)
+		
+		return decodeBin
+	
+	#_____________________________________________________________________
+	
+	def GetPlaybackRate(self):
+		"""
+		Returns:
+			the sample rate of the audio this Event plays,
+			or 0 if it is not known yet.
+		"""
+		if self.playbackRate:
+			return self.playbackRate
+		return self.sampleRate
+	
+	#_____________________________________________________________________
+	
+	def __DecodeCacheCb(self):
+		"""
+		Called once the decoded copy of this Event's file has been written,
+		to play the copy from now on. While the Project is playing, the copy
+		is played the next time the Event's source is set up instead.
+		"""
+		if self.gnlsrc and self in self.instrument.events and \
+				not self.instrument.project.GetIsPlaying():
+			self.SetProperties()
+	
+	#_____________________________________________________________________
+	
+	def UpdateProjectLength(self, removed=False):
+		"""
+		Reports the end time of this Event to the Project, so that the cached
+		Project length and the Instrument compositions follow changes to this Event.
+		
+		Parameters:
+			removed -- True if this Event is no longer part of the Project.
+		"""
+		if removed:
+			end = 0.0
+		else:
+			end = self.start + max(self.duration, self.loadingLength)
+		
+		if end != self.reportedEnd:
+			self.instrument.project.UpdateProjectLength(self.reportedEnd, end)
+			self.reportedEnd = end
 
 	#_____________________________________________________________________
 
@@ -216,36 +382,69 @@ class Event(gobject.GObject):
 			graveyard -- True if this Event is on the graveyard stack,
 						and should be serialized as a dead Event.
 		"""
-		if graveyard:
-			ev = doc.createElement("DeadEvent")
-		else:
-			ev = doc.createElement("Event")
-		parent.appendChild(ev)
-		ev.setAttribute("id", str(self.id))
+		Event.StoreSnapshotToXML(doc, parent, self.GetSnapshot(graveyard))
 		
-		params = doc.createElement("Parameters")
-		ev.appendChild(params)
+	#_____________________________________________________________________
+	
+	def GetSnapshot(self, graveyard=False):
+		"""
+		Copies what StoreToXML() saves, so that it can be serialized later,
+		on another thread, while this Event goes on changing.
 		
+		Parameters:
+			graveyard -- True if this Event is on the graveyard stack,
+						and should be serialized as a dead Event.
+						
+		Returns:
+			a dictionary to pass to StoreSnapshotToXML().
+		"""
 		items = ["start", "duration", "isSelected", 
 				  "name", "offset", "file", "filelabel", "levels_file",
-				  "isLoading", "isRecording"
+				  "isLoading", "isRecording", "sampleRate"
 				]
 				
 		#Since we are saving the path to the project file, don't delete it on exit
 		if self.GetAbsFile() in self.instrument.project.deleteOnCloseAudioFiles:
 			self.instrument.project.deleteOnCloseAudioFiles.remove(self.GetAbsFile())
 		
-		Utils.StoreParametersToXML(self, doc, params, items)		
-		
-		xmlPoints = doc.createElement("FadePoints")
-		ev.appendChild(xmlPoints)
-		Utils.StoreDictionaryToXML(doc, xmlPoints, self.__fadePointsDict, "FadePoint")
-		
 		if self.levels_list:
 			self.levels_list.tofile(self.GetAbsLevelsFile())
 		if self.GetAbsLevelsFile() in self.instrument.project.deleteOnCloseAudioFiles:
 			self.instrument.project.deleteOnCloseAudioFiles.remove(self.GetAbsLevelsFile())
 		
+		return {"id" : self.id,
+				"graveyard" : graveyard,
+				"parameters" : Utils.CopyParameters(self, items),
+				"fadePoints" : self.__fadePointsDict.copy()}
+		
+	#_____________________________________________________________________
+	
+	@staticmethod
+	def StoreSnapshotToXML(doc, parent, snapshot):
+		"""
+		Converts an Event snapshot into an XML representation suitable for saving to a file.
+		
+		Parameters:
+			doc -- the XML document object the Event will be saved to.
+			parent -- the parent node that the serialized Event should
+						be added to.
+			snapshot -- the dictionary returned by GetSnapshot().
+		"""
+		if snapshot["graveyard"]:
+			ev = doc.createElement("DeadEvent")
+		else:
+			ev = doc.createElement("Event")
+		parent.appendChild(ev)
+		ev.setAttribute("id", str(snapshot["id"]))
+		
+		params = doc.createElement("Parameters")
+		ev.appendChild(params)
+		Utils.StoreParameterValuesToXML(doc, params, snapshot["parameters"])
+		
+		xmlPoints = doc.createElement("FadePoints")
+		ev.appendChild(xmlPoints)
+		Utils.StoreDictionaryToXML(doc, xmlPoints, snapshot["fadePoints"], "FadePoint")
+		
 	#_____________________________________________________________________
 		
 	def __repr__(self):
@@ -260,6 +459,16 @@ class Event(gobject.GObject):
 		
 	#_____________________________________________________________________
 	
+	def emit(self, signal, *args):
+		"""
+		Emits the given signal, unless an edit transaction is in progress,
+		in which case it is emitted when the transaction ends.
+		"""
+		if not self.instrument.project.DeferSignal(self, signal, args):
+			gobject.GObject.emit(self, signal, *args)
+	
+	#_____________________________________________________________________
+	
 	def __cmp__(self, object):
 		"""
 		Compares two Events for equality.
@@ -277,7 +486,28 @@ class Event(gobject.GObject):
 	
 	#_____________________________________________________________________
 	
-	@UndoSystem.UndoCommand("Move", "temp")
+	def __GetStart(self):
+		return self.__dict__.get("_Event__start", 0.0)
+	
+	def __SetStart(self, start):
+		"""
+		Changes the time in seconds at which this Event begins, and
+		moves it in its Instrument's index (see Instrument.GetEventsInRange()).
+		
+		Parameters:
+			start -- the new start time in seconds.
+		"""
+		old = self.__GetStart()
+		self.__start = start
+		instrument = self.__dict__.get("instrument")
+		if instrument is not None and start != old and instrument.RemoveFromEventIndex(self, old):
+			instrument.AddToEventIndex(self)
+	
+	start = property(__GetStart, __SetStart)
+	
+	#_____________________________________________________________________
+	
+	@UndoSystem.UndoCommand("Move", "temp", merge=True)
 	def Move(self, to, frm=None):
 		"""
 		Moves this Event in time.
@@ -396,6 +626,28 @@ class Event(gobject.GObject):
 					help prevent the creation of multiple garbage copies of the
 					same event each time a split is undone and redone.
 					
+		Returns:
+			the newly created event.
+		"""
+		project = self.instrument.project
+		project.BeginUpdate()
+		try:
+			e = self.__SplitEvent(split_point, cutRightSide, eventID)
+		finally:
+			project.EndUpdate()
+		
+		#undo parameters
+		self.temp = e.id
+		self.temp2 = cutRightSide
+		
+		return e
+	
+	#_____________________________________________________________________
+	
+	def __SplitEvent(self, split_point, cutRightSide, eventID):
+		"""
+		Does the actual work for SplitEvent(), which takes the same parameters.
+		
 		Returns:
 			the newly created event.
 		"""
@@ -458,10 +710,6 @@ class Event(gobject.GObject):
 		self.emit("position")
 		self.instrument.emit("event::added", e)
 		
-		#undo parameters
-		self.temp = e.id
-		self.temp2 = cutRightSide
-		
 		return e
 		
 	#_____________________________________________________________________
@@ -540,23 +788,28 @@ class Event(gobject.GObject):
 			#both points must not be right at the edges, or there is nothing to split
 			return
 			
-		undoAction = self.instrument.project.NewAtomicUndoAction()
-
-		if 0 < start_split < self.duration:
-			# Split off the left section of the event
-			leftSplit = self.SplitEvent(start_split, False, _undoAction_=undoAction)
-			self.instrument.DeleteEvent(leftSplit.id, _undoAction_=undoAction)
+		project = self.instrument.project
+		undoAction = project.NewAtomicUndoAction()
 		
-		#Adjust the end_split value since splitting the left has changed self.duration
-		end_split = end_split - start_split
-		
-		if 0 < end_split < self.duration:
-			# Split off the right section of the event
-			rightSplit = self.SplitEvent(end_split, _undoAction_=undoAction)
-			self.instrument.DeleteEvent(rightSplit.id, _undoAction_=undoAction)
-		
-		self.SetProperties()
-		self.emit("length")
+		project.BeginUpdate()
+		try:
+			if 0 < start_split < self.duration:
+				# Split off the left section of the event
+				leftSplit = self.SplitEvent(start_split, False, _undoAction_=undoAction)
+				self.instrument.DeleteEvent(leftSplit.id, _undoAction_=undoAction)
+			
+			#Adjust the end_split value since splitting the left has changed self.duration
+			end_split = end_split - start_split
+			
+			if 0 < end_split < self.duration:
+				# Split off the right section of the event
+				rightSplit = self.SplitEvent(end_split, _undoAction_=undoAction)
+				self.instrument.DeleteEvent(rightSplit.id, _undoAction_=undoAction)
+			
+			self.SetProperties()
+			self.emit("length")
+		finally:
+			project.EndUpdate()
 		
 	#_____________________________________________________________________
 	
@@ -658,6 +911,7 @@ class Event(gobject.GObject):
 			# Only send events every second processed to reduce GUI load
 			if self.loadingLength != self.lastEnd:
 				self.lastEnd = self.loadingLength 
+				self.UpdateProjectLength()
 				self.emit("length") # tell the GUI
 		return True
 		
@@ -704,6 +958,11 @@ class Event(gobject.GObject):
 				stoptime = int((self.offset + self.duration) * 1000)
 				self.levels_list = self.levels_list.slice_by_endtime(starttime, stoptime)
 				
+			# remember the rate of the file, so that it is only resampled when it has to be
+			caps = self.loadingPipeline.get_by_name("level_element").get_pad("sink").get_negotiated_caps()
+			if caps:
+				self.sampleRate = caps[0]["rate"]
+			
 			# We're done with the bin so release it
 			self.StopGenerateWaveform()
 			
@@ -786,7 +1045,13 @@ class Event(gobject.GObject):
 	def GenerateWaveform(self):
 		"""
 		Renders the level information for the GUI.
+		
+		Considerations:
+			Nothing is done if the Project's engine cannot process audio.
 		"""
+		if not self.instrument.project.engine.canProcessAudio:
+			return
+		
 		pipe = """filesrc name=src ! decodebin ! audioconvert ! level message=true name=level_element ! fakesink"""
 		self.loadingPipeline = gst.parse_launch(pipe)
 		
@@ -891,6 +1156,7 @@ class Event(gobject.GObject):
 			
 			self.loadingPipeline = None
 			self.loadingLength = 0
+			self.UpdateProjectLength()
 			self.emit("loading")
 	
 	#_____________________________________________________________________
@@ -923,6 +1189,8 @@ class Event(gobject.GObject):
 			# Only send events every second processed to reduce GUI load
 			if self.loadingLength != self.lastEnd:
 				self.lastEnd = self.loadingLength 
+				# grows the compositions of the other instruments as the recording gets longer
+				self.UpdateProjectLength()
 				self.emit("length") # tell the GUI
 		return True
 		
@@ -924,6 +924,27 @@ class ExtensionAPI:
 		
 	#_____________________________________________________________________
 	
+	@exported_function
+	def get_sample_rate(self):
+		"""
+		Returns the sample rate the Project is mixed, recorded and exported at.
+		"""
+		return self.mainapp.project.sampleRate
+		
+	#_____________________________________________________________________
+	
+	@exported_function
+	def set_sample_rate(self, rate):
+		"""
+		Sets the sample rate the Project is mixed, recorded and exported at.
+		
+		Parameters:
+			rate -- the sample rate in Hz.
+		"""
+		self.mainapp.project.SetSampleRate(int(rate))
+		
+	#_____________________________________________________________________
+	
 	@exported_function
 	def get_meter(self):
 		"""
@@ -1040,15 +1061,24 @@ class ExtensionAPI:
 	#____________________________________________________________________	
 
 	@exported_function
-	def seek(self, start_position, end_position=0):
+	def seek(self, start_position, end_position=0, loop=False):
 		"""
 		Performs a seek on the pipeline
 		
 		Parameters:
 			start_position -- position to seek to
 			end_position -- position where playing will stop
-		"""
-		self.mainapp.project.transport.SeekTo(start_position, end_position)
+			loop -- True to play from start_position to end_position over and
+					over, without gaps, until the loop is cleared by a seek without
+					loop set to True
+		"""
+		transport = self.mainapp.project.transport
+		if loop:
+			transport.SetLoop(start_position, end_position)
+			transport.SeekTo(start_position)
+		else:
+			transport.ClearLoop()
+			transport.SeekTo(start_position, end_position)
 		
 	#____________________________________________________________________	
 
@@ -41,6 +41,23 @@ class Settings:
 				"addinstrumentwindowwidth" : 300,
 				"instrumenteffectwindowheight" : 450,				
 				"instrumenteffectwindowwidth" : 650,
+				"projectcompression" : 6, # gzip level of saved project files, from 1 (fastest) to 9 (smallest)
+				"journalsync" : "batch", # when the .incremental file is synced to disk: "always", "batch" or "never"
+				"journalinterval" : 500, # milliseconds an incremental save may wait to be written with the next ones
+				"journalcheckpoint" : 1000, # number of incremental saves after which the .incremental file is compacted
+				"audiopool" : "enabled", # "enabled" to store imported audio files once for all projects, or "disabled"
+				"importthreads" : 4, # number of files copied at the same time when importing a project
+				"exportthreads" : 4, # number of files rendered at the same time when exporting stems
+				"decodecache" : "disabled", # "enabled" to play compressed audio files from decoded copies, or "disabled"
+				"decodecachesize" : 4096, # megabytes the decoded copies of compressed audio files may take
+				"scrubseek" : "keyunit", # "keyunit" for fast, inexact seeks while dragging the playhead, or "accurate"
+				"mixqueues" : "enabled", # "enabled" to process each instrument on a thread of its own, or "disabled"
+				"mixbuses" : 0, # number of buses the instruments are shared between and mixed in first, or 0 for none
+				"mixqueuelive" : 40, # milliseconds of audio queued after each instrument and bus while playing
+				"mixqueueoffline" : 1000, # milliseconds of audio queued after each instrument and bus while exporting
+				"undolimit" : 500, # number of undo actions kept in memory, older ones are moved to disk
+				"undomemory" : 4194304, # bytes of undo actions kept in memory, older ones are moved to disk
+				"undomergewindow" : 1000, # milliseconds within which repeated edits of one value are undone together
 				
 				}
 
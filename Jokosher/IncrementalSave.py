@@ -1,7 +1,10 @@
 
 import Event
 import Utils
-import os.path
+import Globals
+import os, os.path
+import struct, zlib
+import gobject
 import xml.dom.minidom as xml
 
 import gettext
@@ -48,8 +51,10 @@ class NewEvent:
 	
 	@staticmethod
 	def LoadFromString(string):
-		doc = xml.parseString(string)
-		node = doc.firstChild
+		return NewEvent.LoadFromNode(xml.parseString(string).firstChild)
+	
+	@staticmethod
+	def LoadFromNode(node):
 		assert node.nodeName == "NewEvent"
 		
 		instr_id = int(node.getAttribute("instrument_id"))
@@ -92,8 +97,10 @@ class StartDownload:
 	
 	@staticmethod
 	def LoadFromString(string):
-		doc = xml.parseString(string)
-		node = doc.firstChild
+		return StartDownload.LoadFromNode(xml.parseString(string).firstChild)
+	
+	@staticmethod
+	def LoadFromNode(node):
 		assert node.nodeName == "StartDownload"
 		
 		instr_id = int(node.getAttribute("instrument_id"))
@@ -127,8 +134,10 @@ class CompleteLoading:
 	
 	@staticmethod
 	def LoadFromString(string):
-		doc = xml.parseString(string)
-		node = doc.firstChild
+		return CompleteLoading.LoadFromNode(xml.parseString(string).firstChild)
+	
+	@staticmethod
+	def LoadFromNode(node):
 		assert node.nodeName == "CompleteLoading"
 		
 		id = int(node.getAttribute("event_id"))
@@ -208,8 +217,10 @@ class Action:
 				
 	@staticmethod
 	def LoadFromString(string):
-		doc = xml.parseString(string)
-		actionNode = doc.firstChild
+		return Action.LoadFromNode(xml.parseString(string).firstChild)
+	
+	@staticmethod
+	def LoadFromNode(actionNode):
 		assert actionNode.nodeName == "Action"
 		
 		function_name = actionNode.getAttribute("function")
@@ -248,8 +259,10 @@ class SetNotes:
 	
 	@staticmethod
 	def LoadFromString(string):
-		doc = xml.parseString(string)
-		node = doc.firstChild
+		return SetNotes.LoadFromNode(xml.parseString(string).firstChild)
+	
+	@staticmethod
+	def LoadFromNode(node):
 		assert node.nodeName == "SetNotes"
 		
 		notes = Utils.StringUnRepr(node.getAttribute("notes"))
@@ -265,6 +278,9 @@ def Undo():
 def Redo():
 	return Action("P", "Redo", tuple(), dict())
 
+def MergeLastUndoActions():
+	return Action("P", "MergeLastUndoActions", tuple(), dict())
+
 def SetName(name):
 	return Action("P", "SetName", (name,), dict())
 
@@ -280,8 +296,7 @@ def InstrumentSetVolume(id, volume):
 #=========================================================================
 
 def LoadFromString(string):
-	doc = xml.parseString(string)
-	node = doc.firstChild.nodeName
+	node = xml.parseString(string).firstChild
 	
 	action_dict = {
 		"Action" : Action,
@@ -291,10 +306,11 @@ def LoadFromString(string):
 		"SetNotes" : SetNotes,
 	}
 	
-	if node in action_dict:
-		return action_dict[node].LoadFromString(string)
+	if node.nodeName in action_dict:
+		# parse the string only once, instead of again in the class
+		return action_dict[node.nodeName].LoadFromNode(node)
 	
-	raise AssertionError("Unknown IncrementalSave node " + node)
+	raise AssertionError("Unknown IncrementalSave node " + node.nodeName)
 	
 #=========================================================================
 
@@ -319,6 +335,256 @@ def FilterAndExecuteAll(save_action_list, project):
 			
 #=========================================================================
 
+""" Actions which set a value outside of the undo history, so only the last of them for each object counts """
+SUPERSEDED_ACTIONS = (("P", "SetName"), ("P", "SetAuthor"), ("I", "SetVolume"), ("I", "SetInput"))
+
+def Compact(records):
+	"""
+	Removes the actions which have no effect on the restored Project:
+	an Undo immediately followed by a Redo, and all but the last
+	SetNotes, and all but the last of each of SUPERSEDED_ACTIONS
+	on the same object.
+	
+	Parameters:
+		records -- a list of (string, action) tuples, with each action
+				and the string it was loaded from, in journal order.
+				
+	Returns:
+		the list of the tuples which have to be kept, in the same order.
+	"""
+	kept = []
+	for record in records:
+		action = record[1]
+		if isinstance(action, Action) and action.objectString == "P" and action.func_name == "Redo" \
+				and kept and isinstance(kept[-1][1], Action) \
+				and kept[-1][1].objectString == "P" and kept[-1][1].func_name == "Undo":
+			kept.pop()
+		else:
+			kept.append(record)
+	
+	superseded = set()
+	compacted = []
+	for record in reversed(kept):
+		action = record[1]
+		if isinstance(action, SetNotes):
+			key = "SetNotes"
+		elif isinstance(action, Action) and (action.objectString[0], action.func_name) in SUPERSEDED_ACTIONS:
+			key = (action.objectString, action.func_name)
+		else:
+			key = None
+		
+		if key is not None:
+			if key in superseded:
+				continue
+			superseded.add(key)
+		compacted.append(record)
+	
+	compacted.reverse()
+	return compacted
+
+#=========================================================================
+
+class Journal:
+	"""
+	The .incremental file of a Project, which logs every change made since the
+	Project was last saved, so that they can be replayed after a crash.
+	
+	Considerations:
+		The file starts with MAGIC, followed by one record per action: its
+		length and CRC32 as two big endian 32 bit integers, then the action as
+		returned by StoreToString(), in UTF-8. A record which was only partly
+		written when Jokosher crashed fails its CRC, and ends the journal.
+		
+		Records are written in batches. How often the file is synced to disk is
+		set by the "journalsync" setting: "always" writes and syncs each record
+		as it comes, "batch" writes and syncs the records at most "journalinterval"
+		milliseconds after the first of them, and "never" does the same without
+		syncing, leaving it to the operating system.
+	"""
+	
+	""" The first bytes of a journal file, to tell it apart from the old delimited format """
+	MAGIC = "JOKOSHER-JOURNAL 1\n"
+	""" The length and CRC32 in front of every record """
+	RECORD_HEADER = struct.Struct(">II")
+	""" The number of bytes of pending records which is written without waiting """
+	BATCH_SIZE = 65536
+	""" The separator of the actions in .incremental files written before the journal format """
+	OLD_DELIMITER = "\n<<delimiter>>\n"
+	
+	#_____________________________________________________________________
+	
+	def __init__(self, filename):
+		"""
+		Creates a new Journal. The file is only created, replacing any old
+		one, when the first record is written.
+		
+		Parameters:
+			filename -- the path of the .incremental file.
+		"""
+		self.filename = filename
+		self.file = None
+		self.pending = []
+		self.pendingSize = 0
+		self.timeout = None
+		self.appended = 0	#number of records added since the file was last rewritten
+	
+	#_____________________________________________________________________
+	
+	def Append(self, string):
+		"""
+		Adds a record to the journal.
+		
+		Parameters:
+			string -- the serialized action, as returned by StoreToString().
+		"""
+		if isinstance(string, unicode):
+			string = string.encode("utf-8")
+		header = self.RECORD_HEADER.pack(len(string), zlib.crc32(string) & 0xffffffff)
+		self.pending.append(header + string)
+		self.pendingSize += len(header) + len(string)
+		self.appended += 1
+		
+		if Globals.settings.general["journalsync"] == "always" or self.pendingSize >= self.BATCH_SIZE:
+			self.Flush()
+		elif self.timeout is None:
+			interval = int(Globals.settings.general["journalinterval"])
+			self.timeout = gobject.timeout_add(interval, self.OnFlushTimeout)
+	
+	#_____________________________________________________________________
+	
+	def Flush(self):
+		"""
+		Writes the pending records to the file, and syncs it unless
+		the "journalsync" setting is "never".
+		"""
+		if self.timeout is not None:
+			gobject.source_remove(self.timeout)
+			self.timeout = None
+		if not self.pending:
+			return
+		
+		if self.file is None:
+			self.file = open(self.filename, "wb")
+			self.file.write(self.MAGIC)
+		self.file.write("".join(self.pending))
+		self.file.flush()
+		if Globals.settings.general["journalsync"] != "never":
+			os.fsync(self.file.fileno())
+		
+		self.pending = []
+		self.pendingSize = 0
+	
+	#_____________________________________________________________________
+	
+	def OnFlushTimeout(self):
+		"""
+		Writes the pending records once the batch interval has passed.
+		
+		Returns:
+			False -- stop calling the callback on a timeout_add.
+		"""
+		self.timeout = None
+		self.Flush()
+		return False
+	
+	#_____________________________________________________________________
+	
+	def Rewrite(self, strings):
+		"""
+		Replaces the file with one holding the given records, and keeps
+		it open so that new records are added after them.
+		
+		Parameters:
+			strings -- the serialized actions to write.
+		"""
+		self.Close()
+		self.pending = []
+		self.pendingSize = 0
+		
+		self.file = open(self.filename + "~", "wb")
+		self.file.write(self.MAGIC)
+		for string in strings:
+			self.Append(string)
+		self.Flush()
+		self.appended = 0
+		# the old file is replaced, so this one has to be on disk whatever the policy
+		if Globals.settings.general["journalsync"] == "never":
+			os.fsync(self.file.fileno())
+		self.file.close()
+		
+		if os.name != "posix" and os.path.exists(self.filename):
+			os.remove(self.filename)
+		os.rename(self.filename + "~", self.filename)
+		self.file = open(self.filename, "ab")
+	
+	#_____________________________________________________________________
+	
+	def Close(self):
+		"""
+		Writes any pending records and closes the file.
+		"""
+		self.Flush()
+		if self.file:
+			self.file.close()
+			self.file = None
+	
+	#_____________________________________________________________________
+	
+	def Delete(self):
+		"""
+		Drops any pending records, and deletes the file.
+		"""
+		self.pending = []
+		self.pendingSize = 0
+		self.Close()
+		if os.path.exists(self.filename):
+			os.remove(self.filename)
+	
+	#_____________________________________________________________________
+	
+	@staticmethod
+	def ReadRecords(filename):
+		"""
+		Reads all the complete records from a journal file.
+		
+		Considerations:
+			Files in the old format, where the actions are separated by
+			OLD_DELIMITER, are read as well.
+		
+		Parameters:
+			filename -- the path of the .incremental file.
+			
+		Returns:
+			a list of the serialized actions in the file.
+		"""
+		incr_file = open(filename, "rb")
+		try:
+			data = incr_file.read()
+		finally:
+			incr_file.close()
+		
+		if not data.startswith(Journal.MAGIC):
+			return [x.strip() for x in data.split(Journal.OLD_DELIMITER) if x.strip()]
+		
+		strings = []
+		headerSize = Journal.RECORD_HEADER.size
+		position = len(Journal.MAGIC)
+		while position + headerSize <= len(data):
+			length, crc = Journal.RECORD_HEADER.unpack_from(data, position)
+			position += headerSize
+			string = data[position:position + length]
+			if len(string) < length or zlib.crc32(string) & 0xffffffff != crc:
+				Globals.debug("Incomplete record at the end of", filename)
+				break
+			strings.append(string)
+			position += length
+		
+		return strings
+	
+	#_____________________________________________________________________
+
+#=========================================================================
+
 class MockEvent:
 	def __init__(self, string):
 		self.id = int(string[1:])
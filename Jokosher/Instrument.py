@@ -17,10 +17,14 @@ pygst.require("0.10")
 import gst
 import PlatformUtils
 import os, time, shutil
+import hashlib
+import bisect
 import urlparse # To split up URI's
 import gobject
 import Event
-import UndoSystem, IncrementalSave
+import UndoSystem, IncrementalSave, AudioPool
+import OfflineRender, Engine
+from elements.singledecodebin import SingleDecodeBin
 import Utils
 
 import Globals
@@ -47,6 +51,28 @@ class Instrument(gobject.GObject):
 	"""
 	LADSPA_ELEMENT_CAPS = "audio/x-raw-float, width=(int)32, rate=(int)[ 1, 2147483647 ], channels=(int)1, endianness=(int)BYTE_ORDER"
 	
+	"""
+	The caps of the effects bin when there are no effects. The audio is mixed
+	down to mono just as it is for the effects, but is kept in the format it
+	was decoded in, since there is nothing to convert it to float for.
+	"""
+	MONO_CAPS = "audio/x-raw-int, channels=(int)1; audio/x-raw-float, channels=(int)1"
+	
+	"""
+	The silence source and the volume fade operation in the composition always
+	extend EXTENT_HEADROOM seconds past the end of the Project. They are only grown
+	again once the end of the Project comes within EXTENT_MARGIN seconds of their end,
+	so that the composition does not have to be re-laid out on every length change.
+	"""
+	EXTENT_HEADROOM = 600
+	EXTENT_MARGIN = 60
+	
+	""" The encoder used by Freeze(), which keeps the samples as they come out of the effects. """
+	FREEZE_ENCODE_BIN = "audioconvert ! audio/x-raw-float, width=(int)32, channels=(int)1 ! wavenc"
+	
+	""" The number of seconds rendered by Freeze() after the last Event, for the effects to fade out. """
+	FREEZE_TAIL = 10
+	
 	"""
 	Signals:
 		"arm" -- This instrument has been armed or dis-armed for recording.
@@ -57,6 +83,7 @@ class Instrument(gobject.GObject):
 		"event" -- The events for this instrument have changed. The event ID will be passed as a parameter. See below:
 			"event::added" -- An event was added to this instrument.
 			"event::removed" -- An event was removed from this instrument.
+		"freeze" -- This instrument has been frozen or unfrozen.
 		"image" -- The image for this instrument has changed.
 		"mute" -- This instrument has been muted or unmuted.
 		"name" -- The name of this instrument has changed.
@@ -70,6 +97,7 @@ class Instrument(gobject.GObject):
 		"arm"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"effect"		: ( gobject.SIGNAL_RUN_LAST | gobject.SIGNAL_DETAILED, gobject.TYPE_NONE, () ),
 		"event"		: ( gobject.SIGNAL_RUN_LAST | gobject.SIGNAL_DETAILED, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,) ),
+		"freeze"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"image"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"mute"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"name"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
@@ -95,7 +123,9 @@ class Instrument(gobject.GObject):
 		
 		self.project = project
 		
-		self.events = []				# List of events attached to this instrument
+		self.events = EventList(self)	# List of events attached to this instrument
+		self.__sortedEvents = None	# The events sorted by start time, once GetEventsInRange() has needed them (see AddToEventIndex())
+		self.__eventStarts = None	# The start times of __sortedEvents, for binary searches
 		self.graveyard = []			# List of events that have been deleted (kept for undo)
 		self.effects = []				# List of GStreamer effect elements
 		
@@ -120,13 +150,58 @@ class Instrument(gobject.GObject):
 		
 		self.input = None	# the device to use for recording on this instrument.
 		self.inTrack = 0	# Input track to record from if device is multichannel.
+		self.compositionExtent = 0	# Length in seconds of the silence and fade operation in the composition
+		
+		self.frozenFile = None		# Name of the file in the audio directory this Instrument was rendered to by Freeze()
+		self.frozenLength = 0.0		# Length in seconds of the frozen file
+		self.frozenSignature = None	# The GetFreezeSignature() of this Instrument when it was rendered to the frozen file
+		self.freezeRenderer = None	# The OfflineRender.Renderer writing the frozen file, while Freeze() is running
 	
+		# The GStreamer elements are only created by BuildPipeline(), when the
+		# Project is first played, recorded or exported.
+		self.playbackbin = None		# The bin with all the GStreamer elements of this Instrument
+		self.composition = None		# The gnlcomposition holding the sources of the Events
+		self.volumeElement = None
+		self.levelElement = None
+		self.panElement = None
+		self.effectsBin = None
+		self.volumeFadeController = None
+		self.playghostpad = None
+		self.mixQueue = None		# The queue giving this Instrument a thread of its own, if the "mixqueues" setting is enabled
+		self.mixAdder = None		# The adder this Instrument is linked to, which is a bus' adder if there are buses
+		self.frozenSource = None		# The gnlsource playing the frozen file, when it replaces the Events in the composition
+		
+		self.AddAndLinkPlaybackbin()
+		
+		#mute this instrument if another one is solo
+		self.OnMute()
+		#set the volume element since it depends on the project's volume as well
+		self.UpdateVolume()
+		
+	#_____________________________________________________________________
+	
+	def BuildPipeline(self):
+		"""
+		Creates the GStreamer elements for this Instrument and the sources
+		for all of its Events, and sets them up from the current state of
+		the Instrument. Nothing is done if they have already been created.
+		
+		Considerations:
+			This is called by AddAndLinkPlaybackbin() once the Project has
+			built its pipeline. It should not be called explicitly.
+		"""
+		if self.playbackbin is not None:
+			return
+		
+		Globals.debug("building the pipeline for instrument", self.id)
+		
 		# CREATE GSTREAMER ELEMENTS #
 		self.playbackbin = gst.element_factory_make("bin", "Instrument_%d"%self.id)
 		self.volumeElement = gst.element_factory_make("volume", "Instrument_Volume_%d"%self.id)
 		self.levelElement = gst.element_factory_make("level", "Instrument_Level_%d"%self.id)
 		self.panElement = gst.element_factory_make("audiopanorama", "Instrument_Pan_%d"%self.id)
 		self.resample = gst.element_factory_make("audioresample")
+		self.isResampling = False
 		
 		self.composition = gst.element_factory_make("gnlcomposition")
 		self.silentGnlSource = gst.element_factory_make("gnlsource")		# the default source that makes the silence between the tracks
@@ -137,27 +212,29 @@ class Instrument(gobject.GObject):
 		self.effectsBinCaps = gst.element_factory_make("capsfilter", "Effects_float_caps_%d"%self.id)
 		self.effectsBinCaps.set_property("caps", gst.Caps(self.LADSPA_ELEMENT_CAPS))
 		self.effectsBinEndConvert = gst.element_factory_make("audioconvert", "End_Effects_Converter_%d"%self.id)
+		self.effectsBinMonoCaps = gst.element_factory_make("capsfilter", "Effects_mono_caps_%d"%self.id)
+		self.effectsBinMonoCaps.set_property("caps", gst.Caps(self.MONO_CAPS))
 		
 		self.volumeFadeBin = gst.element_factory_make("bin", "Volume_fades_bin")
 		self.volumeFadeElement = gst.element_factory_make("volume", "Volume_Fade_Element")
-		self.volumeFadeStartConvert = gst.element_factory_make("audioconvert", "Start_fadebin_converter")	
-		self.volumeFadeEndConvert = gst.element_factory_make("audioconvert", "End_fadebin_converter")
 		self.volumeFadeOperation = gst.element_factory_make("gnloperation", "gnloperation")
 		self.volumeFadeController = gst.Controller(self.volumeFadeElement, "volume")
 		
 		# CREATE GHOSTPADS FOR BINS #
-		self.effectsBin.add(self.effectsBinConvert, self.effectsBinCaps, self.effectsBinEndConvert)
+		# the effects and the float converters around them are only added by __LinkEffects() when there are effects
+		self.effectsBin.add(self.effectsBinConvert, self.effectsBinMonoCaps)
+		self.effectsBinConvert.link(self.effectsBinMonoCaps)
 		self.effectsBinSink = gst.GhostPad("sink", self.effectsBinConvert.get_pad("sink"))
 		self.effectsBin.add_pad(self.effectsBinSink)
-		self.effectsBinSrc = gst.GhostPad("src", self.effectsBinEndConvert.get_pad("src"))
+		self.effectsBinSrc = gst.GhostPad("src", self.effectsBinMonoCaps.get_pad("src"))
 		self.effectsBin.add_pad(self.effectsBinSrc)
+		self.effectsChain = [self.effectsBinConvert, self.effectsBinMonoCaps]
 		
+		# the volume element takes any format, so it needs no converters
 		self.volumeFadeBin.add(self.volumeFadeElement)
-		self.volumeFadeBin.add(self.volumeFadeStartConvert)
-		self.volumeFadeBin.add(self.volumeFadeEndConvert)
-		volumeFadeBinSink = gst.GhostPad("sink", self.volumeFadeStartConvert.get_pad("sink"))
+		volumeFadeBinSink = gst.GhostPad("sink", self.volumeFadeElement.get_pad("sink"))
 		self.volumeFadeBin.add_pad(volumeFadeBinSink)
-		volumeFadeBinSrc = gst.GhostPad("src", self.volumeFadeEndConvert.get_pad("src"))
+		volumeFadeBinSrc = gst.GhostPad("src", self.volumeFadeElement.get_pad("src"))
 		self.volumeFadeBin.add_pad(volumeFadeBinSrc)
 		
 		# SET ELEMENT PROPERTIES #
@@ -166,24 +243,19 @@ class Instrument(gobject.GObject):
 		self.levelElement.set_property("peak-ttl", 0)
 		self.levelElement.set_property("peak-falloff", 20)
 		
-		self.panElement.set_property("panorama", 0)
-
 		self.silenceAudioSource.set_property("wave", 4)	#4 is silence
 		
 		self.silentGnlSource.set_property("priority", 2 ** 32 - 1)
 		self.silentGnlSource.set_property("start", 0)
-		self.silentGnlSource.set_property("duration", 1000 * gst.SECOND)
 		self.silentGnlSource.set_property("media-start", 0)
-		self.silentGnlSource.set_property("media-duration", 1000 * gst.SECOND)
 		
 		self.volumeFadeOperation.set_property("start", long(0) * gst.SECOND)
-		self.volumeFadeOperation.set_property("duration", long(20) * gst.SECOND)
 		self.volumeFadeOperation.set_property("priority", 1)
 		
 		self.volumeFadeController.set_interpolation_mode("volume", gst.INTERPOLATE_LINEAR)
 		
 		# ADD ELEMENTS TO THE PIPELINE AND/OR THEIR BINS #
-		self.playbackbin.add(self.volumeElement, self.levelElement, self.panElement, self.resample)
+		self.playbackbin.add(self.volumeElement, self.levelElement, self.panElement)
 		self.playbackbin.add(self.composition)
 		self.playbackbin.add(self.effectsBin)
 		
@@ -193,29 +265,36 @@ class Instrument(gobject.GObject):
 		self.composition.add(self.volumeFadeOperation)
 		
 		# LINK GSTREAMER ELEMENTS #
-		self.effectsBinConvert.link(self.effectsBinCaps)
-		self.effectsBinCaps.link(self.effectsBinEndConvert)
-		
 		self.effectsBin.link(self.volumeElement)
 		self.volumeElement.link(self.levelElement)
 		self.levelElement.link(self.panElement)	
-		self.panElement.link(self.resample)
-
-		self.playghostpad = gst.GhostPad("src", self.resample.get_pad("src"))
-		self.playbackbin.add_pad(self.playghostpad)
 		
-		self.volumeFadeStartConvert.link(self.volumeFadeElement)
-		self.volumeFadeElement.link(self.volumeFadeEndConvert)
+		# the resampler is only linked in by __UpdateResampler() when it is needed
+		self.mixQueue = Engine.MakeMixQueue()
+		if self.mixQueue:
+			self.playbackbin.add(self.mixQueue)
+			self.panElement.link(self.mixQueue)
+			self.playghostpad = gst.GhostPad("src", self.mixQueue.get_pad("src"))
+		else:
+			self.playghostpad = gst.GhostPad("src", self.panElement.get_pad("src"))
+		self.playbackbin.add_pad(self.playghostpad)
+		self.__UpdateResampler()
 		
-		self.AddAndLinkPlaybackbin()
-
 		self.composition.connect("pad-added", self.__PadAddedCb)
 		self.composition.connect("pad-removed", self.__PadRemovedCb)
 		
-		#mute this instrument if another one is solo
-		self.OnMute()
-		#set the volume element since it depends on the project's volume as well
+		# LINK THE EFFECTS THAT WERE ADDED BEFORE THE PIPELINE EXISTED #
+		self.__LinkEffects(self.effects)
+		
+		# APPLY THE CURRENT STATE OF THE INSTRUMENT #
+		self.compositionExtent = 0
+		self.UpdateCompositionExtent(self.project.GetProjectLength())
+		self.UpdatePan()
 		self.UpdateVolume()
+		self.volumeElement.set_property("mute", self.actuallyIsMuted)
+		
+		for event in self.events:
+			event.CreateFilesource()
 		
 	#_____________________________________________________________________
 	
@@ -257,6 +336,16 @@ class Instrument(gobject.GObject):
 		return "Instrument [%d] %s"%(self.id, self.name)
 		
 	#_____________________________________________________________________
+	
+	def emit(self, signal, *args):
+		"""
+		Emits the given signal, unless an edit transaction is in progress,
+		in which case it is emitted when the transaction ends.
+		"""
+		if not self.project.DeferSignal(self, signal, args):
+			gobject.GObject.emit(self, signal, *args)
+	
+	#_____________________________________________________________________
 		
 	def StoreToXML(self, doc, parent, graveyard=False):
 		"""
@@ -269,38 +358,74 @@ class Instrument(gobject.GObject):
 			graveyard -- True if this Instrument is on the graveyard stack,
 						and should be serialized as a dead Instrument.
 		"""
-		if graveyard:
+		Instrument.StoreSnapshotToXML(doc, parent, self.GetSnapshot(graveyard))
+
+	#_____________________________________________________________________
+	
+	def GetSnapshot(self, graveyard=False):
+		"""
+		Copies what StoreToXML() saves, including the Events, so that it can
+		be serialized later, on another thread, while this Instrument goes on changing.
+		
+		Parameters:
+			graveyard -- True if this Instrument is on the graveyard stack,
+						and should be serialized as a dead Instrument.
+						
+		Returns:
+			a dictionary to pass to StoreSnapshotToXML().
+		"""
+		items = ["name", "isArmed", 
+				"isMuted", "isSolo", "input", "output", "volume",
+				"isSelected", "isVisible", "inTrack", "instrType", "pan",
+				"frozenFile", "frozenLength", "frozenSignature"]
+		
+		effects = []
+		for effect in self.effects:
+			propsdict = {}
+			for prop in gobject.list_properties(effect):
+				if prop.flags & gobject.PARAM_WRITABLE:
+					propsdict[prop.name] = effect.get_property(prop.name)
+			effects.append((effect.get_factory().get_name(), propsdict))
+		
+		return {"id" : self.id,
+				"graveyard" : graveyard,
+				"parameters" : Utils.CopyParameters(self, items),
+				"effects" : effects,
+				"events" : [ev.GetSnapshot() for ev in self.events] +
+						[ev.GetSnapshot(graveyard=True) for ev in self.graveyard]}
+	
+	#_____________________________________________________________________
+	
+	@staticmethod
+	def StoreSnapshotToXML(doc, parent, snapshot):
+		"""
+		Converts an Instrument snapshot into an XML representation suitable for saving to a file.
+		
+		Parameters:
+			doc -- the XML document object the Instrument will be saved to.
+			parent -- the parent node that the serialized Instrument should
+						be added to.
+			snapshot -- the dictionary returned by GetSnapshot().
+		"""
+		if snapshot["graveyard"]:
 			ins = doc.createElement("DeadInstrument")
 		else:
 			ins = doc.createElement("Instrument")
 		parent.appendChild(ins)
-		ins.setAttribute("id", str(self.id))
-		
-		items = ["name", "isArmed", 
-				"isMuted", "isSolo", "input", "output", "volume",
-				"isSelected", "isVisible", "inTrack", "instrType", "pan"]
+		ins.setAttribute("id", str(snapshot["id"]))
 		
 		params = doc.createElement("Parameters")
 		ins.appendChild(params)
+		Utils.StoreParameterValuesToXML(doc, params, snapshot["parameters"])
 		
-		Utils.StoreParametersToXML(self, doc, params, items)
-		
-		for effect in self.effects:
+		for name, propsdict in snapshot["effects"]:
 			globaleffect = doc.createElement("GlobalEffect")
-			globaleffect.setAttribute("element", effect.get_factory().get_name())
+			globaleffect.setAttribute("element", name)
 			ins.appendChild(globaleffect)
-		
-			propsdict = {}
-			for prop in gobject.list_properties(effect):
-				if prop.flags & gobject.PARAM_WRITABLE:
-					propsdict[prop.name] = effect.get_property(prop.name)
-			
 			Utils.StoreDictionaryToXML(doc, globaleffect, propsdict)
 			
-		for ev in self.events:
-			ev.StoreToXML(doc, ins)
-		for ev in self.graveyard:
-			ev.StoreToXML(doc, ins, graveyard=True)
+		for ev in snapshot["events"]:
+			Event.Event.StoreSnapshotToXML(doc, ins, ev)
 
 	#_____________________________________________________________________
 
@@ -321,26 +446,8 @@ class Instrument(gobject.GObject):
 		#make the new effect
 		effectElement = gst.element_factory_make(effectName)
 		self.effects.append(effectElement)
-		#add the element to effects bin
-		self.effectsBin.add(effectElement)
-		
-		# The src pad on the first element (an audioconvert) in the bin
-		startSrcPad = self.effectsBinConvert.get_pad("src")
-		
-		state = self.playbackbin.get_state(0)[1]
-		if state == gst.STATE_PAUSED or state == gst.STATE_PLAYING:
-			startSrcPad.set_blocked(True)
-			
-		lastEffectElement = self.effectsBinEndConvert.get_pad("sink").get_peer().get_parent()
-		
-		lastEffectElement.unlink(self.effectsBinEndConvert)
-		lastEffectElement.link(effectElement)
-		effectElement.link(self.effectsBinEndConvert)
-		
-		# make the element's state match the bin's state
-		effectElement.set_state(state)
-		#give it a lambda for a callback that does nothing, so we don't have to wait
-		startSrcPad.set_blocked_async(False, lambda x,y: False)
+		#it is linked later if the pipeline is not built yet
+		self.__RelinkEffects()
 		
 		self.emit("effect::added")
 		
@@ -359,35 +466,12 @@ class Instrument(gobject.GObject):
 			Globals.debug("Error: trying to remove an element that is not in the list")
 			return
 		
-		for pad in effect.sink_pads():
-			if pad.is_linked():
-				previousElement = pad.get_peer().get_parent()
-				break
-		
-		for pad in effect.src_pads():
-			if pad.is_linked():
-				nextElement = pad.get_peer().get_parent()
-				break
-		
-		# The src pad on the first element (an audioconvert) in the bin
-		startSrcPad = self.effectsBinConvert.get_pad("src")
-		
-		state = self.playbackbin.get_state(0)[1]
-		if state == gst.STATE_PAUSED or state == gst.STATE_PLAYING:
-			startSrcPad.set_blocked(True)
-		
-		previousElement.unlink(effect)
-		effect.unlink(nextElement)
-		previousElement.link(nextElement)
-		
-		# Remove and dispose of the element
-		self.effectsBin.remove(effect)
-		effect.set_state(gst.STATE_NULL)
-		#remove the effect from our own list
 		self.effects.remove(effect)
-		
-		#give it a lambda for a callback that does nothing, so we don't have to wait
-		startSrcPad.set_blocked_async(False, lambda x,y: False)
+		if self.effectsBin is None or self.frozenSource:
+			effect.set_state(gst.STATE_NULL)
+		else:
+			# the effect is removed from the bin and disposed of when it is unlinked
+			self.__RelinkEffects()
 		
 		self.emit("effect::removed")
 	
@@ -398,9 +482,7 @@ class Instrument(gobject.GObject):
 		Move a given GStreamer element inside the effects bin. This method
 		does not swap the element into its new position, it simply shifts all the
 		elements between the effect's current position and the new position
-		down by one. Since a Gstreamer pipeline is essentially a linked list, this
-		"shift" implementation is the fastest way to make one element move to
-		a new position without changing the order of any of the others.
+		down by one, without changing the order of any of the others.
 		For example if this instrument has five effects which are ordered
 		A, B, C, D, E, and I call this method with effect D and a new position
 		of 1 the new order will be:  A, D, B, C, E.
@@ -422,56 +504,9 @@ class Instrument(gobject.GObject):
 			#the effect is already in the proper position
 			return
 		
-		# The effect currently at the position we want to move the given effect to
-		newPositionEffect = self.effects[newPosition]
-		
-		for pad in effect.sink_pads():
-			if pad.is_linked():
-				previousElement = pad.get_peer().get_parent()
-				break
-		
-		for pad in effect.src_pads():
-			if pad.is_linked():
-				nextElement = pad.get_peer().get_parent()
-				break
-		
-		# The src pad on the first element (an audioconvert) in the bin
-		startSrcPad = self.effectsBinConvert.get_pad("src")
-		# check the state and block if we have to
-		state = self.playbackbin.get_state(0)[1]
-		if state == gst.STATE_PAUSED or state == gst.STATE_PLAYING:
-			startSrcPad.set_blocked(True)
-			
-		#here's where we start unlinking and relinking
-		previousElement.unlink(effect)
-		effect.unlink(nextElement)
-		previousElement.link(nextElement)
-		
-		if oldPosition > newPosition:
-			for pad in newPositionEffect.sink_pads():
-				if pad.is_linked():
-					newPositionPrevious = pad.get_peer().get_parent()
-					break
-			
-			newPositionPrevious.unlink(newPositionEffect)
-			newPositionPrevious.link(effect)
-			effect.link(newPositionEffect)
-		else:
-			for pad in newPositionEffect.src_pads():
-				if pad.is_linked():
-					newPositionNext = pad.get_peer().get_parent()
-					break
-			
-			newPositionEffect.unlink(newPositionNext)
-			newPositionEffect.link(effect)
-			effect.link(newPositionNext)
-			
-		# remove and insert to our own llst so it matches the changes just made
 		del self.effects[oldPosition]
 		self.effects.insert(newPosition, effect)
-		
-		#give it a lambda for a callback that does nothing, so we don't have to wait
-		startSrcPad.set_blocked_async(False, lambda x,y: False)
+		self.__RelinkEffects()
 		
 		self.emit("effect:reordered")
 	
@@ -551,20 +586,24 @@ class Instrument(gobject.GObject):
 			
 		if not undoAction:
 			undoAction = self.project.NewAtomicUndoAction()
-			
-		for uri in fileList:
-			# Parse the uri, and continue only if it is pointing to a local file
-			(scheme, domain, file, params, query, fragment) = urlparse.urlparse(uri, "file", False)
-			if scheme == "file":
-				file = PlatformUtils.url2pathname(file)
-				event = self.addEventFromFile(start, file, copyFile, _undoAction_=undoAction)
-			else:
-				event = self.addEventFromURL(start, uri, _undoAction_=undoAction)
-			
-			if event:
-				event.MoveButDoNotOverlap(event.start)
-				event.SetProperties()
-				start += event.duration
+		
+		self.project.BeginUpdate()
+		try:
+			for uri in fileList:
+				# Parse the uri, and continue only if it is pointing to a local file
+				(scheme, domain, file, params, query, fragment) = urlparse.urlparse(uri, "file", False)
+				if scheme == "file":
+					file = PlatformUtils.url2pathname(file)
+					event = self.addEventFromFile(start, file, copyFile, _undoAction_=undoAction)
+				else:
+					event = self.addEventFromURL(start, uri, _undoAction_=undoAction)
+				
+				if event:
+					event.MoveButDoNotOverlap(event.start)
+					event.SetProperties()
+					start += event.duration
+		finally:
+			self.project.EndUpdate()
 	
 	#_____________________________________________________________________
 
@@ -598,8 +637,9 @@ class Instrument(gobject.GObject):
 			audio_file = os.path.join(self.project.audio_path, newfile)
 			
 			try:
-				shutil.copyfile(file, audio_file)
-			except IOError:
+				if not AudioPool.AddFile(file, audio_file):
+					shutil.copyfile(file, audio_file)
+			except EnvironmentError:
 				raise UndoSystem.CancelUndoCommand()
 				
 			self.project.deleteOnCloseAudioFiles.append(audio_file)
@@ -721,14 +761,52 @@ class Instrument(gobject.GObject):
 		
 		self.graveyard.append(event)
 		self.events.remove(event)
-		event.DestroyFilesource()
 		event.StopGenerateWaveform(False)
+		event.ReleaseResources()
+		event.UpdateProjectLength(removed=True)
 		
 		self.temp = eventid
 		self.emit("event::removed", event)
 	
 	#_____________________________________________________________________
 	
+	def DeleteEvents(self, eventids, undoAction):
+		"""
+		Removes several Events from this Instrument in one pass over its
+		Events, instead of searching the Events for each of them as
+		DeleteEvent() does. Each removal is saved incrementally and added
+		to the undo action just as a call to DeleteEvent() would be.
+		
+		Parameters:
+			eventids -- a set of IDs of the Events to be removed. IDs of
+						Events on other Instruments are ignored.
+			undoAction -- the AtomicUndoAction to add the commands to.
+		"""
+		removed = []
+		kept = []
+		for event in self.events:
+			if event.id in eventids:
+				removed.append(event)
+			else:
+				kept.append(event)
+		if not removed:
+			return
+		
+		# replacing the contents rebuilds the start time index once, on its next use
+		self.events[:] = kept
+		objectString = "I%d" % self.id
+		for event in removed:
+			self.graveyard.append(event)
+			event.StopGenerateWaveform(False)
+			event.ReleaseResources()
+			event.UpdateProjectLength(removed=True)
+			
+			self.project.SaveIncrementalAction(IncrementalSave.Action(objectString, "DeleteEvent", (event.id,), {}))
+			undoAction.AddUndoCommand(objectString, "ResurrectEvent", [event.id])
+			self.emit("event::removed", event)
+	
+	#_____________________________________________________________________
+	
 	@UndoSystem.UndoCommand("DeleteEvent", "temp")
 	def ResurrectEvent(self, eventid):
 		"""
@@ -741,6 +819,7 @@ class Instrument(gobject.GObject):
 		
 		self.events.append(event)
 		self.graveyard.remove(event)
+		event.RestoreResources()
 		event.CreateFilesource()
 		if event.isLoading or not event.levels_list:
 			event.GenerateWaveform()
@@ -810,11 +889,35 @@ class Instrument(gobject.GObject):
 		Updates the volume property of the gstreamer volume element
 		based on this instrument's volume and the project's master volume.
 		"""
+		if self.volumeElement is None:
+			return
 		volume = self.volume * self.project.volume
 		self.volumeElement.set_property("volume", volume)
 	
 	#_____________________________________________________________________
 	
+	def SetPan(self, pan):
+		"""
+		Sets the pan (balance) of this Instrument.
+		
+		Parameters:
+			pan -- new pan value in a [-1,1] range.
+		"""
+		self.pan = pan
+		self.UpdatePan()
+	
+	#_____________________________________________________________________
+	
+	def UpdatePan(self):
+		"""
+		Updates the panorama property of the gstreamer pan element
+		based on this instrument's pan value.
+		"""
+		if self.panElement is not None:
+			self.panElement.set_property("panorama", self.pan)
+	
+	#_____________________________________________________________________
+	
 	@UndoSystem.UndoCommand("SetName", "temp")
 	def SetName(self, name):
 		"""
@@ -939,10 +1042,8 @@ class Instrument(gobject.GObject):
 		Updates the GStreamer volume element to reflect the mute status.
 		"""
 		self.checkActuallyIsMuted()
-		if self.actuallyIsMuted:
-			self.volumeElement.set_property("mute", True)
-		else:
-			self.volumeElement.set_property("mute", False)
+		if self.volumeElement is not None:
+			self.volumeElement.set_property("mute", self.actuallyIsMuted)
 		
 		self.emit("mute")
 	
@@ -968,7 +1069,15 @@ class Instrument(gobject.GObject):
 		"""
 		Creates a playback bin for this Instrument and adds it to the main
 		playback pipeline. *CHECK*
+		
+		Considerations:
+			Nothing is done until the Project has built its pipeline
+			(see Project.BuildPipeline()).
 		"""
+		if not self.project.pipelineBuilt:
+			return
+		self.BuildPipeline()
+		
 		#make sure our playbackbin is in the same state so the pipeline can continue what it was doing
 		status, state, pending = self.project.playbackbin.get_state(0)
 		if pending != gst.STATE_VOID_PENDING:
@@ -980,7 +1089,8 @@ class Instrument(gobject.GObject):
 			self.project.playbackbin.add(self.playbackbin)
 			Globals.debug("added instrument playbackbin to adder playbackbin", self.id)
 		if not self.playghostpad.get_peer():
-			self.playbackbin.link(self.project.adder)
+			self.mixAdder = self.project.GetMixAdder(self)
+			self.playbackbin.link(self.mixAdder)
 			#give it a lambda for a callback that does nothing, so we don't have to wait
 			self.playghostpad.set_blocked_async(False, lambda x,y: False)
 			Globals.debug("linked instrument playbackbin to adder (project)")
@@ -991,6 +1101,9 @@ class Instrument(gobject.GObject):
 		"""
 		Removes this Instrumen's playback bin from the main playback pipeline. *CHECK*
 		"""
+		if self.playbackbin is None:
+			return
+		
 		#get reference to pad before removing self.playbackbin from project.playbackbin!
 		pad = self.playghostpad.get_peer()
 		
@@ -999,9 +1112,11 @@ class Instrument(gobject.GObject):
 			if state == gst.STATE_PAUSED or state == gst.STATE_PLAYING or \
 					pending == gst.STATE_PAUSED or pending == gst.STATE_PLAYING:
 				self.playghostpad.set_blocked(True)
-			self.playbackbin.unlink(self.project.adder)
-			self.project.adder.release_request_pad(pad)
+			self.playbackbin.unlink(self.mixAdder)
+			self.mixAdder.release_request_pad(pad)
 			Globals.debug("unlinked instrument playbackbin from adder")
+			self.project.ReleaseMixAdder(self)
+			self.mixAdder = None
 		
 		if self.playbackbin in list(self.project.playbackbin.elements()):
 			self.project.playbackbin.remove(self.playbackbin)
@@ -1009,6 +1124,56 @@ class Instrument(gobject.GObject):
 	
 	#_____________________________________________________________________
 
+	def ReleasePipeline(self, spillLevels=True):
+		"""
+		Frees the GStreamer elements of this Instrument and the resources of its
+		Events, once it has been moved to the graveyard. Only the effects are kept,
+		so that BuildPipeline() can create the rest again if it is resurrected.
+		
+		Considerations:
+			The playback bin must have been removed from the Project's
+			pipeline first (see RemoveAndUnlinkPlaybackbin()).
+		
+		Parameters:
+			spillLevels -- passed on to Event.ReleaseResources().
+		"""
+		for event in self.events + self.graveyard:
+			event.ReleaseResources(spillLevels)
+		
+		if self.playbackbin is None:
+			return
+		
+		self.playbackbin.set_state(gst.STATE_NULL)
+		for effect in self.effects:
+			if effect.get_parent() is self.effectsBin:
+				self.effectsBin.remove(effect)
+		
+		self.playbackbin = None
+		self.composition = None
+		self.volumeElement = None
+		self.levelElement = None
+		self.panElement = None
+		self.resample = None
+		self.mixQueue = None
+		self.silentGnlSource = None
+		self.silenceAudioSource = None
+		self.effectsBin = None
+		self.effectsBinConvert = None
+		self.effectsBinCaps = None
+		self.effectsBinEndConvert = None
+		self.effectsBinMonoCaps = None
+		self.effectsBinSink = None
+		self.effectsBinSrc = None
+		self.effectsChain = []
+		self.volumeFadeBin = None
+		self.volumeFadeElement = None
+		self.volumeFadeOperation = None
+		self.volumeFadeController = None
+		self.playghostpad = None
+		self.frozenSource = None
+	
+	#_____________________________________________________________________
+
 	@UndoSystem.UndoCommand("ChangeType", "temp", "temp2")
 	def ChangeType(self, type, name):
 		"""
@@ -1050,17 +1215,336 @@ class Instrument(gobject.GObject):
 		Fills the gst.Controller for this Instrument with its list of fade times.
 		"""
 		
+		if self.volumeFadeController is None:
+			return
+		
 		Globals.debug("Preparing the controller")
-		# set the length of the operation to be the full length of the project
-		self.volumeFadeOperation.set_property("duration", self.project.GetProjectLength() * gst.SECOND)
-		self.volumeFadeController.unset_all("volume")
+		# make sure the operation covers the full length of the project
+		self.UpdateCompositionExtent(self.project.GetProjectLength())
+		self.__UpdateFrozenSource()
+		self.__UpdateResampler()
+		self.SetFadeControllerPoints(self.volumeFadeController)
+	
+	#_____________________________________________________________________
+	
+	def Freeze(self):
+		"""
+		Renders the Events of this Instrument, with their volume fades and the
+		effects of this Instrument, to a file in the audio directory, faster than
+		realtime. Once it has been rendered, that file is played instead of the
+		Events, and the effects are bypassed, which saves the CPU they would use.
+		The volume, pan and mute are still applied while playing.
+		
+		Considerations:
+			The frozen file stops being used as soon as anything it was rendered
+			from changes (see IsFrozen()). The playbackbin only switches between
+			the frozen file and the Events when the Project starts playing.
+		"""
+		if not self.project.engine.canProcessAudio or self.freezeRenderer or self.IsFrozen():
+			return
+		
+		signature = self.GetFreezeSignature()
+		filename = "frozen_%d_%s.wav" % (self.id, signature[:8])
+		length = self.FREEZE_TAIL
+		for event in self.events:
+			length = max(length, event.start + event.duration + self.FREEZE_TAIL)
+		
+		path = os.path.join(self.project.audio_path, filename)
+		self.freezeRenderer = OfflineRender.Renderer(self.project, [self], path,
+				self.FREEZE_ENCODE_BIN, length, mix=False)
+		self.freezeRenderer.connect("finished", self.__FreezeFinishedCb, filename, length, signature)
+		self.freezeRenderer.Start()
+	
+	#_____________________________________________________________________
+	
+	def __FreezeFinishedCb(self, renderer, error, filename, length, signature):
+		"""
+		Starts using the frozen file once Freeze() has rendered it.
+		
+		Parameters:
+			renderer -- reserved for GObject callbacks, don't use it explicitly.
+			error -- the error message of the renderer, or None if it succeeded.
+			filename -- the name of the rendered file in the audio directory.
+			length -- the length in seconds of the rendered file.
+			signature -- the GetFreezeSignature() of this Instrument when it was rendered.
+		"""
+		self.freezeRenderer = None
+		if error:
+			Globals.debug("Freezing instrument %d failed: %s" % (self.id, error))
+			return
+		
+		if signature != self.GetFreezeSignature():
+			Globals.debug("Instrument %d changed while it was being frozen" % self.id)
+			os.remove(os.path.join(self.project.audio_path, filename))
+			return
+		
+		oldFile = self.frozenFile
+		self.frozenFile = filename
+		self.frozenLength = length
+		self.frozenSignature = signature
+		if oldFile and oldFile != filename:
+			self.__RemoveFrozenFile(oldFile)
+		
+		if not self.project.GetIsPlaying():
+			self.__UpdateFrozenSource()
+		self.project.SetUnsavedChanges()
+		self.emit("freeze")
+	
+	#_____________________________________________________________________
+	
+	def Unfreeze(self):
+		"""
+		Goes back to playing the Events and effects of this Instrument,
+		and deletes the file it was frozen to.
+		"""
+		if self.freezeRenderer:
+			self.freezeRenderer.Cancel()
+		if not self.frozenFile:
+			return
+		
+		self.__RemoveFrozenFile(self.frozenFile)
+		self.frozenFile = None
+		self.frozenLength = 0.0
+		self.frozenSignature = None
+		
+		if not self.project.GetIsPlaying():
+			self.__UpdateFrozenSource()
+		self.project.SetUnsavedChanges()
+		self.emit("freeze")
+	
+	#_____________________________________________________________________
+	
+	def __RemoveFrozenFile(self, filename):
+		"""
+		Deletes a frozen file which is no longer used.
+		
+		Parameters:
+			filename -- the name of the file in the audio directory.
+		"""
+		path = os.path.join(self.project.audio_path, filename)
+		if os.path.exists(path):
+			Globals.debug("Deleting frozen file:", path)
+			os.remove(path)
+	
+	#_____________________________________________________________________
+	
+	def IsFrozen(self):
+		"""
+		Checks whether this Instrument plays the file it was frozen to.
+		
+		Returns:
+			True if there is a frozen file, and neither the Events, their
+			fades nor the effects have changed since it was rendered.
+		"""
+		if not self.frozenFile or self.frozenSignature != self.GetFreezeSignature():
+			return False
+		return os.path.exists(os.path.join(self.project.audio_path, self.frozenFile))
+	
+	#_____________________________________________________________________
+	
+	def GetFreezeSignature(self):
+		"""
+		Summarises everything the frozen file is rendered from, so that
+		any change to it can be detected.
+		
+		Returns:
+			a hex digest of the positions, files and fades of the Events,
+			and of the kinds and settings of the effects.
+		"""
+		items = []
+		for event in sorted(self.events, key=lambda x: x.start):
+			items.append((event.file, event.start, event.duration, event.offset, event.audioFadePoints))
+		
+		for effect in self.effects:
+			props = []
+			for prop in gobject.list_properties(effect):
+				if prop.flags & gobject.PARAM_WRITABLE and prop.flags & gobject.PARAM_READABLE:
+					value = effect.get_property(prop.name)
+					if isinstance(value, (int, long, float, bool, str)) and prop.name != "name":
+						props.append((prop.name, value))
+			items.append((effect.get_factory().get_name(), props))
+		
+		return hashlib.sha1(repr(items)).hexdigest()
+	
+	#_____________________________________________________________________
+	
+	def __UpdateFrozenSource(self):
+		"""
+		Makes the composition play the frozen file if IsFrozen() is True,
+		and the Events and effects otherwise.
+		
+		Considerations:
+			The pipeline must not be playing.
+		"""
+		if self.composition is None:
+			return
+		
+		frozen = self.IsFrozen()
+		if self.frozenSource:
+			if frozen and self.frozenSource.get_name() == "Frozen_%s" % self.frozenFile:
+				# Events brought back since, by undo for example, must not play over the file
+				for event in self.events:
+					event.DestroyFilesource()
+				return
+			self.composition.remove(self.frozenSource)
+			self.frozenSource.set_state(gst.STATE_NULL)
+			self.frozenSource = None
+			
+			if not frozen:
+				Globals.debug("Instrument %d is playing its events again" % self.id)
+				self.composition.add(self.volumeFadeOperation)
+				for event in self.events:
+					event.CreateFilesource()
+				self.__LinkEffects(self.effects)
+		
+		elif frozen:
+			Globals.debug("Instrument %d is playing its frozen file" % self.id)
+			for event in self.events:
+				event.DestroyFilesource()
+			self.composition.remove(self.volumeFadeOperation)
+			self.__LinkEffects([])
+		
+		if frozen:
+			self.frozenSource = gst.element_factory_make("gnlsource", "Frozen_%s" % self.frozenFile)
+			caps = gst.caps_from_string("audio/x-raw-int;audio/x-raw-float")
+			uri = PlatformUtils.pathname2url(os.path.join(self.project.audio_path, self.frozenFile))
+			self.frozenSource.add(SingleDecodeBin(caps=caps, uri=uri))
+			duration = long(self.frozenLength * gst.SECOND)
+			for prop, value in (("caps", caps), ("start", 0), ("duration", duration),
+					("media-start", 0), ("media-duration", duration), ("priority", 2)):
+				self.frozenSource.set_property(prop, value)
+			self.composition.add(self.frozenSource)
+	
+	#_____________________________________________________________________
+	
+	def __LinkEffects(self, effects):
+		"""
+		Replaces the elements linked in the effects bin. Without any effects, the
+		bin only mixes the audio down to mono like the effects do (see MONO_CAPS),
+		rather than converting it to the format of the effects and back for nothing.
+		
+		Parameters:
+			effects -- the effect elements to link, in order.
+		"""
+		if effects:
+			chain = [self.effectsBinConvert, self.effectsBinCaps] + effects + [self.effectsBinEndConvert]
+		else:
+			chain = [self.effectsBinConvert, self.effectsBinMonoCaps]
+		
+		for i in range(len(self.effectsChain) - 1):
+			self.effectsChain[i].unlink(self.effectsChain[i + 1])
+		for element in self.effectsChain:
+			if element not in chain:
+				self.effectsBin.remove(element)
+				element.set_state(gst.STATE_NULL)
+		
+		added = []
+		for element in chain:
+			if element.get_parent() is not self.effectsBin:
+				self.effectsBin.add(element)
+				added.append(element)
+		for i in range(len(chain) - 1):
+			chain[i].link(chain[i + 1])
+		self.effectsBinSrc.set_target(chain[-1].get_pad("src"))
+		self.effectsChain = chain
+		
+		# make the new elements' state match the bin's state
+		for element in added:
+			element.sync_state_with_parent()
+	
+	#_____________________________________________________________________
+	
+	def __RelinkEffects(self):
+		"""
+		Links the effects of this Instrument again after they have been changed,
+		blocking the audio flowing into the effects bin while it is done.
+		"""
+		if self.effectsBin is None or self.frozenSource:
+			# they are linked when the pipeline is built or the Instrument is unfrozen
+			return
+		
+		# The src pad on the first element (an audioconvert) in the bin
+		startSrcPad = self.effectsBinConvert.get_pad("src")
+		
+		state = self.playbackbin.get_state(0)[1]
+		if state == gst.STATE_PAUSED or state == gst.STATE_PLAYING:
+			startSrcPad.set_blocked(True)
+		
+		self.__LinkEffects(self.effects)
+		
+		#give it a lambda for a callback that does nothing, so we don't have to wait
+		startSrcPad.set_blocked_async(False, lambda x,y: False)
+	
+	#_____________________________________________________________________
+	
+	def __UpdateResampler(self):
+		"""
+		Links the resampler after the pan element if the audio of any Event
+		might not be at the rate of the Project's mix, and unlinks it otherwise.
+		
+		Considerations:
+			The pipeline must not be playing.
+		"""
+		if self.playbackbin is None:
+			return
+		
+		rate = self.project.sampleRate
+		if self.frozenSource:
+			# the rate of the frozen file is not known
+			rates = [0]
+		else:
+			rates = [event.GetPlaybackRate() for event in self.events]
+		needed = bool([x for x in rates if x != rate])
+		if needed == self.isResampling:
+			return
+		
+		if self.mixQueue:
+			nextPad = self.mixQueue.get_pad("sink")
+		else:
+			nextPad = None
+		
+		if needed:
+			Globals.debug("Instrument %d is resampling its events" % self.id)
+			self.playbackbin.add(self.resample)
+			if nextPad:
+				self.panElement.unlink(self.mixQueue)
+				self.panElement.link(self.resample)
+				self.resample.link(self.mixQueue)
+			else:
+				self.panElement.link(self.resample)
+				self.playghostpad.set_target(self.resample.get_pad("src"))
+			self.resample.sync_state_with_parent()
+		else:
+			Globals.debug("Instrument %d no longer resamples its events" % self.id)
+			self.panElement.unlink(self.resample)
+			if nextPad:
+				self.resample.unlink(self.mixQueue)
+				self.panElement.link(self.mixQueue)
+			else:
+				self.playghostpad.set_target(self.panElement.get_pad("src"))
+			self.playbackbin.remove(self.resample)
+			self.resample.set_state(gst.STATE_NULL)
+		
+		self.isResampling = needed
+	
+	#_____________________________________________________________________
+	
+	def SetFadeControllerPoints(self, controller):
+		"""
+		Fills a gst.Controller on the "volume" property of a volume element
+		with the fade points of the Events of this Instrument.
+		
+		Parameters:
+			controller -- the gst.Controller to fill.
+		"""
+		controller.unset_all("volume")
 		firstpoint = False
 		for ev in self.events:
 			if not ev.audioFadePoints:
 				#there are no fade points, so just make it 100% all the way through
 				for point, vol in ((ev.start, 0.99), (ev.start+ev.duration, 0.99)):
 					Globals.debug("FADE POINT: time(%.2f) vol(%.2f)" % (point, vol))
-					self.volumeFadeController.set("volume", (point) * gst.SECOND, vol)
+					controller.set("volume", (point) * gst.SECOND, vol)
 				continue
 			
 			for point in ev.audioFadePoints:
@@ -1072,10 +1556,143 @@ class Instrument(gobject.GObject):
 				else:
 					vol = point[1]
 				Globals.debug("FADE POINT: time(%.2f) vol(%.2f)" % (ev.start + point[0], vol))
-				self.volumeFadeController.set("volume", (ev.start + point[0]) * gst.SECOND, vol)
+				controller.set("volume", (ev.start + point[0]) * gst.SECOND, vol)
 		if not firstpoint:
 			Globals.debug("Set extra zero fade point")
-			self.volumeFadeController.set("volume", 0, 0.99)
+			controller.set("volume", 0, 0.99)
+	
+	#_____________________________________________________________________
+	
+	def UpdateCompositionExtent(self, end):
+		"""
+		Makes sure the silence source and the volume fade operation in the
+		composition reach past the given time. They are only changed when end
+		comes within EXTENT_MARGIN seconds of their current length, and are then
+		grown to EXTENT_HEADROOM seconds past end.
+		
+		Parameters:
+			end -- time in seconds that the composition has to cover.
+		"""
+		if self.composition is None:
+			return
+		if end + self.EXTENT_MARGIN <= self.compositionExtent:
+			return
+		
+		self.compositionExtent = end + self.EXTENT_HEADROOM
+		duration = long(self.compositionExtent * gst.SECOND)
+		Globals.debug("Instrument %d: composition extent is now %d seconds" % (self.id, self.compositionExtent))
+		
+		self.silentGnlSource.set_property("duration", duration)
+		self.silentGnlSource.set_property("media-duration", duration)
+		self.volumeFadeOperation.set_property("duration", duration)
+	
+	#_____________________________________________________________________
+	
+	def FreezeComposition(self, freeze):
+		"""
+		Stops or restarts the composition from recalculating its timeline
+		each time one of its sources changes. While frozen, the changes are
+		accumulated and they are all applied at once when it is thawed.
+		
+		Considerations:
+			This does nothing with versions of gnonlin that don't have the
+			"update" property on gnlcomposition.
+		
+		Parameters:
+			freeze -- True to stop timeline updates, False to apply the pending
+					changes and go back to updating immediately.
+		"""
+		if self.composition is not None and hasattr(self.composition.props, "update"):
+			self.composition.set_property("update", not freeze)
+	
+	#_____________________________________________________________________
+	
+	def GetEventsInRange(self, start, stop):
+		"""
+		Finds the Events of this Instrument which overlap the given interval.
+		
+		Considerations:
+			The Events of an Instrument never overlap, so when they are sorted
+			by start time they are sorted by end time too, and the interval
+			can be found with a binary search. The sorted Events are kept up
+			to date as Events are added, moved and removed, rather than
+			sorted again for every search.
+		
+		Parameters:
+			start -- start of the interval in seconds.
+			stop -- end of the interval in seconds.
+		
+		Returns:
+			a list of the Events overlapping the interval, sorted by start time.
+		"""
+		if self.__sortedEvents is None:
+			self.__sortedEvents = sorted(self.events)
+			self.__eventStarts = [ev.start for ev in self.__sortedEvents]
+		events, starts = self.__sortedEvents, self.__eventStarts
+		
+		first = bisect.bisect_left(starts, start)
+		if first > 0:
+			previous = events[first - 1]
+			if previous.start + max(previous.duration, previous.loadingLength) > start:
+				first -= 1
+		last = bisect.bisect_left(starts, stop)
+		
+		return events[first:last]
+	
+	#_____________________________________________________________________
+	
+	def AddToEventIndex(self, event):
+		"""
+		Adds an Event to the sorted Events searched by GetEventsInRange().
+		Called by the list of Events, and by Events when they move.
+		
+		Parameters:
+			event -- the Event which was added to this Instrument.
+		"""
+		if self.__sortedEvents is None:
+			return
+		index = bisect.bisect_right(self.__sortedEvents, event)
+		self.__sortedEvents.insert(index, event)
+		self.__eventStarts.insert(index, event.start)
+	
+	#_____________________________________________________________________
+	
+	def RemoveFromEventIndex(self, event, start=None):
+		"""
+		Removes an Event from the sorted Events searched by GetEventsInRange().
+		Called by the list of Events, and by Events when they move.
+		
+		Parameters:
+			event -- the Event which was removed from this Instrument.
+			start -- the start time the Event was indexed at,
+					or None if it has not changed since.
+					
+		Returns:
+			True if the Event was indexed.
+		"""
+		if self.__sortedEvents is None:
+			return False
+		if start is None:
+			start = event.start
+		index = bisect.bisect_left(self.__eventStarts, start)
+		while index < len(self.__eventStarts) and self.__eventStarts[index] == start:
+			if self.__sortedEvents[index] is event:
+				del self.__sortedEvents[index]
+				del self.__eventStarts[index]
+				return True
+			index += 1
+		return False
+	
+	#_____________________________________________________________________
+	
+	def ClearEventIndex(self):
+		"""
+		Forgets the sorted Events searched by GetEventsInRange(),
+		so that they are sorted again when they are next needed.
+		"""
+		self.__sortedEvents = None
+		self.__eventStarts = None
+	
 	#_____________________________________________________________________
 	
 	def RemoveEventsUnderEvent(self, mainEvent, undoAction=None):
@@ -1095,28 +1712,123 @@ class Instrument(gobject.GObject):
 		start = mainEvent.start
 		stop = mainEvent.start + max(mainEvent.duration, mainEvent.loadingLength)
 		leftTrimEvent = rightTrimEvent = None
-		for event in self.events:
-			if event is mainEvent:
-				continue
+		
+		self.project.BeginUpdate()
+		try:
+			# iterate over a copy because DeleteEvent() changes self.events
+			for event in self.events[:]:
+				if event is mainEvent:
+					continue
+				
+				eventLeft = event.start
+				eventRight = event.start + event.duration
+				if start <= eventLeft and eventRight <= stop:
+					#this event is in between
+					self.DeleteEvent(event.id, _undoAction_=undoAction)
+				elif eventLeft < start < eventRight and eventRight <= stop:
+					# this event is straddling the start of our interval
+					leftTrimEvent = event
+				elif start <= eventLeft and eventLeft < stop < eventRight:
+					# this event is straddling the stop of our interval
+					rightTrimEvent = event
 			
-			eventLeft = event.start
-			eventRight = event.start + event.duration
-			if start <= eventLeft and eventRight <= stop:
-				#this event is in between
-				self.DeleteEvent(event.id, _undoAction_=undoAction)
-			elif eventLeft < start < eventRight and eventRight <= stop:
-				# this event is straddling the start of our interval
-				leftTrimEvent = event
-			elif start <= eventLeft and eventLeft < stop < eventRight:
-				# this event is straddling the stop of our interval
-				rightTrimEvent = event
-		
-		if leftTrimEvent:
-			leftPiece = leftTrimEvent.SplitEvent(start - leftTrimEvent.start, _undoAction_=undoAction)
-			self.DeleteEvent(leftPiece.id, _undoAction_=undoAction)
-		if rightTrimEvent:
-			rightTrimEvent.SplitEvent(stop - rightTrimEvent.start, _undoAction_=undoAction)
-			self.DeleteEvent(rightTrimEvent.id, _undoAction_=undoAction)
+			if leftTrimEvent:
+				leftPiece = leftTrimEvent.SplitEvent(start - leftTrimEvent.start, _undoAction_=undoAction)
+				self.DeleteEvent(leftPiece.id, _undoAction_=undoAction)
+			if rightTrimEvent:
+				rightTrimEvent.SplitEvent(stop - rightTrimEvent.start, _undoAction_=undoAction)
+				self.DeleteEvent(rightTrimEvent.id, _undoAction_=undoAction)
+		finally:
+			self.project.EndUpdate()
+	
+	#_____________________________________________________________________
+#=========================================================================
+
+class EventList(list):
+	"""
+	The list of the Events of an Instrument, which keeps the Instrument's
+	index of their start times (see Instrument.GetEventsInRange()) up to date.
+	Events are mostly appended and removed one at a time, which updates the
+	index in place. Any other change drops the index, to be sorted again.
+	"""
+	
+	#_____________________________________________________________________
+	
+	def __init__(self, instrument):
+		"""
+		Creates a new, empty EventList.
+		
+		Parameters:
+			instrument -- the Instrument the Events belong to.
+		"""
+		list.__init__(self)
+		self.instrument = instrument
+	
+	#_____________________________________________________________________
+	
+	def append(self, event):
+		list.append(self, event)
+		self.instrument.AddToEventIndex(event)
+	
+	#_____________________________________________________________________
+	
+	def remove(self, event):
+		for index, item in enumerate(self):
+			if item is event:
+				del self[index]
+				return
+		raise ValueError("EventList.remove(x): x not in list")
 	
 	#_____________________________________________________________________
+	
+	def __delitem__(self, index):
+		event = self[index]
+		list.__delitem__(self, index)
+		if isinstance(index, slice) or not self.instrument.RemoveFromEventIndex(event):
+			self.instrument.ClearEventIndex()
+	
+	#_____________________________________________________________________
+	
+	def extend(self, events):
+		self.instrument.ClearEventIndex()
+		return list.extend(self, events)
+	
+	#_____________________________________________________________________
+	
+	def insert(self, index, event):
+		self.instrument.ClearEventIndex()
+		return list.insert(self, index, event)
+	
+	#_____________________________________________________________________
+	
+	def pop(self, *args):
+		self.instrument.ClearEventIndex()
+		return list.pop(self, *args)
+	
+	#_____________________________________________________________________
+	
+	def __setitem__(self, index, value):
+		self.instrument.ClearEventIndex()
+		return list.__setitem__(self, index, value)
+	
+	#_____________________________________________________________________
+	
+	def __setslice__(self, i, j, events):
+		self.instrument.ClearEventIndex()
+		return list.__setslice__(self, i, j, events)
+	
+	#_____________________________________________________________________
+	
+	def __delslice__(self, i, j):
+		self.instrument.ClearEventIndex()
+		return list.__delslice__(self, i, j)
+	
+	#_____________________________________________________________________
+	
+	def __iadd__(self, events):
+		self.instrument.ClearEventIndex()
+		return list.__iadd__(self, events)
+	
+	#_____________________________________________________________________
+
 #=========================================================================
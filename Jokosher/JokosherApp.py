@@ -80,6 +80,7 @@ class MainApp:
 			"on_Stop_clicked" : self.Stop,
 			"on_CompactMix_toggled" : self.OnCompactMixView,
 			"on_export_activate" : self.OnExport,
+			"on_export_stems_activate" : self.OnExportStems,
 			"on_preferences_activate" : self.OnPreferences,
 			"on_open_activate" : self.OnOpenProject,
 			"on_import_activate" : self.OnImportProject,
@@ -105,6 +106,7 @@ class MainApp:
 			"on_instrumentmenu_activate" : self.OnInstrumentMenu,
 			"on_instrMenu_add_audio" : self.OnAddAudio,
 			"on_change_instr_type_activate" : self.OnChangeInstrument,
+			"on_freeze_instr_activate" : self.OnFreezeInstrument,
 			"on_remove_instr_activate" : self.OnRemoveInstrument,
 			"on_report_bug_activate" : self.OnReportBug,
 			"on_project_add_audio" : self.OnAddAudioFile,
@@ -135,12 +137,14 @@ class MainApp:
 		self.delete = self.gtk_builder.get_object("delete")
 		self.instrumentMenu = self.gtk_builder.get_object("instrumentmenu")
 		self.export = self.gtk_builder.get_object("export")
+		self.exportStems = self.gtk_builder.get_object("export_stems")
 		self.recentprojects = self.gtk_builder.get_object("recentprojects")
 		self.recentprojectsmenu = self.gtk_builder.get_object("recentprojects_menu")
 		self.menubar = self.gtk_builder.get_object("menubar")
 		self.toolbar = self.gtk_builder.get_object("MainToolbar")
 		self.addAudioMenuItem = self.gtk_builder.get_object("add_audio_file_instrument_menu")
 		self.changeInstrMenuItem = self.gtk_builder.get_object("change_instrument_type")
+		self.freezeInstrMenuItem = self.gtk_builder.get_object("freeze_instrument")
 		self.removeInstrMenuItem = self.gtk_builder.get_object("remove_selected_instrument")
 		self.addAudioFileButton = self.gtk_builder.get_object("addAudioFileButton")
 		self.addAudioFileMenuItem = self.gtk_builder.get_object("add_audio_file_project_menu")
@@ -159,6 +163,7 @@ class MainApp:
 		self.timeview = None
 		self.tvtoolitem = None #wrapper for putting timeview in toolbar
 		self.workspace = None
+		self.exportdlg = None #the progress dialog of the running export
 		self.instrNameEntry = None #the gtk.Entry when editing an instrument name
 		self.main_vbox = self.gtk_builder.get_object("main_vbox")
 		
@@ -402,6 +407,23 @@ class MainApp:
 				return
 	
 	#_____________________________________________________________________
+
+	def OnFreezeInstrument(self, widget=None):
+		"""
+		Freezes the selected Instrument, or unfreezes it if it is frozen.
+		
+		Parameters:
+			widget -- reserved for GTK callbacks, don't use it explicitly.	
+		"""
+		for instr in self.project.instruments:
+			if instr.isSelected:
+				if instr.IsFrozen() or instr.freezeRenderer:
+					instr.Unfreeze()
+				else:
+					instr.Freeze()
+				return
+	
+	#_____________________________________________________________________
 	
 	def About(self, widget=None):
 		"""
@@ -597,23 +619,35 @@ class MainApp:
 	
 	#_____________________________________________________________________
 	
-	def OnExport(self, widget=None):
+	def OnExport(self, widget=None, stems=False):
 		"""
 		Creates and shows a save file dialog which allows the user to export
 		the project as ogg or mp3.
 		
 		Parameters:
 			widget -- reserved for GTK callbacks, don't use it explicitly.
+			stems -- True to choose a folder to export each instrument to,
+					instead of a file to export the whole project to.
 		"""
+		if self.project.GetIsExporting():
+			# only one export runs at a time; its progress dialog is not modal
+			if self.exportdlg:
+				self.exportdlg.present()
+			return
+		
 		buttons = (gtk.STOCK_CANCEL,gtk.RESPONSE_CANCEL,gtk.STOCK_SAVE,gtk.RESPONSE_OK)
-		chooser = gtk.FileChooserDialog(_("Export Project"), self.window, gtk.FILE_CHOOSER_ACTION_SAVE, buttons)
+		if stems:
+			chooser = gtk.FileChooserDialog(_("Export Stems"), self.window, gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER, buttons)
+		else:
+			chooser = gtk.FileChooserDialog(_("Export Project"), self.window, gtk.FILE_CHOOSER_ACTION_SAVE, buttons)
 		if os.path.exists(Globals.settings.general["projectfolder"]):
 			chooser.set_current_folder(Globals.settings.general["projectfolder"])
 		else:
 			chooser.set_current_folder(os.path.expanduser("~"))
-		chooser.set_do_overwrite_confirmation(True)
 		chooser.set_default_response(gtk.RESPONSE_OK)
-		chooser.set_current_name(self.project.name)
+		if not stems:
+			chooser.set_do_overwrite_confirmation(True)
+			chooser.set_current_name(self.project.name)
 
 		sampleRateHBox = gtk.HBox()
 		sampleRateLabel = gtk.Label(_("Sample rate:"))
@@ -636,8 +670,10 @@ class MainApp:
 
 		for index, samplerate in enumerate(Globals.SAMPLE_RATES):
 			sampleRateCombo.append_text("%d Hz" % samplerate)
-			if samplerate == Globals.DEFAULT_SAMPLE_RATE:
+			if samplerate == self.project.sampleRate:
 				sampleRateCombo.set_active(index)
+		if sampleRateCombo.get_active() < 0:
+			sampleRateCombo.set_active(Globals.SAMPLE_RATES.index(Globals.DEFAULT_SAMPLE_RATE))
 		
 		for index, bitrate in enumerate(Globals.BIT_RATES):
 			bitRateCombo.append_text("%d kbps" % bitrate)
@@ -655,12 +691,15 @@ class MainApp:
 		response = chooser.run()
 		if response == gtk.RESPONSE_OK:
 			exportFilename = chooser.get_filename()
-			Globals.settings.general["projectfolder"] = os.path.dirname(exportFilename)
+			if stems:
+				Globals.settings.general["projectfolder"] = exportFilename
+			else:
+				Globals.settings.general["projectfolder"] = os.path.dirname(exportFilename)
 			Globals.settings.write()
 			#If they haven't already appended the extension for the 
 			#chosen file type, add it to the end of the file.
 			filetypeDict = Globals.EXPORT_FORMATS[typeCombo.get_active()]
-			if not exportFilename.lower().endswith("." + filetypeDict["extension"]):
+			if not stems and not exportFilename.lower().endswith("." + filetypeDict["extension"]):
 				exportFilename += "." + filetypeDict["extension"]
 		
 			if sampleRateHBox.get_property("visible"):
@@ -676,12 +715,43 @@ class MainApp:
 				bitrate = None
 
 			chooser.destroy()
-			self.project.Export(exportFilename, filetypeDict["pipeline"], samplerate, bitrate)
+			if stems:
+				existing = [os.path.basename(path) for instr, path in
+						self.project.GetStemFilenames(exportFilename, filetypeDict["extension"])
+						if os.path.exists(path)]
+				if existing:
+					dlg = gtk.MessageDialog(self.window,
+						gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+						gtk.MESSAGE_QUESTION,
+						gtk.BUTTONS_NONE,
+						_("These files already exist in the folder:\n\n%s\n\nDo you want to replace them?") % "\n".join(existing))
+					dlg.add_button(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL)
+					dlg.add_button(_("_Replace"), gtk.RESPONSE_YES)
+					response = dlg.run()
+					dlg.destroy()
+					if response != gtk.RESPONSE_YES:
+						return
+				self.project.ExportStems(exportFilename, filetypeDict["pipeline"],
+						filetypeDict["extension"], samplerate, bitrate, overwrite=True)
+			else:
+				self.project.Export(exportFilename, filetypeDict["pipeline"], samplerate, bitrate)
 		else:
 			chooser.destroy()
 		
 	#_____________________________________________________________________
 
+	def OnExportStems(self, widget=None):
+		"""
+		Creates and shows a folder dialog which allows the user to export
+		each instrument of the project to a file of its own.
+		
+		Parameters:
+			widget -- reserved for GTK callbacks, don't use it explicitly.
+		"""
+		self.OnExport(widget, stems=True)
+		
+	#_____________________________________________________________________
+
 	def OnExportFormatChanged(self, typeCombo, sampleRateHBox, bitRateHBox):
 		"""
 		Updates the export file chooser dialog's setting options to make sure
@@ -705,12 +775,16 @@ class MainApp:
 		"""
 		Updates the progress bar corresponding to the current export operation.
 		"""
+		if not self.exportdlg:
+			return False
+		
 		progress = self.project.GetExportProgress()
 		if progress[0] == -1 or progress[1] == 0:
 			self.exportprogress.set_fraction(0.0)
 			self.exportprogress.set_text(_("Preparing to mixdown project"))
 		elif progress[0] == progress[1] == 100:
 			self.exportdlg.destroy()
+			self.exportdlg = None
 			return False
 		else:
 			self.exportprogress.set_fraction(progress[0]/progress[1])
@@ -722,16 +796,68 @@ class MainApp:
 	
 	def OnExportCancel(self, widget=None):
 		"""
-		Cancels a running export operation and destroys the export progress dialog.
+		Cancels a running export operation. The export progress dialog
+		is destroyed once the export has stopped.
 		
 		Parameters:
 			widget: reserved for GTK callbacks, don't use it explicitly.
 		"""
-		self.exportdlg.destroy()
 		self.project.TerminateExport()
 	
 	#_____________________________________________________________________
 	
+	def UpdateImportDialog(self):
+		"""
+		Updates the progress bar of the current import operation, and opens
+		the imported project once all its files have been copied.
+		"""
+		if self.importJob.IsRunning():
+			done, total = self.importJob.GetProgress()
+			if total:
+				self.importprogress.set_fraction(float(done) / total)
+				self.importprogress.set_text(_("%(done)d of %(total)d MB copied") % {"done":done / 1048576, "total":total / 1048576})
+			return True
+		
+		self.importdlg.destroy()
+		job, self.importJob = self.importJob, None
+		new_project_file = job.Finish()
+		
+		if new_project_file:
+			self.OpenProjectFromPath(new_project_file, self.window)
+		elif not job.cancelled.isSet():
+			self.ShowImportProjectErrorDialog()
+		return False
+	
+	#_____________________________________________________________________
+	
+	def OnImportCancel(self, widget=None):
+		"""
+		Cancels a running import operation. The progress dialog is
+		destroyed by UpdateImportDialog() once the copying has stopped.
+		
+		Parameters:
+			widget: reserved for GTK callbacks, don't use it explicitly.
+		"""
+		self.importdlg.set_sensitive(False)
+		self.importJob.Cancel()
+	
+	#_____________________________________________________________________
+	
+	def ShowImportProjectErrorDialog(self):
+		"""
+		Tells the user that a project could not be imported.
+		"""
+		dlg = gtk.MessageDialog(
+		        parent=self.window,
+		        flags=gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+		        type=gtk.MESSAGE_ERROR,
+		        buttons=gtk.BUTTONS_OK,
+		        message_format=_("An error occurred and the project could not be imported."))
+		dlg.run()
+		dlg.destroy()
+	
+	#_____________________________________________________________________
+	
 	def OnPreferences(self, widget, destroyCallback=None):
 		"""
 		Creates and shows the "Jokosher Preferences" dialog.
@@ -829,21 +955,28 @@ class MainApp:
 			chooser.destroy()
 
 			try:
-				new_project_file = ProjectManager.ImportProject(uri)
+				self.importJob = ProjectManager.ImportProjectJob(uri)
 			except ProjectManager.OpenProjectError, e:
 				self.ShowOpenProjectErrorDialog(e, self.window)
+				return
+			except ProjectManager.CreateProjectError, e:
+				self.ShowImportProjectErrorDialog()
+				return
 			
-			if new_project_file:
-				self.OpenProjectFromPath(new_project_file, chooser)
-			else:
-				dlg = gtk.MessageDialog(
-				        parent=self.window,
-				        flags=gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
-				        type=gtk.MESSAGE_ERROR,
-				        buttons=gtk.BUTTONS_OK,
-				        message_format=_("An error occurred and the project could not be imported."))
-				dlg.run()
-				dlg.destroy()
+			gtk_builder = Globals.LoadGtkBuilderFilename("ProgressDialog.ui")
+			gtk_builder.connect_signals({"on_cancel_clicked": self.OnImportCancel})
+			
+			self.importdlg = gtk_builder.get_object("ProgressDialog")
+			self.importdlg.set_icon(self.icon)
+			self.importdlg.set_transient_for(self.window)
+			
+			label = gtk_builder.get_object("progressLabel")
+			label.set_text(_("Importing project: %s") % filename)
+			
+			self.importprogress = gtk_builder.get_object("progressBar")
+			
+			self.importJob.Start()
+			gobject.timeout_add(100, self.UpdateImportDialog)
 		else:
 			chooser.destroy()
 		
@@ -859,7 +992,7 @@ class MainApp:
 		if self.project:
 			self.project.SelectInstrument(None)
 			self.project.ClearEventSelections()
-			self.project.SaveProjectFile()
+			self.project.SaveProjectFile(background=True)
 			
 	#_____________________________________________________________________
 	
@@ -960,6 +1093,9 @@ class MainApp:
 		
 		if self.project.CheckUnsavedChanges():
 			self.OnSaveProject()
+			if not self.project.WaitForSave():
+				# the error is shown by OnProjectSaveFailed(), and the changes are kept
+				return 1
 			self.project.CloseProject()
 		elif self.project.newly_created_project:
 			self.project.CloseProject()
@@ -1043,6 +1179,8 @@ class MainApp:
 		self.exportdlg = gtk_builder.get_object("ProgressDialog")
 		self.exportdlg.set_icon(self.icon)
 		self.exportdlg.set_transient_for(self.window)
+		# the export runs in a pipeline of its own, so the project can be used meanwhile
+		self.exportdlg.set_modal(False)
 		
 		label = gtk_builder.get_object("progressLabel")
 		label.set_text(_("Mixing project to file: %s") % self.project.exportFilename)
@@ -1063,6 +1201,7 @@ class MainApp:
 		"""
 		if self.exportdlg:
 			self.exportdlg.destroy()
+			self.exportdlg = None
 	
 	#_____________________________________________________________________
 	
@@ -1094,6 +1233,24 @@ class MainApp:
 		
 	#_____________________________________________________________________
 	
+	def OnProjectSaveFailed(self, project, message):
+		"""
+		Callback for when the project file could not be written.
+		
+		Parameters:
+			project -- The project instance that send the signal.
+			message -- the error message.
+		"""
+		dlg = gtk.MessageDialog(self.window,
+			gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+			gtk.MESSAGE_ERROR,
+			gtk.BUTTONS_OK,
+			_("The project could not be saved. Your changes have not been lost.\n\n%s") % message)
+		dlg.run()
+		dlg.destroy()
+		
+	#_____________________________________________________________________
+	
 	def OnTransportMode(self, transportManager=None, mode=None):
 		"""
 		Callback for signal when the transport mode changes.
@@ -1284,9 +1441,10 @@ class MainApp:
 				if event.isSelected:
 					#Add to the clipboard
 					self.project.clipboardList.append(event)
-					if cut:
-						#if we are cutting (as opposed to copying)
-						event.Delete()
+		
+		if cut and self.project.clipboardList:
+			#if we are cutting (as opposed to copying)
+			self.project.DeleteInstrumentsOrEvents(self.project.clipboardList)
 	
 	#______________________________________________________________________
 	
@@ -1319,8 +1477,13 @@ class MainApp:
 	
 		for instr in self.project.instruments:
 			if instr.isSelected:
-				for event in self.project.clipboardList:
-					instr.addEventFromEvent(0, event)
+				undoAction = self.project.NewAtomicUndoAction()
+				self.project.BeginUpdate()
+				try:
+					for event in self.project.clipboardList:
+						instr.addEventFromEvent(0, event, _undoAction_=undoAction)
+				finally:
+					self.project.EndUpdate()
 				break
 	
 	#______________________________________________________________________
@@ -1387,7 +1550,7 @@ class MainApp:
 		
 		ctrls = (self.save, self.close, self.addInstrumentButton, self.addAudioFileButton,
 			self.reverse, self.forward, self.play, self.stop, self.record,
-			self.instrumentMenu, self.export, self.cut, self.copy, self.paste,
+			self.instrumentMenu, self.export, self.exportStems, self.cut, self.copy, self.paste,
 			self.undo, self.redo, self.delete, self.compactMixButton, self.properties_menu_item,
 			self.addAudioFileMenuItem, self.addInstrumentFileMenuItem, self.recordingInputsFileMenuItem,
 			self.timeFormatFileMenuItem)
@@ -1508,6 +1671,7 @@ class MainApp:
 		"""
 		if self.isRecording:
 			self.export.set_sensitive(False)
+			self.exportStems.set_sensitive(False)
 			self.addInstrumentFileMenuItem.set_sensitive(False)
 			self.addAudioFileMenuItem.set_sensitive(False)
 			self.recordingInputsFileMenuItem.set_sensitive(False)
@@ -1523,6 +1687,7 @@ class MainApp:
 					eventList = True
 					break
 		self.export.set_sensitive(eventList)
+		self.exportStems.set_sensitive(eventList)
 			
 	#_____________________________________________________________________
 	
@@ -1564,13 +1729,20 @@ class MainApp:
 		"""
 		
 		instrCount = 0
+		frozen = False
 		if self.project:
 			for instr in self.project.instruments:
 				if instr.isSelected:
 					instrCount += 1
+					frozen = instr.IsFrozen() or instr.freezeRenderer is not None
 		
 		self.addAudioMenuItem.set_sensitive(instrCount == 1)
 		self.changeInstrMenuItem.set_sensitive(instrCount == 1)
+		self.freezeInstrMenuItem.set_sensitive(instrCount == 1 and self.project.engine.canProcessAudio)
+		if frozen:
+			self.freezeInstrMenuItem.get_child().set_text_with_mnemonic(_("Un_freeze Instrument"))
+		else:
+			self.freezeInstrMenuItem.get_child().set_text_with_mnemonic(_("_Freeze Instrument"))
 		self.removeInstrMenuItem.set_sensitive(instrCount > 0)
 	
 	#_____________________________________________________________________
@@ -1644,6 +1816,7 @@ class MainApp:
 		self.project.connect("audio-state::export-stop", self.OnProjectExportStop)
 		self.project.connect("name", self.OnProjectNameChanged)
 		self.project.connect("undo", self.OnProjectUndo)
+		self.project.connect("save-failed", self.OnProjectSaveFailed)
 		
 		self.project.transport.connect("transport-mode", self.OnTransportMode)
 		self.OnTransportMode()
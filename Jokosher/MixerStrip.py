@@ -237,8 +237,7 @@ class MixerStrip(gtk.Frame):
 		#to remove the status bar message in a few seconds
 		self.OnTimedStatusBarClear()
 		
-		self.instrument.pan = value
-		self.instrument.panElement.set_property("panorama", value)
+		self.instrument.SetPan(value)
 		
 	#_____________________________________________________________________
 	
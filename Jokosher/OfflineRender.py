@@ -0,0 +1,387 @@
+#
+#	THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#	THE 'COPYING' FILE FOR DETAILS
+#
+#	OfflineRender.py
+#
+#	This module renders Instruments to files in GStreamer pipelines of their
+#	own. The pipelines are built from the Instruments and Events rather than
+#	from the elements used for playback, and nothing in them is synchronised
+#	to a clock, so they run as fast as the CPU allows while the main pipeline
+#	is left alone.
+#
+#-------------------------------------------------------------------------------
+
+import pygst
+pygst.require("0.10")
+import gst, gobject
+import os
+import Globals
+import Engine
+
+#=========================================================================
+
+class Renderer(gobject.GObject):
+	"""
+	Renders some Instruments of a Project to one or more files.
+
+	Signals:
+		"finished" -- The rendering has stopped. The error message is passed
+				as a parameter, or None if the file was rendered completely.
+	"""
+
+	__gsignals__ = {
+		"finished"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,) )
+	}
+
+	#_____________________________________________________________________
+
+	def __init__(self, project, instruments, filename, encodeBin, length, mix=True, skipMuted=True):
+		"""
+		Creates a new Renderer. Nothing is rendered until Start() is called.
+
+		Parameters:
+			project -- the Project the Instruments belong to.
+			instruments -- the Instruments to render.
+			filename -- the path of the file to render to.
+			encodeBin -- the gst-launch syntax string of the encoder,
+					as used in Globals.EXPORT_FORMATS.
+			length -- the number of seconds to render.
+			mix -- True to apply the volume, pan and mute of the Instruments
+					and mix them like the main pipeline does. False to render a
+					single Instrument as it comes out of its effects.
+			skipMuted -- False to mix the Instruments which are muted too.
+		"""
+		gobject.GObject.__init__(self)
+
+		self.project = project
+		self.instruments = instruments
+		self.filename = filename
+		self.encodeBin = encodeBin
+		self.targets = [(filename, encodeBin)]	# the files to render to, with their encoders
+		self.length = length
+		self.mix = mix
+		self.skipMuted = skipMuted
+
+		self.pipeline = None
+		self.bus = None
+		self.controllers = []	# the fade controllers of the Instruments, which stop working once they are freed
+		self.isRunning = False
+		self.isFinished = False
+		self.cancelled = False
+
+	#_____________________________________________________________________
+
+	def AddTarget(self, filename, encodeBin):
+		"""
+		Adds another file to render to, from the same rendered audio.
+		The audio is only rendered once for all the files, and split
+		between their encoders by a tee.
+
+		Parameters:
+			filename -- the path of the file to render to.
+			encodeBin -- the gst-launch syntax string of the encoder.
+
+		Considerations:
+			Targets cannot be added once the rendering has started.
+		"""
+		self.targets.append((filename, encodeBin))
+
+	#_____________________________________________________________________
+
+	def Start(self):
+		"""
+		Builds the pipeline and starts rendering.
+
+		Considerations:
+			Raises gobject.GError if an encoder cannot be created.
+		"""
+		encodebins = [gst.parse_bin_from_description(x[1], True) for x in self.targets]
+
+		self.pipeline = gst.Pipeline("Render")
+		if self.mix:
+			adder = gst.element_factory_make("adder")
+			caps = gst.element_factory_make("capsfilter")
+			caps.set_property("caps", gst.caps_from_string(Engine.MIX_CAPS % self.project.sampleRate))
+			tail = [adder, caps]
+		else:
+			tail = []
+		tail.append(gst.element_factory_make("audioconvert"))
+		if len(self.targets) > 1:
+			tail.append(gst.element_factory_make("tee"))
+
+		for element in tail:
+			self.pipeline.add(element)
+		gst.element_link_many(*tail)
+
+		for encodebin, (filename, encodeBin) in zip(encodebins, self.targets):
+			filesink = gst.element_factory_make("filesink")
+			filesink.set_property("location", filename)
+			filesink.set_property("sync", False)
+			branch = [encodebin, filesink]
+			if len(self.targets) > 1:
+				# each encoder has a thread and a format of its own, so a
+				# slow encoder does not hold up the others more than it has to
+				branch[:0] = [gst.element_factory_make("queue"), gst.element_factory_make("audioconvert")]
+
+			for element in branch:
+				self.pipeline.add(element)
+			gst.element_link_many(*([tail[-1]] + branch))
+
+		instruments = self.instruments
+		if self.mix and self.skipMuted:
+			instruments = [x for x in instruments if not x.actuallyIsMuted]
+		buses = []
+		if self.mix:
+			for i in range(min(Engine.GetMixBusCount(), len(instruments))):
+				buses.append(Engine.MakeMixBus(self.pipeline, tail[0], self.project.sampleRate, offline=True)[0])
+
+		for i, instr in enumerate(instruments):
+			bin, controller = BuildInstrumentBin(instr, self.length, self.mix)
+			self.controllers.append(controller)
+			self.pipeline.add(bin)
+			if buses:
+				bin.link(buses[i % len(buses)])
+			else:
+				bin.link(tail[0])
+		if not instruments:
+			bin = BuildSilenceBin(self.length)
+			self.pipeline.add(bin)
+			bin.link(tail[0])
+
+		self.bus = self.pipeline.get_bus()
+		self.bus.add_signal_watch()
+		self.bus.connect("message::eos", self.__BusEosCb)
+		self.bus.connect("message::error", self.__BusErrorCb)
+
+		Globals.debug("Rendering %d instruments to %s" % (len(instruments), self.filename))
+		self.isRunning = True
+		self.pipeline.set_state(gst.STATE_PLAYING)
+
+	#_____________________________________________________________________
+
+	def Cancel(self):
+		"""
+		Stops rendering and deletes the unfinished files.
+		"""
+		if self.isRunning:
+			self.cancelled = True
+			self.__Finish("cancelled")
+
+	#_____________________________________________________________________
+
+	def GetProgress(self):
+		"""
+		Returns:
+			a tuple with the number of seconds rendered so far and
+			the total number of seconds to render.
+		"""
+		if self.isFinished:
+			return (self.length, self.length)
+		elif not self.isRunning:
+			return (0, self.length)
+		try:
+			position = self.pipeline.query_position(gst.FORMAT_TIME)[0]
+		except gst.QueryError:
+			position = 0
+		return (min(float(position) / gst.SECOND, self.length), self.length)
+
+	#_____________________________________________________________________
+
+	def __BusEosCb(self, bus, message):
+		"""
+		Finishes the rendering once the whole length has been written.
+
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		self.__Finish(None)
+
+	#_____________________________________________________________________
+
+	def __BusErrorCb(self, bus, message):
+		"""
+		Stops the rendering when an element of the pipeline fails.
+
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		error, debug = message.parse_error()
+		Globals.debug("Rendering %s failed: %s\n%s" % (self.filename, error, debug))
+		self.__Finish(str(error))
+
+	#_____________________________________________________________________
+
+	def __Finish(self, error):
+		"""
+		Disposes of the pipeline and emits the "finished" signal.
+
+		Parameters:
+			error -- the error message, or None if the rendering succeeded.
+		"""
+		self.isRunning = False
+		self.isFinished = True
+		self.pipeline.set_state(gst.STATE_NULL)
+		self.bus.remove_signal_watch()
+		self.pipeline = self.bus = None
+		self.controllers = []
+
+		if error:
+			for filename, encodeBin in self.targets:
+				if os.path.exists(filename):
+					os.remove(filename)
+
+		self.emit("finished", error)
+
+	#_____________________________________________________________________
+
+#=========================================================================
+
+def BuildInstrumentBin(instr, length, mix=True):
+	"""
+	Builds a bin which plays an Instrument the way its playbackbin does,
+	with new elements set up from the Instrument and its Events.
+
+	Parameters:
+		instr -- the Instrument to play.
+		length -- the number of seconds the bin plays.
+		mix -- True to apply the volume and pan of the Instrument after its effects.
+
+	Returns:
+		a tuple with the bin, which has a "src" ghost pad, and the gst.Controller
+		of its volume fades, which has to be kept while the bin is used.
+	"""
+	duration = long(length * gst.SECOND)
+	bin = gst.Bin("Render_Instrument_%d" % instr.id)
+	composition = gst.element_factory_make("gnlcomposition")
+	composition.add(_MakeSilentSource(duration))
+
+	for event in instr.events:
+		source = gst.element_factory_make("gnlsource", "Render_Event_%d" % event.id)
+		event.ConfigureSource(source)
+		composition.add(source)
+
+	# the volume fades
+	fadeBin = gst.Bin()
+	fadeVolume = gst.element_factory_make("volume")
+	fadeBin.add(fadeVolume)
+	fadeBin.add_pad(gst.GhostPad("sink", fadeVolume.get_pad("sink")))
+	fadeBin.add_pad(gst.GhostPad("src", fadeVolume.get_pad("src")))
+
+	operation = gst.element_factory_make("gnloperation")
+	operation.set_property("start", 0)
+	operation.set_property("duration", duration)
+	operation.set_property("priority", 1)
+	operation.add(fadeBin)
+	composition.add(operation)
+
+	controller = gst.Controller(fadeVolume, "volume")
+	controller.set_interpolation_mode("volume", gst.INTERPOLATE_LINEAR)
+	instr.SetFadeControllerPoints(controller)
+
+	# copies of the effects, so that the ones in the playbackbin are not disturbed.
+	# Like the effects bin of the Instrument, the audio is mono either way.
+	caps = gst.element_factory_make("capsfilter")
+	chain = [gst.element_factory_make("audioconvert"), caps]
+	if instr.effects:
+		caps.set_property("caps", gst.Caps(instr.LADSPA_ELEMENT_CAPS))
+		for effect in instr.effects:
+			chain.append(CopyElement(effect))
+		chain.append(gst.element_factory_make("audioconvert"))
+	else:
+		caps.set_property("caps", gst.Caps(instr.MONO_CAPS))
+
+	if mix:
+		volume = gst.element_factory_make("volume")
+		volume.set_property("volume", instr.volume * instr.project.volume)
+		pan = gst.element_factory_make("audiopanorama")
+		pan.set_property("panorama", instr.pan)
+		chain.extend([volume, pan])
+	chain.append(gst.element_factory_make("audioresample"))
+	queue = Engine.MakeMixQueue(offline=True)
+	if queue:
+		chain.append(queue)
+
+	bin.add(composition)
+	for element in chain:
+		bin.add(element)
+	gst.element_link_many(*chain)
+	bin.add_pad(gst.GhostPad("src", chain[-1].get_pad("src")))
+
+	def PadAddedCb(composition, pad):
+		pad.link(chain[0].get_pad("sink"))
+	composition.connect("pad-added", PadAddedCb)
+
+	return bin, controller
+
+#_____________________________________________________________________
+
+def BuildSilenceBin(length):
+	"""
+	Builds a bin which plays silence, for rendering when there are
+	no Instruments to play.
+
+	Parameters:
+		length -- the number of seconds the bin plays.
+
+	Returns:
+		the bin, which has a "src" ghost pad.
+	"""
+	bin = gst.Bin("Render_Silence")
+	composition = gst.element_factory_make("gnlcomposition")
+	composition.add(_MakeSilentSource(long(length * gst.SECOND)))
+	convert = gst.element_factory_make("audioconvert")
+	bin.add(composition, convert)
+	bin.add_pad(gst.GhostPad("src", convert.get_pad("src")))
+
+	def PadAddedCb(composition, pad):
+		pad.link(convert.get_pad("sink"))
+	composition.connect("pad-added", PadAddedCb)
+
+	return bin
+
+#_____________________________________________________________________
+
+def CopyElement(element):
+	"""
+	Creates a new element of the same kind as the given one,
+	with the same values for its properties.
+
+	Parameters:
+		element -- the element to copy.
+
+	Returns:
+		the new element.
+	"""
+	copy = gst.element_factory_make(element.get_factory().get_name())
+	for prop in gobject.list_properties(element):
+		if prop.flags & gobject.PARAM_WRITABLE and prop.flags & gobject.PARAM_READABLE \
+				and prop.name not in ("name", "parent"):
+			copy.set_property(prop.name, element.get_property(prop.name))
+	return copy
+
+#_____________________________________________________________________
+
+def _MakeSilentSource(duration):
+	"""
+	Creates the lowest priority source of a composition, which
+	plays silence wherever no Event is playing.
+
+	Parameters:
+		duration -- the length of the source in nanoseconds.
+
+	Returns:
+		the gnlsource.
+	"""
+	silence = gst.element_factory_make("audiotestsrc")
+	silence.set_property("wave", 4)	#4 is silence
+	source = gst.element_factory_make("gnlsource")
+	source.add(silence)
+	for prop, value in (("priority", 2 ** 32 - 1), ("start", 0), ("duration", duration),
+			("media-start", 0), ("media-duration", duration)):
+		source.set_property(prop, value)
+	return source
+
+#_____________________________________________________________________
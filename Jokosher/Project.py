@@ -15,8 +15,12 @@ import pygst
 pygst.require("0.10")
 import gst
 import gobject
-import os, os.path
+import os, os.path, shutil
 import gzip
+import threading
+import StringIO
+from xml.sax import saxutils
+import bisect
 import re
 
 import TransportManager
@@ -25,9 +29,11 @@ import Globals
 import xml.dom.minidom as xml
 import Instrument, Event
 import Utils
-import AudioBackend
+import AudioBackend, AudioPool
+import OfflineRender, DecodeCache
 import ProjectManager
 import PlatformUtils
+import Engine
 
 #=========================================================================
 
@@ -41,11 +47,15 @@ class Project(gobject.GObject):
 	Globals.VERSION = "0.11.1"
 	
 	""" The audio playback state enum values """
-	AUDIO_STOPPED, AUDIO_RECORDING, AUDIO_PLAYING, AUDIO_PAUSED, AUDIO_EXPORTING = range(5)
+	AUDIO_STOPPED, AUDIO_RECORDING, AUDIO_PLAYING, AUDIO_PAUSED = range(4)
 	
 	""" String constants for incremental save """
 	INCREMENTAL_SAVE_EXT = ".incremental"
-	INCREMENTAL_SAVE_DELIMITER = "\n<<delimiter>>\n"
+	""" The extension the .incremental file is moved to while the Project is being saved """
+	SAVING_JOURNAL_EXT = ".incremental-saving"
+	
+	""" Extension of the file which keeps the saved undo history """
+	HISTORY_EXT = ".history"
 	
 	"""
 	Signals:
@@ -64,6 +74,8 @@ class Project(gobject.GObject):
 			"instrument::added" -- An instrument was added to this project.
 			"instrument::removed" -- An instrument was removed from this project.
 			"instrument::reordered" -- The order of the instruments for this project changed.
+		"sample-rate" -- The sample rate of the mix was changed.
+		"save-failed" -- A save in the background could not write the Project file. The error message is passed as a parameter.
 		"time-signature" -- The time signature values were changed.
 		"undo" -- The undo or redo stacks for this project have been changed.
 		"view-start" -- The starting position of the view of this project's timeline has changed.
@@ -79,6 +91,8 @@ class Project(gobject.GObject):
 		"incremental-save" : ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"instrument"		: ( gobject.SIGNAL_RUN_LAST | gobject.SIGNAL_DETAILED, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,) ),
 		"name"			: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING,) ),
+		"sample-rate"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
+		"save-failed"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING,) ),
 		"time-signature"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"undo"			: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
 		"view-start"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () ),
@@ -88,12 +102,20 @@ class Project(gobject.GObject):
 
 	#_____________________________________________________________________
 
-	def __init__(self):
+	def __init__(self, engine=None):
 		"""
 		Creates a new instance of Project with default values.
+		
+		Parameters:
+			engine -- the engine used to process the audio of this Project
+					(see Engine.py), or None to use the GStreamerEngine.
 		"""
 		gobject.GObject.__init__(self)
 		
+		if engine is None:
+			engine = Engine.GStreamerEngine()
+		self.engine = engine		#the engine which plays, records and exports this project
+		
 		self.author = ""			#user specified author of this project
 		self.name = ""				#the name of this project
 		self.name_is_unset = True		#True if the user has not manually changed the name
@@ -112,92 +134,73 @@ class Project(gobject.GObject):
 		self.viewStart= 0.0			#View offset in seconds
 		self.soloInstrCount = 0		#number of solo instruments (to know if others must be muted)
 		self.audioState = self.AUDIO_STOPPED	#which audio state we are currently in
-		self.exportPending = False	# True if we are waiting to start an export
+		self.exportRenderers = []	# The OfflineRender.Renderers writing the exported files, while an export is running
+		self.__pendingExports = []	# The Renderers of the running export which have not been started yet
 		self.exportFilename = ""
 		self.bpm = 120
+		self.sampleRate = Globals.DEFAULT_SAMPLE_RATE	#the sample rate the instruments are mixed, recorded and exported at
 		self.meter_nom = 4		# time signature numerator
 		self.meter_denom = 4		# time signature denominator
 		self.clickbpm = 120			#the number of beats per minute that the click track will play
 		self.clickVolumeValue = 0	#The value of the click track volume between 0.0 and 1.0
 		#Keys are instruments which are recording; values are 3-tuples of the event being recorded, the recording bin and bus handler id
 		self.recordingEvents = {}	#Dict containing recording information for each recording instrument
+		self.pipelineBuilt = False	#True once the Instruments and Events have created their GStreamer elements (see BuildPipeline())
 		self.volume = 1.0			#The volume setting for the entire project
 		self.level = 0.0			#The level of the entire project as reported by the gstreamer element
+		self.__projectLength = None	#Cached value of GetProjectLength(), None if it has to be recalculated
 		self.currentSinkString = None	#to keep track if the sink changes or not
 		
 		self.newly_created_project = False	#if the project was newly created this session (set by ProjectManager.CreateNewProject())
 
 		self.hasDoneIncrementalSave = False	# True if we have already written to the .incremental file from this project.
+		self.__journal = None			# the IncrementalSave.Journal writing the .incremental file, once there is one
 		self.isDoingIncrementalRestore = False # If we are currently restoring incremental save actions
+		self.__saveThread = None		# the thread writing the Project file, when saving in the background
+		self.__saveResult = None		# the arguments of __FinishSave() for the save the thread has written
+		self.__saveFailed = False		# True if the last save could not write the Project file
 
 		# Variables for the undo/redo command system
 		self.__unsavedChanges = False	#This boolean is to indicate if something which is not on the undo/redo stack needs to be saved
 		self.__undoStack = []			#not yet saved undo commands
-		self.__redoStack = []			#not yet saved actions that we're undone
-		self.__savedUndoStack = []		#undo commands that have already been saved in the project file
+		self.__undoSpill = UndoSystem.SpilledActionStack()	#the oldest not yet saved undo commands, when there are too many to keep in memory
+		self.__redoStack = UndoSystem.SavedActionStack()		#not yet saved actions that we're undone
+		self.__savedUndoStack = UndoSystem.SavedActionStack()	#undo commands that have already been saved in the project file
 		self.__savedRedoStack = []		#redo commands that have already been saved in the project file
 		self.__performingUndo = False	#True if we are currently in the process of performing an undo command
 		self.__performingRedo = False	#True if we are currently in the process of performing a redo command
 		self.__savedUndo = False		#True if we are performing an undo/redo command that was previously saved
-	
-		
-		# CREATE GSTREAMER ELEMENTS AND SET PROPERTIES #
-		self.mainpipeline = gst.Pipeline("timeline")
-		self.playbackbin = gst.Bin("playbackbin")
-		self.adder = gst.element_factory_make("adder")
-		self.postAdderConvert = gst.element_factory_make("audioconvert")
-		self.masterSink = self.MakeProjectSink()
-		
-		self.levelElement = gst.element_factory_make("level", "MasterLevel")
-		self.levelElement.set_property("interval", gst.SECOND / 50)
-		self.levelElement.set_property("message", True)
-		
-		#Restrict adder's output caps due to adder bug 341431
-		self.levelElementCaps = gst.element_factory_make("capsfilter", "levelcaps")
-		capsString = "audio/x-raw-float,rate=44100,channels=2,width=32,endianness=(int)BYTE_ORDER"
-		caps = gst.caps_from_string(capsString)
-		self.levelElementCaps.set_property("caps", caps)
-		
-		# ADD ELEMENTS TO THE PIPELINE AND/OR THEIR BINS #
-		self.mainpipeline.add(self.playbackbin)
-		Globals.debug("added project playback bin to the pipeline")
-		for element in [self.adder, self.levelElementCaps, self.postAdderConvert, self.levelElement, self.masterSink]:
-			self.playbackbin.add(element)
-			Globals.debug("added %s to project playbackbin" % element.get_name())
-
-		# LINK GSTREAMER ELEMENTS #
-		self.adder.link(self.levelElementCaps)
-		self.levelElementCaps.link(self.postAdderConvert)
-		self.postAdderConvert.link(self.levelElement)
-		self.levelElement.link(self.masterSink)
-		
-		# CONSTRUCT CLICK TRACK BIN #
-		self.clickTrackBin = gst.Bin("Click_Track_Bin")
-		self.clickTrackAudioSrc = gst.element_factory_make("audiotestsrc", "Click_Track_AudioSource")
-		self.clickTrackAudioSrc.set_property("wave", 3)
-		self.clickTrackVolume = gst.element_factory_make("volume", "Click_Track_Volume")
-		self.clickTrackVolume.set_property("mute", True)
-		self.clickTrackConvert = gst.element_factory_make("audioconvert", "Click_Track_Audioconvert")
-		
-		self.playbackbin.add(self.clickTrackBin)
-		for element in [self.clickTrackAudioSrc, self.clickTrackVolume, self.clickTrackConvert]:
-			self.clickTrackBin.add(element)
-		
-		clickTrackSrc = gst.GhostPad("src", self.clickTrackConvert.get_pad("src"))
-		self.clickTrackBin.add_pad(clickTrackSrc)
-		self.clickTrackController = gst.Controller(self.clickTrackAudioSrc, "volume")
-		
-		self.clickTrackAudioSrc.link(self.clickTrackVolume)
-		self.clickTrackVolume.link(self.clickTrackConvert)
-		self.clickTrackBin.link(self.adder)
-		# /END OF GSTREAMER BITS #
+		self.__historyFile = None		#the history file the saved undo and redo stacks were loaded from or last written to
+		self.__historySize = 0			#number of bytes of the history file which belong to the saved Project
+		self.__historyVersion = None	#the version of Jokosher which wrote the end of the history file
+		self.__historyFailed = False	#True if the last save could not write the history file, so it has to be written again
+		
+		# Variables for the edit transactions (see BeginUpdate())
+		self.__updateDepth = 0			#number of nested BeginUpdate() calls that have not been ended yet
+		self.__updateCounter = 0		#increases with each deferred signal, to keep them in order
+		self.__pendingSignals = {}		#signals to emit on EndUpdate(). Values are (order, object, signal, args) tuples.
+		self.__pendingEvents = {}		#Events whose SetProperties() call was deferred until EndUpdate(), keyed by id(event)
+	
+		
+		# The GStreamer elements of the main pipeline are created by the engine.
+		# They are all None when using the Engine.NullEngine.
+		self.mainpipeline = None
+		self.playbackbin = None
+		self.adder = None
+		self.levelElementCaps = None
+		self.levelElement = None
+		self.masterSink = None
+		self.clickTrackVolume = None
+		self.clickTrackController = None
+		self.bus = None
+		self.engine.CreateProjectPipeline(self)
+		self.mixBuses = []	# The (elements, Instruments) of the buses the Instruments are mixed in first (see Engine.MakeMixBus())
 		
 		# set up the bus message callbacks
-		self.bus = self.mainpipeline.get_bus()
-		self.bus.add_signal_watch()
-		self.Mhandler = self.bus.connect("message::element", self.__PipelineBusLevelCb)
-		self.EOShandler = self.bus.connect("message::eos", self.Stop)
-		self.Errorhandler = self.bus.connect("message::error", self.__PipelineBusErrorCb)
+		if self.bus:
+			self.Mhandler = self.bus.connect("message::element", self.__PipelineBusLevelCb)
+			self.EOShandler = self.bus.connect("message::eos", self.Stop)
+			self.Errorhandler = self.bus.connect("message::error", self.__PipelineBusErrorCb)
 		
 		#initialize the transport mode
 		self.transportMode = TransportManager.TransportManager.MODE_BARS_BEATS
@@ -214,7 +217,6 @@ class Project(gobject.GObject):
 		Parameters:
 			newAudioState -- determines the Project audio state to set when playback commences:
 							AUDIO_PAUSED or AUDIO_PLAYING = move the graphical indicator along playback.
-							AUDIO_EXPORTING = perform playback without moving the graphical bar.
 			recording -- determines if the Project should only playback or playback and record:
 						True = playback and record.
 						False = playback only.
@@ -222,6 +224,12 @@ class Project(gobject.GObject):
 		if not newAudioState:
 			newAudioState = self.AUDIO_PLAYING
 		
+		if not self.engine.canProcessAudio:
+			Globals.debug("The project engine cannot play audio")
+			return
+		
+		self.BuildPipeline()
+		
 		Globals.debug("play() in Project.py")
 		Globals.debug("current state:", self.mainpipeline.get_state(0)[1].value_name)
 
@@ -247,6 +255,100 @@ class Project(gobject.GObject):
 	
 	#_____________________________________________________________________
 	
+	def BuildPipeline(self):
+		"""
+		Creates the GStreamer elements of all the Instruments and Events,
+		and adds them to the main pipeline. Loading a Project does not create
+		them, so this is done the first time the Project is played or recorded.
+		
+		Considerations:
+			Once the pipeline is built, every later change to the Instruments
+			and Events is applied to their existing elements, and Instruments or
+			Events added afterwards create their own elements straight away.
+		"""
+		if self.pipelineBuilt or not self.engine.canProcessAudio:
+			return
+		
+		Globals.debug("building the pipeline for the project")
+		self.pipelineBuilt = True
+		# the sample rate may have been loaded after the pipeline was created
+		self.__UpdateMixCaps()
+		for instr in self.instruments:
+			instr.AddAndLinkPlaybackbin()
+	
+	#_____________________________________________________________________
+	
+	def GetMixAdder(self, instr):
+		"""
+		Chooses the adder an Instrument is mixed by. If the "mixbuses" setting
+		is not 0, the Instrument is added to the bus with the fewest Instruments,
+		and a new bus is created until there are as many as the setting allows.
+		
+		Parameters:
+			instr -- the Instrument being linked to the main pipeline.
+			
+		Returns:
+			the adder to link the Instrument to.
+		"""
+		count = Engine.GetMixBusCount()
+		if not count:
+			return self.adder
+		
+		if len(self.mixBuses) < count:
+			elements = Engine.MakeMixBus(self.playbackbin, self.adder, self.sampleRate)
+			# the new elements have to be in the same state as the pipeline
+			for element in elements:
+				element.sync_state_with_parent()
+			self.mixBuses.append((elements, []))
+		
+		elements, instruments = min(self.mixBuses, key=lambda bus: len(bus[1]))
+		instruments.append(instr)
+		return elements[0]
+	
+	#_____________________________________________________________________
+	
+	def __UpdateMixCaps(self):
+		"""
+		Sets the caps of the adders of the main pipeline
+		to mix at the sample rate of this Project.
+		"""
+		if not self.levelElementCaps:
+			return
+		
+		caps = gst.caps_from_string(Engine.MIX_CAPS % self.sampleRate)
+		self.levelElementCaps.set_property("caps", caps)
+		for elements, instruments in self.mixBuses:
+			elements[1].set_property("caps", caps)
+	
+	#_____________________________________________________________________
+	
+	def ReleaseMixAdder(self, instr):
+		"""
+		Removes an Instrument from its bus, once it has been unlinked from the
+		bus' adder. A bus is removed once it has no Instruments, because the
+		adder it is mixed by would otherwise wait for it forever.
+		
+		Parameters:
+			instr -- the Instrument unlinked from the main pipeline.
+		"""
+		for bus in self.mixBuses:
+			elements, instruments = bus
+			if instr not in instruments:
+				continue
+			
+			instruments.remove(instr)
+			if not instruments:
+				pad = elements[-1].get_pad("src").get_peer()
+				elements[-1].unlink(self.adder)
+				self.adder.release_request_pad(pad)
+				for element in elements:
+					self.playbackbin.remove(element)
+					element.set_state(gst.STATE_NULL)
+				self.mixBuses.remove(bus)
+			break
+	
+	#_____________________________________________________________________
+	
 	def Stop(self, bus=None, message=None):
 		"""
 		Stop playback or recording
@@ -256,6 +358,9 @@ class Project(gobject.GObject):
 			message -- reserved for GStreamer callbacks, don't use it explicitly.
 		"""
 
+		if not self.mainpipeline:
+			return
+		
 		Globals.debug("Stop pressed, about to set state to READY")
 		Globals.debug("current state:", self.mainpipeline.get_state(0)[1].value_name)
 		
@@ -297,8 +402,18 @@ class Project(gobject.GObject):
 		Start recording all selected instruments.
 		"""
 
+		if not self.engine.canProcessAudio:
+			Globals.debug("The project engine cannot record audio")
+			return
+		
+		self.BuildPipeline()
+		
 		Globals.debug("pre-record state:", self.mainpipeline.get_state(0)[1].value_name)
 		
+		#make sure the other instruments have enough silence to play along with the recording
+		for instr in self.instruments:
+			instr.UpdateCompositionExtent(self.transport.GetPosition())
+		
 		#Add all instruments to the pipeline
 		self.recordingEvents = {}
 		devices = {}
@@ -348,18 +463,9 @@ class Project(gobject.GObject):
 						src_element.set_property("device", device)
 				
 				caps = gst.caps_from_string("audio/x-raw-int;audio/x-raw-float")
-
-				sampleRate = Globals.settings.recording["samplerate"]
-				try:
-					sampleRate = int(sampleRate)
-				except ValueError:
-					sampleRate = 0
-				# 0 means for "autodetect", or more technically "don't use any rate caps".
-				if sampleRate > 0:
-					for struct in caps:
-						struct.set_value("rate", sampleRate)
-
+				# record at the rate of the project, so the new events are never resampled
 				for struct in caps:
+					struct.set_value("rate", self.sampleRate)
 					struct.set_value("channels", channelsNeeded)
 
 				Globals.debug("recording with capsfilter:", caps.to_string())
@@ -368,11 +474,13 @@ class Project(gobject.GObject):
 				
 				split = gst.element_factory_make("deinterleave")
 				convert = gst.element_factory_make("audioconvert")
+				resample = gst.element_factory_make("audioresample")
 				
-				recordingbin.add(srcBin, split, convert, capsfilter)
+				recordingbin.add(srcBin, split, convert, resample, capsfilter)
 				
 				srcBin.link(convert) 
-				convert.link(capsfilter)
+				convert.link(resample)
+				resample.link(capsfilter)
 				capsfilter.link(split)
 				
 				split.connect("pad-added", self.__RecordingPadAddedCb, recInstruments, recordingbin)
@@ -383,6 +491,7 @@ class Project(gobject.GObject):
 			else:
 				instr = recInstruments[0]
 				event = instr.GetRecordingEvent()
+				event.sampleRate = self.sampleRate
 			
 				encodeString = Globals.settings.recording["fileformat"]
 				recordString = Globals.settings.recording["audiosrc"]
@@ -391,17 +500,10 @@ class Project(gobject.GObject):
 				if Globals.settings.recording["bitrate"] > 0:
 					encodeString %= {'bitrate' : int(Globals.settings.recording["bitrate"])}
 				
-				sampleRate = 0
-				try:
-					sampleRate = int( Globals.settings.recording["samplerate"] )
-				except ValueError:
-					pass
-				# 0 means "autodetect", or more technically "don't use any caps".
-				if sampleRate > 0:
-					capsString = "audio/x-raw-int,rate=%s ! audioconvert" % sampleRate
-				else:
-					capsString = "audioconvert"
-					
+				# record at the rate of the project, so the new event is never resampled.
+				# The resampler does nothing if the device can record at that rate.
+				capsString = "audioconvert ! audioresample ! audio/x-raw-int,rate=%d ! audioconvert" % self.sampleRate
+				
 				# TODO: get rid of this entire string; do it manually
 				pipe = "%s ! %s ! level name=recordlevel ! audioconvert ! %s ! filesink name=sink"
 				pipe %= (recordString, capsString, encodeString)
@@ -440,120 +542,238 @@ class Project(gobject.GObject):
 		
 	#_____________________________________________________________________
 
-	def Export(self, filename, encodeBin, samplerate=None, bitrate=None):
+	def Export(self, filename, encodeBin=None, samplerate=None, bitrate=None):
 		"""
 		Export to location filename with format specified by format variable.
 		
 		Parameters:
-			filename -- filename where the exported audio will be saved.
+			filename -- filename where the exported audio will be saved, or a list
+					of (filename, encodeBin, samplerate, bitrate) tuples to export
+					the Project to several files at once.
 			encodeBin -- the gst-launch syntax string of the encoder as used in Globals.EXPORT_FORMATS:
 					for ogg: "vorbisenc ! oggmux"
 					for mp3: "lame"
 					for wav: "wavenc"
 			samplerate -- the sample rate to output (optional, uses project default if blank).
 			bitrate -- the target bit rate to encode at (optional, uses encoder default if blank).
+			
+		Considerations:
+			The Project is mixed in a pipeline of its own (see OfflineRender),
+			which runs as fast as the CPU allows and leaves the main pipeline
+			alone, so the Project can still be played and edited. The export
+			renders the Project as it was when the export started.
+			
+			When exporting to several files, the Project is only mixed once,
+			and the mix is split between the encoders of the files.
+		"""
+		if not self.engine.canProcessAudio:
+			Globals.debug("The project engine cannot export audio")
+			return
+		
+		if self.exportRenderers:
+			Globals.debug("Cannot export while another export is running")
+			return
+		
+		if isinstance(filename, list):
+			targets = filename
+		else:
+			targets = [(filename, encodeBin, samplerate, bitrate)]
+		targets = [(x[0], self.__GetExportEncodeBin(*x[1:])) for x in targets]
+		if not targets:
+			return
+		
+		renderer = OfflineRender.Renderer(self, self.instruments, targets[0][0], targets[0][1], self.GetProjectLength())
+		for target in targets[1:]:
+			renderer.AddTarget(*target)
+		self.__StartExport([renderer], ", ".join([x[0] for x in targets]))
+
+	#_____________________________________________________________________
+	
+	def ExportStems(self, folder, encodeBin, extension, samplerate=None, bitrate=None, overwrite=False):
+		"""
+		Exports each Instrument to a file of its own, named after the Instrument.
+		
+		Parameters:
+			folder -- the folder where the exported files will be saved.
+			encodeBin -- the gst-launch syntax string of the encoder as used in Globals.EXPORT_FORMATS.
+			extension -- the extension of the exported files, as used in Globals.EXPORT_FORMATS.
+			samplerate -- the sample rate to output (optional, uses project default if blank).
+			bitrate -- the target bit rate to encode at (optional, uses encoder default if blank).
+			overwrite -- True to replace the files which already exist in the folder,
+					False to give the new files other names (see GetStemFilenames()).
+			
+		Considerations:
+			The Instruments are exported with their volume and pan, whether
+			they are muted or not. Each one is rendered in a pipeline of its own,
+			and as many of them as the "exportthreads" setting allows are
+			rendered at the same time.
+		"""
+		if not self.engine.canProcessAudio:
+			Globals.debug("The project engine cannot export audio")
+			return
+		
+		if self.exportRenderers:
+			Globals.debug("Cannot export while another export is running")
+			return
+		
+		encodeBin = self.__GetExportEncodeBin(encodeBin, samplerate, bitrate)
+		length = self.GetProjectLength()
+		renderers = []
+		for instr, filename in self.GetStemFilenames(folder, extension, overwrite):
+			renderers.append(OfflineRender.Renderer(self, [instr], filename, encodeBin, length, skipMuted=False))
+		
+		if renderers:
+			self.__StartExport(renderers, folder)
+		
+	#_____________________________________________________________________
+	
+	def GetStemFilenames(self, folder, extension, overwrite=True):
+		"""
+		Names the files ExportStems() exports the Instruments to.
+		
+		Parameters:
+			folder -- the folder where the exported files will be saved.
+			extension -- the extension of the exported files.
+			overwrite -- True to use the names of files which already exist in
+					the folder, False to number the names until they are new.
+					
+		Returns:
+			a list of (Instrument, path) tuples, in the order of the Instruments.
+		"""
+		stems = []
+		names = []
+		for instr in self.instruments:
+			name = instr.name.replace(os.sep, "_")
+			count = 1
+			while name.lower() in names or (not overwrite and \
+					os.path.exists(os.path.join(folder, "%s.%s" % (name, extension)))):
+				count += 1
+				name = "%s (%d)" % (instr.name.replace(os.sep, "_"), count)
+			names.append(name.lower())
+			stems.append((instr, os.path.join(folder, "%s.%s" % (name, extension))))
+		return stems
+	
+	#_____________________________________________________________________
+	
+	def __GetExportEncodeBin(self, encodeBin, samplerate, bitrate):
 		"""
+		Adds the sample rate and bit rate of an export to its encoder.
 		
-		if samplerate:
+		Parameters:
+			encodeBin -- the gst-launch syntax string of the encoder as used in Globals.EXPORT_FORMATS.
+			samplerate -- the sample rate to output, or None to use the rate of the Project.
+			bitrate -- the target bit rate to encode at, or None to use the encoder default.
+			
+		Returns:
+			the gst-launch syntax string of the whole encoder.
+		"""
+		if samplerate and samplerate != self.sampleRate:
 			encodeBin = "audioresample ! audio/x-raw-float,rate=%d ! audioconvert ! %s" % (samplerate, encodeBin)
 		if bitrate:
 			encodeBin %= {'bitrate' : bitrate}
+		return encodeBin
+	
+	#_____________________________________________________________________
+	
+	def __StartExport(self, renderers, filename):
+		"""
+		Starts the Renderers of an export.
+		
+		Parameters:
+			renderers -- the OfflineRender.Renderers writing the exported files.
+			filename -- the file or folder which is shown as being exported to.
 			
-		#try to create encoder/muxer first, before modifying the main pipeline.
+		Considerations:
+			Raises ProjectManager.ProjectExportException if the encoder cannot be created.
+		"""
+		for renderer in renderers:
+			renderer.connect("finished", self.__ExportFinishedCb)
+		self.exportRenderers = renderers
+		self.__pendingExports = list(renderers)
+		
 		try:
-			self.encodebin = gst.parse_bin_from_description(encodeBin, True)
+			self.__StartPendingExports()
 		except gobject.GError, e:
+			# all the Renderers use the same encoder, so the first one has failed
+			self.exportRenderers = []
+			self.__pendingExports = []
 			if e.code == gst.PARSE_ERROR_NO_SUCH_ELEMENT:
 				error_no = ProjectManager.ProjectExportException.MISSING_ELEMENT
 			else:
 				error_no = ProjectManager.ProjectExportException.INVALID_ENCODE_BIN
 			raise ProjectManager.ProjectExportException(error_no, e.message)
-
-		#stop playback because some elements will be removed from the pipeline
-		self.Stop()
-		
-		#remove and unlink the alsasink
-		self.playbackbin.remove(self.masterSink, self.levelElement)
-		self.postAdderConvert.unlink(self.levelElement)
-		self.levelElement.unlink(self.masterSink)
 		
-		#create filesink
-		self.outfile = gst.element_factory_make("filesink", "export_file")
-		self.outfile.set_property("location", filename)
-		self.playbackbin.add(self.outfile)
-
-		self.playbackbin.add(self.encodebin)
-		self.postAdderConvert.link(self.encodebin)
-		self.encodebin.link(self.outfile)
-			
-		#disconnect the bus message handler so the levels don't change
-		self.bus.disconnect(self.Mhandler)
-		self.bus.disconnect(self.EOShandler)
-		self.EOShandler = self.bus.connect("message::eos", self.TerminateExport)
-		
-		self.exportPending = True
 		self.exportFilename = filename
-		#start the pipeline!
-		self.Play(newAudioState=self.AUDIO_EXPORTING)
 		self.emit("audio-state::export-start")
-
+	
 	#_____________________________________________________________________
 	
-	def TerminateExport(self, bus=None, message=None):
+	def __StartPendingExports(self):
 		"""
-		GStreamer End Of Stream handler. It is connected to eos on 
-		mainpipeline while export is taking place.
+		Starts the Renderers of the running export which are still waiting,
+		until as many are running as the "exportthreads" setting allows.
 		
-		Parameters:
-			bus -- reserved for GStreamer callbacks, don't use it explicitly.
-			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		Considerations:
+			Raises gobject.GError if the encoder cannot be created.
 		"""
-		
-		if not self.GetIsExporting():
-			return
+		limit = max(1, int(Globals.settings.general["exportthreads"]))
+		running = len([x for x in self.exportRenderers if x.isRunning])
+		while self.__pendingExports and running < limit:
+			self.__pendingExports.pop(0).Start()
+			running += 1
+	
+	#_____________________________________________________________________
+	
+	def TerminateExport(self):
+		"""
+		Cancels the running export, and deletes the unfinished files.
+		"""
+		self.__pendingExports = []
+		for renderer in self.exportRenderers:
+			renderer.Cancel()
 	
-		#stop playback because some elements will be removed from the pipeline
-		self.Stop()
+	#_____________________________________________________________________
 	
-		self.bus.disconnect(self.EOShandler)
-		self.Mhandler = self.bus.connect("message::element", self.__PipelineBusLevelCb)
-		self.EOShandler = self.bus.connect("message::eos", self.Stop)
+	def __ExportFinishedCb(self, renderer, error):
+		"""
+		Called when one of the export pipelines has stopped, either because
+		its file was written or because it failed or was cancelled. The export
+		is stopped once none of its pipelines are running.
 		
-		#remove the filesink and encoder
-		self.playbackbin.remove(self.outfile, self.encodebin)		
-		self.postAdderConvert.unlink(self.encodebin)
-			
-		#dispose of the elements
-		self.outfile.set_state(gst.STATE_NULL)
-		self.encodebin.set_state(gst.STATE_NULL)
-		del self.outfile, self.encodebin
-		
-		#re-add all the alsa playback elements
-		self.playbackbin.add(self.masterSink, self.levelElement)
-		self.postAdderConvert.link(self.levelElement)
-		self.levelElement.link(self.masterSink)
+		Parameters:
+			renderer -- the OfflineRender.Renderer which has stopped.
+			error -- the error message, or None if the file was written.
+		"""
+		if not self.exportRenderers:
+			return
+		
+		if error and not renderer.cancelled:
+			self.emit("gst-bus-error", error, "")
+			self.TerminateExport()
+		else:
+			try:
+				self.__StartPendingExports()
+			except gobject.GError, e:
+				self.emit("gst-bus-error", str(e), "")
+				self.TerminateExport()
 		
-		self.emit("audio-state::export-stop")
+		# cancelling the other pipelines above may have stopped the export already
+		if self.exportRenderers and not self.__pendingExports and \
+				not [x for x in self.exportRenderers if x.isRunning]:
+			self.exportRenderers = []
+			self.emit("audio-state::export-stop")
 	
 	#_____________________________________________________________________
 	
 	def GetExportProgress(self):
 		"""
 		Returns a tuple with the number of seconds exported
-		and the number of total seconds.
+		and the number of total seconds, adding up all the
+		files of the export.
 		"""
-		if self.exportPending or self.GetIsExporting():
-			try:
-				#total = self.mainpipeline.query_duration(gst.FORMAT_TIME)[0]
-				total = self.GetProjectLength() * gst.SECOND
-				current = self.mainpipeline.query_position(gst.FORMAT_TIME)[0]
-			except gst.QueryError:
-				return (-1, -1)
-			else:
-				if current > total:
-					total = current
-					self.TerminateExport()
-				return (float(current)/gst.SECOND, float(total)/gst.SECOND)
+		if self.exportRenderers:
+			progress = [x.GetProgress() for x in self.exportRenderers]
+			return (sum([x[0] for x in progress]), sum([x[1] for x in progress]))
 		else:
 			return (100, 100)
 		
@@ -578,10 +798,9 @@ class Project(gobject.GObject):
 	
 	def GetIsExporting(self):
 		"""
-		Returns true if the Project is not in the stopped state,
-		because paused, playing and recording are all forms of playing.
+		Returns true if the Project is being exported to a file.
 		"""
-		return self.audioState == self.AUDIO_EXPORTING
+		return bool(self.exportRenderers)
 	
 	#_____________________________________________________________________
 	
@@ -601,8 +820,6 @@ class Project(gobject.GObject):
 			self.emit("audio-state::stop")
 		elif newState == self.AUDIO_RECORDING:
 			self.emit("audio-state::record")
-		elif newState == self.AUDIO_EXPORTING:
-			self.exportPending = False
 		
 	#_____________________________________________________________________
 	
@@ -629,6 +846,7 @@ class Project(gobject.GObject):
 		for instr in recInstruments:
 			if instr.inTrack == index:
 				event = instr.GetRecordingEvent()
+				event.sampleRate = self.sampleRate
 				
 				encodeString = Globals.settings.recording["fileformat"]
 				# 0 means this encoder doesn't take a bitrate
@@ -733,6 +951,8 @@ class Project(gobject.GObject):
 	#_____________________________________________________________________
 	
 	def DumpDotFile(self):
+		if not self.mainpipeline:
+			return
 		basepath, ext = os.path.splitext(self.projectfile)
 		name = "jokosher-pipeline-" + os.path.basename(basepath)
 		gst.DEBUG_BIN_TO_DOT_FILE_WITH_TS(self.mainpipeline, gst.DEBUG_GRAPH_SHOW_ALL, name)
@@ -741,15 +961,30 @@ class Project(gobject.GObject):
 	
 	#_____________________________________________________________________
 	
-	def SaveProjectFile(self, path=None, backup=False):
+	def SaveProjectFile(self, path=None, backup=False, background=False):
 		"""
 		Saves the Project and its children as an XML file
 		to the path specified by file.
 		
 		Parameters:
 			path -- path to the Project file.
+			backup -- True if this is a backup copy, which should not
+					mark the Project as saved.
+			background -- True to serialize, compress and write the file in a
+					separate thread, from a snapshot of the Project taken now.
+					
+		Considerations:
+			Only one save is in progress at a time. If a background save is
+			still being written, this waits for it before starting.
+			
+			The Project is only marked as saved, and its .incremental file
+			deleted, once the file has been written. If a background save
+			fails, the "save-failed" signal is emitted; any other save raises
+			ProjectManager.SaveProjectError.
 		"""
 		
+		self.WaitForSave()
+		
 		if not path:
 			if not self.projectfile:
 				raise Exception("No save path specified!")
@@ -781,110 +1016,547 @@ class Project(gobject.GObject):
 		if not backup:
 			self.__unsavedChanges = False
 			#purge main undo stack so that it will not prompt to save on exit
+			self.__savedUndoStack.extend(self.__undoSpill.Pop())
+			self.__undoSpill.Clear()
 			self.__savedUndoStack.extend(self.__undoStack)
 			self.__undoStack = []
 			#purge savedRedoStack so that it will not prompt to save on exit
 			self.__redoStack.extend(self.__savedRedoStack)
 			self.__savedRedoStack = []
 			
-			# delete the incremental file since its all safe on disk now
-			basepath, ext = os.path.splitext(self.projectfile)
-			incr_path = basepath + self.INCREMENTAL_SAVE_EXT
-			try:
-				if os.path.exists(incr_path):
-					os.remove(incr_path)
-			except OSError:
-				Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+			# actions made from now on go to a new .incremental file,
+			# and the old one is only deleted once the Project file is on disk
+			retired = self.__RetireJournal()
+		else:
+			retired = None
 		
-		doc = xml.Document()
-		head = doc.createElement("JokosherProject")
-		doc.appendChild(head)
+		# copy the model on this thread, since it may change as soon as we return
+		history = self.__GenerateHistoryRecords(path)
+		try:
+			snapshot = self.__GetSnapshot()
+		except Exception, e:
+			error = self.__FinishSave(path, history, str(e) or e.__class__.__name__, backup, retired)
+			if background:
+				self.emit("save-failed", error)
+				return
+			raise ProjectManager.SaveProjectError(error)
+		
+		fragments = self.__GenerateProjectXML(snapshot)
+		if background:
+			# leave the serialization, compression and disk access to the thread
+			self.__saveThread = threading.Thread(target=self.__SaveThread,
+					args=(path, fragments, history, backup, retired))
+			self.__saveThread.start()
+			self.emit("undo")
+		else:
+			error = self.__WriteProjectFile(path, fragments, history, retired)
+			error = self.__FinishSave(path, history, error, backup, retired)
+			if error:
+				raise ProjectManager.SaveProjectError(error)
+	
+	#_____________________________________________________________________
+	
+	def __SaveThread(self, path, fragments, history, backup, retired):
+		"""
+		Writes the Project file on the thread of a background save,
+		and has the main thread finish the save once it is written.
+		
+		Parameters:
+			path -- path to the Project file.
+			fragments -- the generator returned by __GenerateProjectXML().
+			history -- the tuple returned by __GenerateHistoryRecords().
+			backup -- True if this is a backup copy.
+			retired -- the path the .incremental file was moved to, or None.
+		"""
+		error = self.__WriteProjectFile(path, fragments, history, retired)
+		self.__saveResult = (path, history, error, backup, retired)
+		gobject.idle_add(self.__SaveThreadDoneCb)
+	
+	#_____________________________________________________________________
+	
+	def __SaveThreadDoneCb(self):
+		"""
+		Finishes a background save on the main thread, unless
+		WaitForSave() has already done so.
+		
+		Returns:
+			False -- stop calling the callback on an idle_add.
+		"""
+		self.WaitForSave()
+		return False
+	
+	#_____________________________________________________________________
+	
+	def __FinishSave(self, path, history, error, backup, retired):
+		"""
+		Marks the Project as saved once its file has been written,
+		or puts back what has to be saved again if it was not.
 		
-		head.setAttribute("version", Globals.VERSION)
+		Parameters:
+			path -- path to the Project file.
+			history -- the tuple returned by __GenerateHistoryRecords().
+			error -- the error message, or None if the file was written.
+			backup -- True if this was a backup copy.
+			retired -- the path the .incremental file was moved to, or None.
+			
+		Returns:
+			the error message, or None if the file was written.
+		"""
+		self.__saveFailed = bool(error)
+		if error:
+			Globals.debug("Saving the project to %s failed: %s" % (path, error))
+			# the saved Project still refers to the old end of the history file
+			self.__historySize = history[1]
+			self.__historyFailed = True
+			if not backup:
+				self.__unsavedChanges = True
+				self.__RestoreJournal(retired)
+		else:
+			# the saved history is in the history file now, so it does not have to stay in memory
+			self.__TrimUndoHistory()
 		
-		params = doc.createElement("Parameters")
-		head.appendChild(params)
+		self.emit("undo")
+		return error
+	
+	#_____________________________________________________________________
+	
+	def __GetSnapshot(self):
+		"""
+		Copies what is saved in the Project file, so that it can be
+		serialized on another thread while the Project goes on changing.
+		Only the values are copied here; no XML is built.
 		
+		Returns:
+			a dictionary to pass to __GenerateProjectXML().
+		"""
 		items = ["viewScale", "viewStart", "name", "name_is_unset", "author", "volume",
-		         "transportMode", "bpm", "meter_nom", "meter_denom", "projectfile"]
+		         "transportMode", "bpm", "sampleRate", "meter_nom", "meter_denom", "projectfile"]
+		
+		return {"parameters" : Utils.CopyParameters(self, items),
+				"notes" : self.notes,
+				"history" : (self.__savedUndoStack.Count(), self.__redoStack.Count(), self.__historySize),
+				"instruments" : [x.GetSnapshot() for x in self.instruments] +
+						[x.GetSnapshot(graveyard=True) for x in self.graveyard]}
+	
+	#_____________________________________________________________________
+	
+	def __GenerateProjectXML(self, snapshot):
+		"""
+		Serializes the Project one piece at a time, so that the whole
+		document never has to be held in memory at once. Each top level
+		element is built in a small document of its own, which is
+		discarded once it has been rendered.
 		
-		Utils.StoreParametersToXML(self, doc, params, items)
+		Parameters:
+			snapshot -- the dictionary returned by __GetSnapshot().
 		
-		notesNode = doc.createElement("Notes")
-		head.appendChild(notesNode)
+		Returns:
+			a generator of strings which make up the Project file.
+		"""
+		yield '<?xml version="1.0" ?>\n'
+		yield '<JokosherProject version=%s>\n' % saxutils.quoteattr(Globals.VERSION)
 		
+		doc = xml.Document()
+		params = doc.createElement("Parameters")
+		Utils.StoreParameterValuesToXML(doc, params, snapshot["parameters"])
+		yield self.__RenderXMLFragment(params)
+		
+		notesNode = doc.createElement("Notes")
 		# use repr() because XML will not preserve whitespace charaters such as \n and \t.
-		notesNode.setAttribute("text", repr(self.notes))
+		notesNode.setAttribute("text", repr(snapshot["notes"]))
+		yield self.__RenderXMLFragment(notesNode)
+		
+		# the actions themselves are in the history file (see __GenerateHistoryRecords())
+		undo, redo, size = snapshot["history"]
+		history = doc.createElement("History")
+		history.setAttribute("undo", str(undo))
+		history.setAttribute("redo", str(redo))
+		history.setAttribute("size", str(size))
+		yield self.__RenderXMLFragment(history)
+		
+		for instr in snapshot["instruments"]:
+			fragment = doc.createElement("Fragment")
+			Instrument.Instrument.StoreSnapshotToXML(doc, fragment, instr)
+			# __RenderXMLFragment() frees the element, which leaves the fragment empty
+			yield self.__RenderXMLFragment(fragment.removeChild(fragment.firstChild))
+		
+		yield "</JokosherProject>\n"
+	
+	#_____________________________________________________________________
+	
+	def __RenderXMLFragment(self, node, indent="\t"):
+		"""
+		Renders an XML element and its children as indented text,
+		then frees the element.
+		
+		Parameters:
+			node -- the XML element to render.
+			indent -- the indentation of the element in the Project file.
 			
-		undo = doc.createElement("Undo")
-		head.appendChild(undo)
-		for action in self.__savedUndoStack:
-			actionXML = doc.createElement("Action")
-			undo.appendChild(actionXML)
-			action.StoreToXML(doc, actionXML)
+		Returns:
+			the XML text of the element.
+		"""
+		output = StringIO.StringIO()
+		node.writexml(output, indent, "\t", "\n")
+		node.unlink()
+		return output.getvalue()
+	
+	#_____________________________________________________________________
+	
+	def __GenerateHistoryRecords(self, path):
+		"""
+		Works out what has to be appended to the history file so that it
+		holds the saved undo and redo stacks, and marks the stacks as saved.
+		
+		Considerations:
+			Saving to a new location starts a new history file, so the whole
+			history is loaded and written out again.
+		
+		Parameters:
+			path -- path to the Project file.
 			
-		redo = doc.createElement("Redo")
-		head.appendChild(redo)
-		for action in self.__redoStack:
-			actionXML = doc.createElement("Action")
-			redo.appendChild(actionXML)
-			action.StoreToXML(doc, actionXML)
+		Returns:
+			a tuple with the path of the history file, the number of bytes at
+			the start of it which are kept, and the lines to append after them.
+		"""
+		historyfile = os.path.splitext(path)[0] + self.HISTORY_EXT
+		if historyfile != self.__historyFile or self.__historyFailed:
+			self.__LoadHistory()
+			self.__savedUndoStack.MarkUnsaved()
+			self.__redoStack.MarkUnsaved()
+			self.__historyFile = historyfile
+			self.__historySize = 0
+			self.__historyVersion = None
+			self.__historyFailed = False
+		
+		keptSize = self.__historySize
+		records = []
+		doc = xml.Document()
+		
+		if self.__historyVersion != Globals.VERSION:
+			node = doc.createElement("Version")
+			node.setAttribute("value", Globals.VERSION)
+			records.append(node)
+			self.__historyVersion = Globals.VERSION
+		
+		for tag, stack in (("Undo", self.__savedUndoStack), ("Redo", self.__redoStack)):
+			length, actions = stack.GetChanges()
+			if length is not None:
+				node = doc.createElement("Truncate")
+				node.setAttribute("stack", tag)
+				node.setAttribute("length", str(length))
+				records.append(node)
+			for action in actions:
+				node = doc.createElement("Action")
+				node.setAttribute("stack", tag)
+				action.StoreToXML(doc, node)
+				records.append(node)
+			stack.MarkSaved()
+		
+		lines = []
+		for node in records:
+			# one record per line, so line breaks in parameters have to be escaped
+			line = node.toxml().replace("\n", "&#10;").replace("\r", "&#13;")
+			lines.append(line.encode("utf-8") + "\n")
+			node.unlink()
+			self.__historySize += len(lines[-1])
+		
+		return historyfile, keptSize, lines
+	
+	#_____________________________________________________________________
+	
+	def __WriteHistoryFile(self, history):
+		"""
+		Appends the records from __GenerateHistoryRecords() to the history file,
+		dropping anything left after the saved part by a save which did not complete.
+		
+		Parameters:
+			history -- the tuple returned by __GenerateHistoryRecords().
+		"""
+		historyfile, keptSize, lines = history
+		if keptSize:
+			file_ = open(historyfile, "r+b")
+		else:
+			file_ = open(historyfile, "wb")
+		try:
+			file_.truncate(keptSize)
+			file_.seek(keptSize)
+			file_.writelines(lines)
+			file_.flush()
+			os.fsync(file_.fileno())
+		finally:
+			file_.close()
+	
+	#_____________________________________________________________________
+	
+	def __LoadHistory(self):
+		"""
+		Loads the parts of the saved undo and redo stacks which are
+		only in the history file so far.
+		"""
+		if not (self.__savedUndoStack.unloaded or self.__redoStack.unloaded):
+			return
+		
+		self.WaitForSave()
+		Globals.debug("Loading undo history from", self.__historyFile)
+		try:
+			stacks = ProjectManager.LoadHistoryFile(self.__historyFile, self.__historySize)
+		except Exception, e:
+			Globals.debug("Loading the undo history failed:", e)
+			stacks = {"Undo" : [], "Redo" : []}
+		
+		for tag, stack in (("Undo", self.__savedUndoStack), ("Redo", self.__redoStack)):
+			if len(stacks[tag]) < stack.unloaded:
+				Globals.debug("The history file is missing %s actions" % tag)
+				stack.unloaded = len(stacks[tag])
+				# write out what is left of the history on the next save
+				self.__historyFailed = True
+			stack.SetLoaded(stacks[tag])
+	
+	#_____________________________________________________________________
+	
+	def SetSavedHistory(self, undoCount, redoCount, size):
+		"""
+		Sets the sizes of the saved undo and redo stacks, which are kept
+		in the history file next to the Project file and are only loaded
+		when they are needed.
+		
+		Parameters:
+			undoCount -- the number of actions in the saved undo stack.
+			redoCount -- the number of actions in the saved redo stack.
+			size -- the number of bytes of the history file which belong to the Project.
+		"""
+		self.__savedUndoStack.SetUnloaded(undoCount)
+		self.__redoStack.SetUnloaded(redoCount)
+		self.__historyFile = os.path.splitext(self.projectfile)[0] + self.HISTORY_EXT
+		self.__historySize = size
+		self.__historyVersion = None
+	
+	#_____________________________________________________________________
+	
+	def __WriteProjectFile(self, path, fragments, history, retired=None):
+		"""
+		Compresses the serialized Project into a temporary file and moves it
+		over the Project file once it is safely on disk, so that a crash
+		while saving never leaves a truncated Project behind.
+		
+		Parameters:
+			path -- path to the Project file.
+			fragments -- the strings which make up the Project file.
+			history -- the records to append to the history file first
+					(see __GenerateHistoryRecords()).
+			retired -- the path the .incremental file was moved to, which is
+					deleted as soon as the Project file is in place, or None.
+					
+		Returns:
+			the error message, or None if the Project file was written.
+		"""
+		#append "~" in case the saving fails
+		temppath = path + "~"
+		try:
+			self.__WriteHistoryFile(history)
+			compression = int(Globals.settings.general["projectcompression"])
+			rawfile = open(temppath, "wb")
+			try:
+				gzipfile = gzip.GzipFile(os.path.basename(path), "wb", compression, rawfile)
+				for fragment in fragments:
+					if isinstance(fragment, unicode):
+						fragment = fragment.encode("utf-8")
+					gzipfile.write(fragment)
+				gzipfile.close()
+				rawfile.flush()
+				os.fsync(rawfile.fileno())
+			finally:
+				rawfile.close()
 			
-		for instr in self.instruments:
-			instr.StoreToXML(doc, head)
+			#if the saving doesn't fail, move it to the proper location
+			if os.name != "posix" and os.path.exists(path):
+				os.remove(path)
+			os.rename(temppath, path)
+		except Exception, e:
+			if os.path.exists(temppath):
+				os.remove(temppath)
+			return str(e) or e.__class__.__name__
+		
+		# the actions in the old .incremental file are all in the Project file now
+		if retired and os.path.exists(retired):
+			try:
+				os.remove(retired)
+			except OSError:
+				Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+		return None
+	
+	#_____________________________________________________________________
+	
+	def WaitForSave(self):
+		"""
+		Blocks until a save started with SaveProjectFile(background=True)
+		has finished writing the Project file.
+		
+		Returns:
+			True if the last save wrote the Project file.
+		"""
+		if not self.__saveThread:
+			return not self.__saveFailed
+		
+		self.__saveThread.join()
+		self.__saveThread = None
+		result, self.__saveResult = self.__saveResult, None
+		error = self.__FinishSave(*result)
+		if error:
+			self.emit("save-failed", error)
+		return not error
+	
+	#_____________________________________________________________________
+	
+	def SaveIncrementalAction(self, action):
+		if self.isDoingIncrementalRestore:
+			return
+		
+		if self.__performingUndo or self.__performingRedo:
+			return
+		
+		if not self.__journal:
+			# if we haven't performed an incremental save yet,
+			# the existing .incremental file is old, so it will be overwritten.
+			path, ext = os.path.splitext(self.projectfile)
+			self.__journal = IncrementalSave.Journal(path + self.INCREMENTAL_SAVE_EXT)
+			self.hasDoneIncrementalSave = True
+		
+		self.__journal.Append(action.StoreToString())
+		if self.__journal.appended >= int(Globals.settings.general["journalcheckpoint"]):
+			self.__CheckpointJournal()
+		
+		self.SetUnsavedChanges()
+		self.emit("incremental-save")
+	
+	#_____________________________________________________________________
+	
+	def __CheckpointJournal(self):
+		"""
+		Rewrites the .incremental file without the actions which would have
+		no effect when it is restored (see IncrementalSave.Compact()), so that
+		the restore time depends on the changes made, not on how long it took.
+		"""
+		self.__journal.Flush()
+		records = self.__LoadJournalRecords(self.__journal.filename)
+		compacted = IncrementalSave.Compact(records)
+		Globals.debug("Checkpoint of the .incremental file: %d of %d actions kept" % (len(compacted), len(records)))
+		self.__journal.Rewrite([string for string, action in compacted])
+	
+	#_____________________________________________________________________
+	
+	def __LoadJournalRecords(self, filename):
+		"""
+		Reads the actions from an .incremental file.
+		
+		Parameters:
+			filename -- the path of the .incremental file.
 			
-		for instr in self.graveyard:
-			instr.StoreToXML(doc, head, graveyard=True)
+		Returns:
+			a list of tuples with the string of each action,
+			and the IncrementalSave action loaded from it.
+		"""
+		records = []
+		for incr_xml in IncrementalSave.Journal.ReadRecords(filename):
+			records.append((incr_xml, IncrementalSave.LoadFromString(incr_xml)))
+		return records
+	
+	#_____________________________________________________________________
+	
+	def FlushIncrementalSave(self):
+		"""
+		Writes any incremental save actions which are waiting
+		for the next batch to the .incremental file.
+		"""
+		if self.__journal:
+			self.__journal.Flush()
+	
+	#_____________________________________________________________________
+	
+	def __RetireJournal(self):
+		"""
+		Moves the .incremental file aside while the Project is being saved,
+		so that a new one is started for the actions made in the meantime.
 		
+		Returns:
+			the path the file was moved to, or None if there was no file.
+		"""
+		path, ext = os.path.splitext(self.projectfile)
+		filename = path + self.INCREMENTAL_SAVE_EXT
+		retired = path + self.SAVING_JOURNAL_EXT
 		try:
-			#append "~" in case the saving fails
-			gzipfile = gzip.GzipFile(path +"~", "w")
-			gzipfile.write(doc.toprettyxml())
-			gzipfile.close()
-		except:
-			os.remove(path + "~")
-		else:
-			#if the saving doesn't fail, move it to the proper location
-			if os.path.exists(path):
-				os.remove(path)
-			os.rename(path + "~", path)		
-		
-		self.emit("undo")
+			if self.__journal:
+				self.__journal.Close()
+				self.__journal = None
+			if os.path.exists(retired):
+				# left behind by a save which did not finish, so it comes first
+				self.__RestoreJournal(retired)
+				if self.__journal:
+					self.__journal.Close()
+					self.__journal = None
+			if not os.path.exists(filename):
+				return None
+			os.rename(filename, retired)
+		except (IOError, OSError), e:
+			Globals.debug("Cannot move the .incremental file aside:", e)
+			return None
+		return retired
 	
 	#_____________________________________________________________________
 	
-	def SaveIncrementalAction(self, action):
-		if self.isDoingIncrementalRestore:
-			return
+	def __RestoreJournal(self, retired):
+		"""
+		Puts the actions of a .incremental file moved aside by __RetireJournal()
+		back in front of the actions logged since, when the save failed.
 		
-		if self.__performingUndo or self.__performingRedo:
+		Parameters:
+			retired -- the path the file was moved to, or None.
+		"""
+		if not retired or not os.path.exists(retired):
 			return
 		
 		path, ext = os.path.splitext(self.projectfile)
 		filename = path + self.INCREMENTAL_SAVE_EXT
-		
-		if self.hasDoneIncrementalSave:
-			incr_file = open(filename, "a")
-		else:
-			# if we haven't performed an incremental save yet,
-			# the existing .incremental file is old, so overwrite it.
-			incr_file = open(filename, "w")
-			self.hasDoneIncrementalSave = True
-		
-		incr_file.write(action.StoreToString())
-		incr_file.write(self.INCREMENTAL_SAVE_DELIMITER)
-		
-		incr_file.close()
-		
-		self.SetUnsavedChanges()
-		self.emit("incremental-save")
+		try:
+			strings = IncrementalSave.Journal.ReadRecords(retired)
+			if self.__journal:
+				self.__journal.Flush()
+			if os.path.exists(filename):
+				strings += IncrementalSave.Journal.ReadRecords(filename)
+			if not self.__journal:
+				self.__journal = IncrementalSave.Journal(filename)
+				self.hasDoneIncrementalSave = True
+			self.__journal.Rewrite(strings)
+			os.remove(retired)
+		except (IOError, OSError), e:
+			Globals.debug("Cannot restore the .incremental file:", e)
+	
+	#_____________________________________________________________________
+	
+	def __DeleteJournal(self):
+		"""
+		Deletes the .incremental file, along with any actions
+		which are waiting to be written to it.
+		"""
+		path, ext = os.path.splitext(self.projectfile)
+		filename = path + self.INCREMENTAL_SAVE_EXT
+		try:
+			if self.__journal:
+				self.__journal.Delete()
+				self.__journal = None
+			for journal in (filename, path + self.SAVING_JOURNAL_EXT):
+				if os.path.exists(journal):
+					os.remove(journal)
+		except OSError:
+			Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
 	
 	#_____________________________________________________________________
 	
 	def CanDoIncrementalRestore(self):
 		path, ext = os.path.splitext(self.projectfile)
 		filename = path + self.INCREMENTAL_SAVE_EXT
-		return os.path.exists(filename)	
+		return os.path.exists(filename) or os.path.exists(path + self.SAVING_JOURNAL_EXT)
 	
 	#_____________________________________________________________________
 	
@@ -901,28 +1573,34 @@ class Project(gobject.GObject):
 		path, ext = os.path.splitext(self.projectfile)
 		filename = path + self.INCREMENTAL_SAVE_EXT
 		
-		save_action_list = []
-		
-		if os.path.isfile(filename):
-			incr_file = open(filename, "r")
-			filetext = incr_file.read()
-			incr_file.close()
-			for incr_xml in filetext.split(self.INCREMENTAL_SAVE_DELIMITER):
-				incr_xml = incr_xml.strip()
-				if incr_xml:
-					incr_action = IncrementalSave.LoadFromString(incr_xml)
-					save_action_list.append(incr_action)
+		records = []
+		# the actions of a save which did not finish come before the newer ones
+		for journal in (path + self.SAVING_JOURNAL_EXT, filename):
+			if os.path.isfile(journal):
+				records += self.__LoadJournalRecords(journal)
+		records = IncrementalSave.Compact(records)
+		save_action_list = [action for string, action in records]
 		
+		# all the signals are sent once the whole journal has been replayed,
+		# and the pipeline is only built when the Project is first played.
 		self.isDoingIncrementalRestore = True
+		self.BeginUpdate()
 		try:
 			IncrementalSave.FilterAndExecuteAll(save_action_list, self)
 		except:
 			Globals.debug("Exception while restoring incremental save.",
 						"Project state is surely out of sync with .incremental file")
 			raise
+		finally:
+			self.EndUpdate()
 		
 		# set hasDoneIncrementSave to True because project is now in sync with .incremental file
 		# i.e. we don't have to destory the .incremental file because the states match up.
+		# It is written out again compacted, without any incomplete record at the end.
+		self.__journal = IncrementalSave.Journal(filename)
+		self.__journal.Rewrite([string for string, action in records])
+		if os.path.exists(path + self.SAVING_JOURNAL_EXT):
+			os.remove(path + self.SAVING_JOURNAL_EXT)
 		self.hasDoneIncrementalSave = True
 		self.isDoingIncrementalRestore = False
 		return True
@@ -934,23 +1612,32 @@ class Project(gobject.GObject):
 		Closes down this Project.
 		"""
 		
+		self.WaitForSave()
+		self.TerminateExport()
+		DecodeCache.Cancel()
+		for instr in self.instruments:
+			if instr.freezeRenderer:
+				instr.freezeRenderer.Cancel()
+		
 		# when closing the file, the user chooses to either save, or discard
 		# in either case, we don't need the incremental save file anymore
-		path, ext = os.path.splitext(self.projectfile)
-		filename = path + self.INCREMENTAL_SAVE_EXT
-		try:
-			if os.path.exists(filename):
-				os.remove(filename)
-		except OSError:
-			Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+		self.__DeleteJournal()
 		
+		droppedPooled = False
 		for file in self.deleteOnCloseAudioFiles:
 			if os.path.exists(file):
+				droppedPooled = droppedPooled or AudioPool.IsPooled(file)
 				Globals.debug("Deleting copied audio file:", file)
 				os.remove(file)
 		self.deleteOnCloseAudioFiles = []
+		self.__undoSpill.Clear()
 		
-		self.mainpipeline.set_state(gst.STATE_NULL)
+		# only go through the whole pool if this Project let go of some of it
+		if droppedPooled:
+			AudioPool.Collect()
+		
+		if self.mainpipeline:
+			self.mainpipeline.set_state(gst.STATE_NULL)
 		
 	#_____________________________________________________________________
 	
@@ -961,11 +1648,17 @@ class Project(gobject.GObject):
 		"""
 		self.__performingUndo = True
 		
+		if not len(self.__undoStack) and self.__undoSpill.Count():
+			limit = int(Globals.settings.general["undolimit"])
+			self.__undoStack[:0] = self.__undoSpill.Pop(max(1, limit / 2))
+		
 		if len(self.__undoStack):
 			cmd = self.__undoStack.pop()
 			self.ExecuteAction(cmd)
 			
-		elif len(self.__savedUndoStack):
+		elif self.__savedUndoStack.Count():
+			if not len(self.__savedUndoStack):
+				self.__LoadHistory()
 			self.__savedUndo = True
 			cmd = self.__savedUndoStack.pop()
 			self.ExecuteAction(cmd)
@@ -991,7 +1684,9 @@ class Project(gobject.GObject):
 			self.ExecuteAction(cmd)
 			self.__savedUndo = False
 			
-		elif len(self.__redoStack):
+		elif self.__redoStack.Count():
+			if not len(self.__redoStack):
+				self.__LoadHistory()
 			cmd = self.__redoStack.pop()
 			self.ExecuteAction(cmd)
 			
@@ -1021,17 +1716,104 @@ class Project(gobject.GObject):
 			self.__undoStack.append(object)
 		else:
 			self.__undoStack.append(object)
-			self.__redoStack = []
+			self.__redoStack.Clear()
 			#if we have undone anything that was previously saved
 			if len(self.__savedRedoStack):
 				self.__savedRedoStack = []
 				#since there is no other record that something has 
 				#changed after savedRedoStack is purged
 				self.__unsavedChanges = True
+		self.__TrimUndoHistory()
 		self.emit("undo")
 	
 	#_____________________________________________________________________
 	
+	def MergeUndoAction(self, undoAction):
+		"""
+		Merges an undo action which has just been added into the one before it,
+		if both hold a single undo command of the same kind on the same object,
+		and they were made within the "undomergewindow" setting of each other.
+		Undoing the merged action then goes back to the value from before the
+		first of them, so that nudging an Event several times, for example,
+		is undone in one step.
+		
+		Considerations:
+			This is only meant for undo commands which set a value back
+			(see the merge option of UndoSystem.UndoCommand()).
+			
+			The merge is written to the .incremental file. While restoring
+			from it, the actions are only merged where the file says so,
+			since the time between them is lost.
+		
+		Parameters:
+			undoAction -- the AtomicUndoAction which was just added.
+		"""
+		if self.__performingUndo or self.__performingRedo or self.isDoingIncrementalRestore:
+			return
+		if len(self.__undoStack) < 2 or self.__undoStack[-1] is not undoAction:
+			return
+		
+		previous = self.__undoStack[-2]
+		commands = undoAction.GetUndoCommands()
+		previousCommands = previous.GetUndoCommands()
+		if len(commands) != 1 or len(previousCommands) != 1:
+			return
+		if commands[0][:2] != previousCommands[0][:2]:
+			return
+		
+		window = float(Globals.settings.general["undomergewindow"]) / 1000
+		if undoAction.time - previous.time <= window:
+			self.MergeLastUndoActions()
+			self.SaveIncrementalAction(IncrementalSave.MergeLastUndoActions())
+	
+	#_____________________________________________________________________
+	
+	def MergeLastUndoActions(self):
+		"""
+		Merges the last undo action into the one before it, as decided by
+		MergeUndoAction(), so that undoing them goes back to the value from
+		before the first of them.
+		"""
+		if len(self.__undoStack) < 2:
+			return
+		
+		undoAction = self.__undoStack.pop()
+		# keep merging as long as the edits keep coming
+		self.__undoStack[-1].time = undoAction.time
+	
+	#_____________________________________________________________________
+	
+	def __TrimUndoHistory(self):
+		"""
+		Keeps the number of undo actions in memory, and the memory they use,
+		within the "undolimit" and "undomemory" settings. The oldest saved actions
+		are dropped from memory, since they are in the history file and can be
+		loaded again, and then the oldest unsaved ones are moved to a temporary file.
+		The most recent undo action always stays in memory.
+		"""
+		limit = int(Globals.settings.general["undolimit"])
+		maxSize = int(Globals.settings.general["undomemory"])
+		
+		actions = list(self.__savedUndoStack) + self.__undoStack
+		count = len(actions)
+		size = sum([action.GetSize() for action in actions])
+		if count <= limit and size <= maxSize:
+			return
+		
+		# the number of actions to move out of memory, oldest first
+		drop = 0
+		while drop < count - 1 and (count - drop > limit or size > maxSize):
+			size -= actions[drop].GetSize()
+			drop += 1
+		
+		drop -= self.__savedUndoStack.Unload(drop)
+		drop = min(drop, len(self.__undoStack) - 1)
+		if drop > 0:
+			self.__undoSpill.Push(self.__undoStack[:drop])
+			del self.__undoStack[:drop]
+	
+	#_____________________________________________________________________
+	
 	def NewAtomicUndoAction(self):
 		"""
 		Creates a new AtomicUndoAction and adds to the
@@ -1046,6 +1828,124 @@ class Project(gobject.GObject):
 		
 	#_____________________________________________________________________
 	
+	def BeginUpdate(self):
+		"""
+		Starts an edit transaction. Until the matching EndUpdate() call, signals
+		emitted by this Project, its Instruments and its Events are held back,
+		and identical signals without parameters are only emitted once. Updates
+		to the GStreamer sources of Events are also deferred and only applied once.
+		
+		Considerations:
+			Calls can be nested, and every call must be matched by a call to
+			EndUpdate(), so it should be placed in a finally block.
+		"""
+		self.__updateDepth += 1
+		if self.__updateDepth == 1:
+			for instr in self.instruments:
+				instr.FreezeComposition(True)
+	
+	#_____________________________________________________________________
+	
+	def EndUpdate(self):
+		"""
+		Ends an edit transaction started by BeginUpdate(). When the outermost
+		transaction ends, the deferred Event properties are applied and the
+		deferred signals are emitted in the order they were last emitted.
+		"""
+		self.__updateDepth -= 1
+		if self.__updateDepth > 0:
+			return
+		
+		self.__updateDepth = 0
+		events = self.__pendingEvents.values()
+		self.__pendingEvents = {}
+		events.sort()
+		liveEvents = set()
+		for instr in self.instruments:
+			liveEvents.update([id(ev) for ev in instr.events])
+		for event in events:
+			# skip the Events that have been deleted in the meantime
+			if id(event) in liveEvents:
+				event.SetProperties()
+		
+		# let every composition update its timeline once for the whole transaction
+		for instr in self.instruments + self.graveyard:
+			instr.FreezeComposition(False)
+		
+		signals = self.__pendingSignals.values()
+		signals.sort()
+		self.__pendingSignals = {}
+		for order, obj, signal, args in signals:
+			gobject.GObject.emit(obj, signal, *args)
+	
+	#_____________________________________________________________________
+	
+	def IsUpdating(self):
+		"""
+		Returns True if an edit transaction is currently in progress.
+		"""
+		return self.__updateDepth > 0
+	
+	#_____________________________________________________________________
+	
+	def DeferSignal(self, obj, signal, args):
+		"""
+		Holds back a signal until the current edit transaction ends.
+		
+		Parameters:
+			obj -- the Project, Instrument or Event emitting the signal.
+			signal -- the name of the signal (including any detail).
+			args -- tuple with the parameters of the signal.
+			
+		Returns:
+			True -- the signal was deferred.
+			False -- there is no transaction, so the signal must be emitted now.
+		"""
+		if not self.__updateDepth:
+			return False
+		
+		self.__updateCounter += 1
+		if args:
+			# the order of signals with parameters matters (ie event::added
+			# and event::removed) so never merge them.
+			key = self.__updateCounter
+		else:
+			key = (id(obj), signal)
+		self.__pendingSignals[key] = (self.__updateCounter, obj, signal, args)
+		return True
+	
+	#_____________________________________________________________________
+	
+	def DeferSetProperties(self, event):
+		"""
+		Holds back the update of an Event's GStreamer source until the
+		current edit transaction ends.
+		
+		Parameters:
+			event -- the Event whose SetProperties() call should be deferred.
+			
+		Returns:
+			True -- the update was deferred.
+			False -- there is no transaction, so the update must be done now.
+		"""
+		if not self.__updateDepth:
+			return False
+		
+		self.__pendingEvents[id(event)] = event
+		return True
+	
+	#_____________________________________________________________________
+	
+	def emit(self, signal, *args):
+		"""
+		Emits the given signal, unless an edit transaction is in progress,
+		in which case it is emitted when the transaction ends.
+		"""
+		if not self.DeferSignal(self, signal, args):
+			gobject.GObject.emit(self, signal, *args)
+	
+	#_____________________________________________________________________
+	
 	def CheckUnsavedChanges(self):
 		"""
 		Uses boolean self.__unsavedChanges and Undo/Redo to 
@@ -1057,6 +1957,7 @@ class Project(gobject.GObject):
 		"""
 		return self.__unsavedChanges or \
 			len(self.__undoStack) > 0 or \
+			self.__undoSpill.Count() > 0 or \
 			len(self.__savedRedoStack) > 0
 	
 	#_____________________________________________________________________
@@ -1075,7 +1976,7 @@ class Project(gobject.GObject):
 			True -- there is another undo command in the stack that can be performed.
 			False -- there are no available undo commands.
 		"""
-		return bool(len(self.__undoStack) or len(self.__savedUndoStack))
+		return bool(len(self.__undoStack) or self.__undoSpill.Count() or self.__savedUndoStack.Count())
 	
 	#_____________________________________________________________________
 	
@@ -1087,7 +1988,7 @@ class Project(gobject.GObject):
 			True -- there is another redo command in the stack that can be performed.
 			False -- there are no available redo commands.
 		"""
-		return bool(len(self.__redoStack) or len(self.__savedRedoStack))
+		return bool(self.__redoStack.Count() or len(self.__savedRedoStack))
 	
 	#_____________________________________________________________________
 	
@@ -1135,7 +2036,7 @@ class Project(gobject.GObject):
 				
 	#_____________________________________________________________________
 	
-	@UndoSystem.UndoCommand("SetBPM", "temp")
+	@UndoSystem.UndoCommand("SetBPM", "temp", merge=True)
 	def SetBPM(self, bpm):
 		"""
 		Changes the current beats per minute.
@@ -1152,7 +2053,35 @@ class Project(gobject.GObject):
 	
 	#_____________________________________________________________________
 
-	@UndoSystem.UndoCommand("SetMeter", "temp", "temp1")
+	@UndoSystem.UndoCommand("SetSampleRate", "temp", merge=True)
+	def SetSampleRate(self, rate):
+		"""
+		Changes the sample rate the Instruments are mixed, recorded and
+		exported at. The Events whose files are at another rate are resampled.
+		
+		Parameters:
+			rate -- the new sample rate in Hz.
+			
+		Considerations:
+			The Project is stopped first if it is playing or recording,
+			because the running pipeline cannot change its rate.
+		"""
+		self.temp = self.sampleRate
+		if self.sampleRate != rate:
+			if self.GetIsPlaying():
+				self.Stop()
+			self.sampleRate = rate
+			self.__UpdateMixCaps()
+			# play the copies decoded at the new rate (see DecodeCache)
+			for instr in self.instruments:
+				for event in instr.events:
+					if event.gnlsrc:
+						event.SetProperties()
+			self.emit("sample-rate")
+	
+	#_____________________________________________________________________
+
+	@UndoSystem.UndoCommand("SetMeter", "temp", "temp1", merge=True)
 	def SetMeter(self, nom, denom):
 		"""
 		Changes the current time signature.
@@ -1208,11 +2137,152 @@ class Project(gobject.GObject):
 			instrumentList -- a list of Instrument instances to be removed.
 		"""
 		undoAction = self.NewAtomicUndoAction()
-		for instrOrEvent in instrumentOrEventList:
-			if isinstance(instrOrEvent, Instrument.Instrument):
-				self.DeleteInstrument(instrOrEvent.id, _undoAction_=undoAction)
-			elif isinstance(instrOrEvent, Event.Event):
-				instrOrEvent.instrument.DeleteEvent(instrOrEvent.id, _undoAction_=undoAction)
+		eventIDs = []
+		self.BeginUpdate()
+		try:
+			for instrOrEvent in instrumentOrEventList:
+				if isinstance(instrOrEvent, Instrument.Instrument):
+					self.DeleteInstrument(instrOrEvent.id, _undoAction_=undoAction)
+				elif isinstance(instrOrEvent, Event.Event):
+					eventIDs.append(instrOrEvent.id)
+			
+			if eventIDs:
+				self.DeleteEvents(eventIDs, undoAction)
+		finally:
+			self.EndUpdate()
+	
+	#_____________________________________________________________________
+	
+	def __GroupEventsByInstrument(self, eventIDs):
+		"""
+		Finds the Events with the given IDs in the Project.
+		
+		Parameters:
+			eventIDs -- list of Event IDs.
+		
+		Returns:
+			a list of (Instrument, list of Events) tuples, with the Events
+			of each Instrument sorted by their start time.
+		"""
+		wanted = set(eventIDs)
+		groups = []
+		for instr in self.instruments:
+			events = [ev for ev in instr.events if ev.id in wanted]
+			if events:
+				events.sort()
+				groups.append((instr, events))
+		return groups
+	
+	#_____________________________________________________________________
+	
+	def DeleteEvents(self, eventIDs, undoAction=None):
+		"""
+		Removes several Events from the Project at once, as a single undo action.
+		
+		Parameters:
+			eventIDs -- list of IDs of the Events to be removed.
+			undoAction -- the AtomicUndoAction to add the commands to,
+						or None to create a new one.
+		"""
+		if not undoAction:
+			undoAction = self.NewAtomicUndoAction()
+		
+		wanted = set(eventIDs)
+		self.BeginUpdate()
+		try:
+			for instr in self.instruments:
+				instr.DeleteEvents(wanted, undoAction)
+		finally:
+			self.EndUpdate()
+	
+	#_____________________________________________________________________
+	
+	def MoveEvents(self, eventIDs, delta, undoAction=None):
+		"""
+		Moves several Events in time by the same amount, as a single undo action.
+		The move is clamped so that no Event ends up before the start of the Project.
+		
+		Parameters:
+			eventIDs -- list of IDs of the Events to be moved.
+			delta -- the time in seconds to move the Events by (negative to move left).
+			undoAction -- the AtomicUndoAction to add the commands to,
+						or None to create a new one.
+		
+		Returns:
+			True -- the Events were moved.
+			False -- the Events were not moved, because they would overlap
+					Events that are not being moved.
+		"""
+		groups = self.__GroupEventsByInstrument(eventIDs)
+		if not groups:
+			return False
+		
+		delta = max(delta, -min([events[0].start for instr, events in groups]))
+		if not delta:
+			return False
+		
+		for instr, events in groups:
+			moving = set([id(ev) for ev in events])
+			for event in events:
+				start = event.start + delta
+				for other in instr.GetEventsInRange(start, start + event.duration):
+					if id(other) not in moving:
+						return False
+		
+		if not undoAction:
+			undoAction = self.NewAtomicUndoAction()
+		
+		self.BeginUpdate()
+		try:
+			for instr, events in groups:
+				for event in events:
+					event.Move(event.start + delta, _undoAction_=undoAction)
+		finally:
+			self.EndUpdate()
+		
+		return True
+	
+	#_____________________________________________________________________
+	
+	def SplitEventsAt(self, times, eventIDs=None, undoAction=None):
+		"""
+		Splits Events at each of the given times (for example, every bar line),
+		as a single undo action.
+		
+		Parameters:
+			times -- list of times in seconds to split at.
+			eventIDs -- list of IDs of the Events to split, or None to
+						split every Event in the Project.
+			undoAction -- the AtomicUndoAction to add the commands to,
+						or None to create a new one.
+		"""
+		times = sorted(set(times))
+		if not times:
+			return
+		
+		if eventIDs is None:
+			groups = [(instr, instr.events[:]) for instr in self.instruments]
+		else:
+			groups = self.__GroupEventsByInstrument(eventIDs)
+		
+		if not undoAction:
+			undoAction = self.NewAtomicUndoAction()
+		
+		self.BeginUpdate()
+		try:
+			for instr, events in groups:
+				for event in events:
+					if event.isLoading or event.isRecording:
+						continue
+					
+					first = bisect.bisect_right(times, event.start)
+					last = bisect.bisect_left(times, event.start + event.duration)
+					# split from the right, so the left piece keeps its ID and
+					# the remaining split points stay inside it.
+					for split in reversed(times[first:last]):
+						event.SplitEvent(split - event.start, _undoAction_=undoAction)
+		finally:
+			self.EndUpdate()
 	
 	#_____________________________________________________________________
 	
@@ -1274,6 +2344,8 @@ class Project(gobject.GObject):
 		
 		for event in instr.events:
 			event.StopGenerateWaveform(False)
+			event.UpdateProjectLength(removed=True)
+		instr.ReleasePipeline()
 			
 		self.temp = id
 		self.emit("instrument::removed", instr)
@@ -1290,6 +2362,8 @@ class Project(gobject.GObject):
 		"""
 		instr = [x for x in self.graveyard if x.id == id][0]
 		
+		for event in instr.events:
+			event.RestoreResources()
 		instr.AddAndLinkPlaybackbin()
 		
 		self.instruments.append(instr)
@@ -1298,7 +2372,8 @@ class Project(gobject.GObject):
 			self.OnAllInstrumentsMute()
 			
 		for event in instr.events:
-			if event.isLoading:
+			event.UpdateProjectLength()
+			if event.isLoading or not event.levels_list:
 				event.GenerateWaveform()
 		
 		instr.isVisible = True
@@ -1414,12 +2489,36 @@ class Project(gobject.GObject):
 		Returns:
 			lenght of the Project in seconds.
 		"""
-		length = 0
+		if self.__projectLength is None:
+			length = 0
+			for instr in self.instruments:
+				for event in instr.events:
+					size = event.start + max(event.duration, event.loadingLength)
+					length = max(length, size)
+			self.__projectLength = length
+		return self.__projectLength
+	
+	#_____________________________________________________________________
+	
+	def UpdateProjectLength(self, oldEnd, newEnd):
+		"""
+		Updates the cached Project length when the end of an Event has
+		changed, and grows the Instrument compositions if they no longer
+		reach far enough past the end of the Project.
+		
+		Parameters:
+			oldEnd -- the previous end time in seconds of the Event (0 if it was just added).
+			newEnd -- the new end time in seconds of the Event (0 if it was removed).
+		"""
+		if self.__projectLength is not None:
+			if newEnd >= self.__projectLength:
+				self.__projectLength = newEnd
+			elif oldEnd >= self.__projectLength:
+				#the Event at the end of the Project got shorter, so recalculate on next use
+				self.__projectLength = None
+		
 		for instr in self.instruments:
-			for event in instr.events:
-				size = event.start + max(event.duration, event.loadingLength)
-				length = max(length, size)
-		return length
+			instr.UpdateCompositionExtent(newEnd)
 
 	#_____________________________________________________________________
 	
@@ -1506,6 +2605,9 @@ class Project(gobject.GObject):
 		Prepares the click track.
 		"""
 
+		if not self.clickTrackController:
+			return
+		
 		self.ClearClickTimes()
 
 		second = 1000000000
@@ -1535,9 +2637,10 @@ class Project(gobject.GObject):
 			value -- The volume of the click track between 0.0 and 1.0
 		"""
 		if self.clickVolumeValue != value:
-			self.clickTrackVolume.set_property("mute", (value < 0.01))
-			# convert the 0.0 to 1.0 range to 0.0 to 2.0 range (to let the user make it twice as loud)
-			self.clickTrackVolume.set_property("volume", value * 2)
+			if self.clickTrackVolume:
+				self.clickTrackVolume.set_property("mute", (value < 0.01))
+				# convert the 0.0 to 1.0 range to 0.0 to 2.0 range (to let the user make it twice as loud)
+				self.clickTrackVolume.set_property("volume", value * 2)
 			self.clickVolumeValue = value
 			self.emit("click-track", value)
 
@@ -1547,7 +2650,8 @@ class Project(gobject.GObject):
 		"""
 		Clears the click track controller times.
 		"""
-		self.clickTrackController.unset_all("volume")
+		if self.clickTrackController:
+			self.clickTrackController.unset_all("volume")
 		
 	#_____________________________________________________________________
 	
@@ -1557,9 +2661,7 @@ class Project(gobject.GObject):
 		the pipeline to use that sink.
 		"""
 		
-		if self.audioState == self.AUDIO_EXPORTING:
-			#we're exporting so some encoders and a filesink are hooked up
-			#changing that would mess everything up.
+		if not self.mainpipeline:
 			return
 		
 		if self.audioState != self.AUDIO_STOPPED:
@@ -1580,8 +2682,7 @@ class Project(gobject.GObject):
 		Grabs the sink element device based on the Global preferences, and sets
 		the pipeline to use that device.
 		"""
-		if self.audioState != self.AUDIO_EXPORTING and \
-		   self.audioState != self.AUDIO_STOPPED:
+		if self.audioState != self.AUDIO_STOPPED:
 			self.Stop()
 			
 		if not self.masterSink:
@@ -1676,11 +2777,142 @@ class Project(gobject.GObject):
 					abs_audio_files.add(event.file)
 				else:
 					rel_audio_files.add(event.file)
+			
+			if instrument.frozenFile:
+				rel_audio_files.add(instrument.frozenFile)
 					
 		return abs_audio_files, rel_audio_files, levels_files
 	
 	#____________________________________________________________________	
 	
+	def CompactProject(self, keepHistory=None, archivePath=None):
+		"""
+		Removes the files in the audio and levels directories which are not
+		used by any Event, including the deleted ones which undo can bring back.
+		
+		Parameters:
+			keepHistory -- the number of the most recent undo actions to keep,
+					or None to keep the whole history. The older actions, the
+					redo history, and the deleted Instruments and Events which
+					only they could bring back are discarded, and the Project
+					is saved so that its file no longer refers to them.
+			archivePath -- a directory to move the unused files into,
+					or None to delete them.
+					
+		Returns:
+			the number of bytes reclaimed.
+			
+		Considerations:
+			Files which will be deleted when the Project is closed, and files
+			the .incremental file adds Events from, are always kept, since
+			they are needed to recover the Project if Jokosher crashes.
+			
+			Nothing is removed unless the Project file on disk is up to date
+			with the last save, since it may still refer to any of the files.
+			ProjectManager.SaveProjectError is raised instead.
+		"""
+		if not self.WaitForSave():
+			raise ProjectManager.SaveProjectError("The last save of the project failed")
+		if keepHistory is not None:
+			self.__PruneHistory(keepHistory)
+			# raises SaveProjectError, before anything is removed, if the file is not written
+			self.SaveProjectFile()
+		
+		abs_audio_files, rel_audio_files, levels_files = self.GetAudioAndLevelsFilenames(include_deleted=True)
+		used = set([os.path.join(self.audio_path, x) for x in rel_audio_files])
+		used.update([os.path.join(self.levels_path, x) for x in levels_files])
+		used.update(self.deleteOnCloseAudioFiles)
+		
+		self.FlushIncrementalSave()
+		basepath = os.path.splitext(self.projectfile)[0]
+		for journalfile in (basepath + self.INCREMENTAL_SAVE_EXT, basepath + self.SAVING_JOURNAL_EXT):
+			if not os.path.exists(journalfile):
+				continue
+			for incr_xml, action in self.__LoadJournalRecords(journalfile):
+				if isinstance(action, IncrementalSave.NewEvent):
+					used.add(os.path.join(self.audio_path, action.filename))
+		
+		reclaimed = 0
+		for directory in (self.audio_path, self.levels_path):
+			if not os.path.isdir(directory):
+				continue
+			for filename in os.listdir(directory):
+				path = os.path.join(directory, filename)
+				if path in used or not os.path.isfile(path):
+					continue
+				
+				stat = os.stat(path)
+				# a file from the audio pool is only freed with its last reference
+				if stat.st_nlink == 1:
+					reclaimed += stat.st_size
+				
+				if archivePath:
+					archive = os.path.join(archivePath, os.path.basename(directory))
+					if not os.path.isdir(archive):
+						os.makedirs(archive)
+					Globals.debug("Archiving unused file:", path)
+					shutil.move(path, os.path.join(archive, filename))
+				else:
+					Globals.debug("Deleting unused file:", path)
+					os.remove(path)
+		
+		if AudioPool.IsEnabled():
+			reclaimed += AudioPool.Collect()
+		
+		return reclaimed
+	
+	#____________________________________________________________________	
+	
+	def __PruneHistory(self, keep):
+		"""
+		Discards all but the most recent undo actions and the whole redo
+		history, then empties the graveyards of everything which no
+		remaining action refers to.
+		
+		Parameters:
+			keep -- the number of undo actions to keep.
+		"""
+		self.__LoadHistory()
+		actions = list(self.__savedUndoStack) + self.__undoSpill.Pop() + self.__undoStack
+		actions = actions[max(0, len(actions) - keep):]
+		
+		self.__savedUndoStack.Clear()
+		self.__savedUndoStack.extend(actions)
+		self.__undoSpill.Clear()
+		self.__undoStack = []
+		self.__redoStack.Clear()
+		self.__savedRedoStack = []
+		# the history file still has the discarded actions, so it is written again
+		self.__historyFailed = True
+		
+		# IDs are unique in the whole Project, so any number in a command may be an object
+		ids = set()
+		def AddIDs(values):
+			for value in values:
+				if isinstance(value, (list, tuple)):
+					AddIDs(value)
+				elif isinstance(value, (int, long)):
+					ids.add(value)
+		for action in actions:
+			for objectString, function, paramList in action.GetUndoCommands():
+				if objectString[1:].isdigit():
+					ids.add(int(objectString[1:]))
+				AddIDs(paramList)
+		
+		for instr in self.graveyard[:]:
+			if instr.id not in ids:
+				Globals.debug("Discarding deleted instrument:", instr.name)
+				self.graveyard.remove(instr)
+		for instr in self.instruments + self.graveyard:
+			for event in instr.graveyard[:]:
+				if event.id not in ids:
+					Globals.debug("Discarding deleted event:", event.name)
+					instr.graveyard.remove(event)
+		
+		self.emit("undo")
+	
+	#____________________________________________________________________	
+	
 	def SetName(self, name):
 		if self.name != name:
 			self.name = name
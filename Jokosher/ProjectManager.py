@@ -11,16 +11,32 @@
 
 import urlparse, os, gzip, shutil, gst
 import itertools, datetime, errno
-import Globals, Utils, UndoSystem, LevelsList, IncrementalSave
+import threading, Queue, hashlib
+import Globals, Utils, UndoSystem, LevelsList, IncrementalSave, AudioPool
 import Project, Instrument, Event
 import xml.dom.minidom as xml
+try:
+	import xml.etree.cElementTree as ElementTree
+except ImportError:
+	import xml.etree.ElementTree as ElementTree
 import traceback
 import PlatformUtils
 import gio
+try:
+	import fcntl
+except ImportError:
+	# not available on Windows, where files are never cloned
+	fcntl = None
+
+""" The ioctl which makes a copy-on-write clone of a file on Linux (FICLONE). """
+FICLONE = 0x40049409
+
+""" The size of the chunks in which imported files are hashed and copied. """
+COPY_CHUNK_SIZE = 1024 * 1024
 
 #_____________________________________________________________________
 
-def CreateNewProject(name, author, projecturi=None):
+def CreateNewProject(name, author, projecturi=None, engine=None):
 	"""
 	Creates a new Project.
 
@@ -29,6 +45,7 @@ def CreateNewProject(name, author, projecturi=None):
 		author - the name of the Project's author.
 		projecturi -- the filesystem location for the new Project.
 						Currently, only file:// URIs are considered valid.
+		engine -- the engine for the Project (see Project.__init__()).
 		
 	Returns:
 		the newly created Project object.
@@ -37,16 +54,27 @@ def CreateNewProject(name, author, projecturi=None):
 	if not projecturi:
 		projecturi = PlatformUtils.pathname2url(Globals.PROJECTS_PATH)
 		
-	project = InitProjectLocation(projecturi)
+	project = InitProjectLocation(projecturi, engine)
 	project.name = name
 	project.author = author
 	
-	project.SaveProjectFile(project.projectfile)
+	# new projects are mixed at the rate chosen for recording, if there is one
+	try:
+		sampleRate = int(Globals.settings.recording["samplerate"])
+	except ValueError:
+		sampleRate = 0
+	if sampleRate > 0:
+		project.sampleRate = sampleRate
+	
+	try:
+		project.SaveProjectFile(project.projectfile)
+	except SaveProjectError, e:
+		raise CreateProjectError(3, e.message)
 	return project
 	
 #_____________________________________________________________________
 	
-def InitProjectLocation(projecturi):
+def InitProjectLocation(projecturi, engine=None):
 	"""
 	Initialises the folder structure on disk for a Project.
 	If no project is provided, a new one is created.
@@ -55,6 +83,7 @@ def InitProjectLocation(projecturi):
 	Parameters:
 		projecturi -- the filesystem location for the new Project.
 						Currently, only file:// URIs are considered valid.
+		engine -- the engine for the Project (see Project.__init__()).
 	Returns:
 		the given Project, or the newly created Project object.
 	"""
@@ -74,7 +103,7 @@ def InitProjectLocation(projecturi):
 	projectdir = os.path.join(folder, folder_name_template)
 
 	try:
-		project = Project.Project()
+		project = Project.Project(engine)
 	except gst.PluginNotFoundError, e:
 		Globals.debug("Missing Gstreamer plugin:", e)
 		raise CreateProjectError(6, str(e))
@@ -136,77 +165,382 @@ def DeleteProjectLocation(project):
 #_____________________________________________________________________
 
 def ImportProject(project_uri):
-	try:
-		old_project = LoadProjectFile(project_uri)
-	except OpenProjectError, e:
-		raise
-		
-	all_files = old_project.GetAudioAndLevelsFilenames(include_deleted=True)
-	abs_audio_files, rel_audio_files, levels_files = all_files
+	"""
+	Copies a project and all the files it uses into a new folder in
+	the projects directory. This blocks until the copy is finished,
+	see ImportProjectJob for an import which runs in the background.
 	
+	Parameters:
+		project_uri -- the URI of the project file to import.
+		
+	Returns:
+		the path of the new project file, or None if the import failed.
+	"""
 	try:
-		new_project = InitProjectLocation(PlatformUtils.pathname2url(Globals.PROJECTS_PATH))
+		job = ImportProjectJob(project_uri)
 	except CreateProjectError, e:
 		return None
 	
-	delete_on_fail_list = []
+	job.Start()
+	return job.Finish()
+
+#=========================================================================
+
+class ImportProjectJob:
+	"""
+	Copies the audio and levels files of a project into a new project
+	folder on a pool of worker threads, so that large projects can be
+	imported while the interface keeps running.
 	
-	try:
-		for audio_filename in rel_audio_files:
-			src = gio.File(path=old_project.audio_path).get_child(audio_filename)
-			dst = gio.File(path=new_project.audio_path).get_child(audio_filename)
+	Audio files with the same content are only stored once, and files
+	on the same filesystem share their data with the originals (see CloneFile).
+	The job is started with Start(), and Finish() must then be called from the
+	main thread, once IsRunning() is False, to write the new project file.
+	"""
+	
+	#_____________________________________________________________________
+	
+	def __init__(self, project_uri):
+		"""
+		Loads the project to import and creates the folder of the new one.
 		
-			src.copy(dst)
-			delete_on_fail_list.append(dst.get_uri())
+		Parameters:
+			project_uri -- the URI of the project file to import.
+			
+		Considerations:
+			Raises OpenProjectError if the project cannot be loaded, and
+			CreateProjectError if the new folder cannot be created.
+		"""
+		self.old_project = LoadProjectFile(project_uri)
+		self.new_project = InitProjectLocation(PlatformUtils.pathname2url(Globals.PROJECTS_PATH))
 		
-			Globals.debug("Copy:\n\t" + src.get_uri() + "\n\t" + dst.get_uri())
+		self.cancelled = threading.Event()
+		self.error = None
+		self.copied = []		# the new files, to be deleted if the import fails
+		
+		self.__lock = threading.Lock()
+		self.__thread = None
+		self.__done = 0
+		self.__total = 0
+	
+	#_____________________________________________________________________
+	
+	def Start(self):
+		"""
+		Starts copying the files in the background.
+		"""
+		self.__thread = threading.Thread(target=self.__Run)
+		self.__thread.setDaemon(True)
+		self.__thread.start()
+	
+	#_____________________________________________________________________
+	
+	def Cancel(self):
+		"""
+		Stops the import. The files copied so far are deleted by Finish().
+		"""
+		self.cancelled.set()
+	
+	#_____________________________________________________________________
+	
+	def IsRunning(self):
+		"""
+		Returns:
+			True if the files are still being copied.
+		"""
+		return self.__thread is not None and self.__thread.isAlive()
+	
+	#_____________________________________________________________________
+	
+	def GetProgress(self):
+		"""
+		Returns:
+			a tuple of the number of bytes processed so far and the
+			total number of bytes to process.
+		"""
+		self.__lock.acquire()
+		try:
+			return self.__done, self.__total
+		finally:
+			self.__lock.release()
+	
+	#_____________________________________________________________________
+	
+	def Finish(self):
+		"""
+		Waits for the files to be copied, then copies the incremental save
+		file and saves the project in its new location. If the import
+		failed or was cancelled, the new project folder is removed.
 		
-		for level_filename in levels_files:
-			src = gio.File(path=old_project.levels_path).get_child(level_filename)
-			dst = gio.File(path=new_project.levels_path).get_child(level_filename)
+		Returns:
+			the path of the new project file, or None if the import failed.
+		"""
+		if self.__thread:
+			self.__thread.join()
+		
+		old_project, new_project = self.old_project, self.new_project
+		if not self.error and not self.cancelled.isSet():
+			old_project.FlushIncrementalSave()
+			path, ext = os.path.splitext(old_project.projectfile)
+			project_incremental_path = path + old_project.INCREMENTAL_SAVE_EXT
+			path, ext = os.path.splitext(new_project.projectfile)
+			new_project_incremental_path = path + new_project.INCREMENTAL_SAVE_EXT
+			
+			# If the project was closed properly, there will be no
+			# .incremental file. This is not a problem.
+			if os.path.exists(project_incremental_path):
+				try:
+					shutil.copyfile(project_incremental_path, new_project_incremental_path)
+					self.copied.append(new_project_incremental_path)
+				except EnvironmentError, e:
+					self.error = e
+		
+		if not self.error and not self.cancelled.isSet():
+			old_project.audio_path = new_project.audio_path
+			old_project.levels_path = new_project.levels_path
+			old_project.projectfile = new_project.projectfile
+			try:
+				old_project.SaveProjectFile(new_project.projectfile)
+			except SaveProjectError, e:
+				self.error = e
+		
+		if self.error or self.cancelled.isSet():
+			if self.error:
+				Globals.debug("Unable to import project:\n\t%s" % self.error)
+			project_dir = os.path.dirname(new_project.projectfile)
+			uris = [gio.File(path=filename).get_uri() for filename in self.copied]
+			ImportCleanUpFiles(uris, new_project.audio_path, new_project.levels_path, project_dir)
+			return None
 		
-			src.copy(dst)
-			delete_on_fail_list.append(dst.get_uri())
+		return new_project.projectfile
+	
+	#_____________________________________________________________________
+	
+	def __Run(self):
+		"""
+		Copies the files of the project, first hashing the audio files which
+		might be duplicates so that each content is only copied once.
+		"""
+		abs_audio_files, rel_audio_files, levels_files = \
+				self.old_project.GetAudioAndLevelsFilenames(include_deleted=True)
 		
-			Globals.debug("Copy:\n\t" + src.get_uri() + "\n\t" + dst.get_uri())
+		try:
+			# (source, destination, size, link) of each file to copy
+			audio = []
+			for filename in rel_audio_files:
+				src = os.path.join(self.old_project.audio_path, filename)
+				dst = os.path.join(self.new_project.audio_path, filename)
+				audio.append((src, dst, os.path.getsize(src), True))
+			levels = []
+			for filename in levels_files:
+				src = os.path.join(self.old_project.levels_path, filename)
+				dst = os.path.join(self.new_project.levels_path, filename)
+				# levels files are rewritten when they are regenerated, so they are never hard linked
+				levels.append((src, dst, os.path.getsize(src), False))
+		except EnvironmentError, e:
+			self.error = e
+			return
+		
+		# only files of the same size can have the same content, and
+		# files from the audio pool are already stored only once
+		bySize = {}
+		for task in audio:
+			if not AudioPool.IsPooled(task[0]):
+				bySize.setdefault(task[2], []).append(task)
+		toHash = [task for group in bySize.itervalues() if len(group) > 1 for task in group]
+		
+		self.__total = sum([task[2] for task in audio + levels + toHash])
+		
+		digests = {}
+		self.__RunPool(self.__HashTask, toHash, digests)
+		
+		unique, duplicates, firstCopy = [], [], {}
+		for task in audio:
+			digest = digests.get(task[0])
+			if digest is None:
+				unique.append(task)
+			elif digest in firstCopy:
+				duplicates.append((task, firstCopy[digest]))
+			else:
+				firstCopy[digest] = task[1]
+				unique.append(task)
 		
-		path, ext = os.path.splitext(old_project.projectfile)
-		project_incremental_path = path + old_project.INCREMENTAL_SAVE_EXT
-		path, ext = os.path.splitext(new_project.projectfile)
-		new_project_incremental_path = path + new_project.INCREMENTAL_SAVE_EXT
-		src = gio.File(project_incremental_path)
-		dst = gio.File(new_project_incremental_path)
+		self.__RunPool(self.__CopyTask, unique + levels)
 		
+		# the duplicates are linked to the first copy, which is in the new folder too
 		try:
-			src.copy(dst)
-			delete_on_fail_list.append(dst.get_uri())
-		except gio.Error, e:
-			# If the project was closed properly, there will be no
-			# .incremental file. This is not a problem.
-			pass
+			for task, original in duplicates:
+				if self.error or self.cancelled.isSet():
+					break
+				Globals.debug("Import: %s has the same content as %s" % (task[0], original))
+				self.__CopyTask((original,) + task[1:])
+		except EnvironmentError, e:
+			self.error = e
+	
+	#_____________________________________________________________________
+	
+	def __RunPool(self, function, tasks, *args):
+		"""
+		Calls function for each of the tasks on a number of worker threads
+		set by the "importthreads" setting, and waits until they are all done.
 		
-		old_project.audio_path = new_project.audio_path
-		old_project.levels_path = new_project.levels_path
-		old_project.projectfile = new_project.projectfile
-		old_project.SaveProjectFile(new_project.projectfile)
-		return new_project.projectfile
-	except gio.Error, gio_error:
-		Globals.debug("Unable to import project; copying failed:\n\t%s" % gio_error.message)
-		project_dir = gio.File(path=new_project.projectfile).get_parent().get_path()
-		ImportCleanUpFiles(delete_on_fail_list, new_project.audio_path,
-		        new_project.levels_path, project_dir)
-
-		if gio_error.code == gio.ERROR_NOT_FOUND:
-			# Ask user if they would like to continue even though
-			# some files are missing
-			pass
-		elif gio_error.code == gio.ERROR_EXISTS:
-			pass
-		elif gio_error.code == gio.ERROR_IS_DIRECTORY:
-			pass
+		Parameters:
+			function -- the function to call with each task.
+			tasks -- the list of tasks.
+			args -- extra arguments passed to function after the task.
+		"""
+		queue = Queue.Queue()
+		for task in tasks:
+			queue.put(task)
 		
-		return None
+		def Worker():
+			while not self.error and not self.cancelled.isSet():
+				try:
+					task = queue.get_nowait()
+				except Queue.Empty:
+					break
+				try:
+					function(task, *args)
+				except EnvironmentError, e:
+					self.error = e
+		
+		count = max(1, min(len(tasks), int(Globals.settings.general["importthreads"])))
+		workers = [threading.Thread(target=Worker) for i in range(count)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+	
+	#_____________________________________________________________________
+	
+	def __HashTask(self, task, digests):
+		"""
+		Computes the content hash of a file.
+		
+		Parameters:
+			task -- the (source, destination, size, link) tuple of the file.
+			digests -- the dictionary to store the hash in, by source path.
+		"""
+		src = task[0]
+		digest = hashlib.sha1()
+		srcfile = open(src, "rb")
+		try:
+			while not self.cancelled.isSet():
+				data = srcfile.read(COPY_CHUNK_SIZE)
+				if not data:
+					break
+				digest.update(data)
+				self.__AddProgress(len(data))
+		finally:
+			srcfile.close()
+		
+		self.__lock.acquire()
+		try:
+			digests[src] = digest.digest()
+		finally:
+			self.__lock.release()
+	
+	#_____________________________________________________________________
+	
+	def __CopyTask(self, task):
+		"""
+		Copies a file into the new project folder.
+		
+		Parameters:
+			task -- the (source, destination, size, link) tuple of the file.
+		"""
+		src, dst, size, link = task
+		self.__lock.acquire()
+		try:
+			self.copied.append(dst)
+		finally:
+			self.__lock.release()
+		
+		if link and AudioPool.LinkPooledFile(src, dst):
+			self.__AddProgress(size)
+			Globals.debug("Link to pooled file:\n\t" + dst)
+			return
+		
+		CloneFile(src, dst, link, self.__AddProgress, self.cancelled)
+		Globals.debug("Copy:\n\t" + src + "\n\t" + dst)
+	
+	#_____________________________________________________________________
+	
+	def __AddProgress(self, size):
+		"""
+		Adds a number of bytes to the progress of the import.
+		
+		Parameters:
+			size -- the number of bytes processed.
+		"""
+		self.__lock.acquire()
+		try:
+			self.__done += size
+		finally:
+			self.__lock.release()
+	
+	#_____________________________________________________________________
 
+#=========================================================================
+
+def CloneFile(src, dst, link=False, progress=None, cancelled=None):
+	"""
+	Copies the file src to dst. When both are on the same filesystem their
+	data is shared instead of copied: by a copy-on-write clone (reflink) if
+	the filesystem supports it, otherwise by a hard link if link is True.
+	Anything else is copied in chunks.
+	
+	Parameters:
+		src -- the path of the file to copy.
+		dst -- the path of the new file.
+		link -- True if dst may be a hard link to src. Only use it for
+				files which are never written to again, like recorded audio.
+		progress -- a function called with the number of bytes copied.
+		cancelled -- a threading.Event which stops the copy when it is set.
+		
+	Returns:
+		True if the file was copied, False if the copy was cancelled.
+	"""
+	size = os.path.getsize(src)
+	sameDevice = os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev
+	
+	srcfile = open(src, "rb")
+	try:
+		dstfile = open(dst, "wb")
+		try:
+			if sameDevice and fcntl:
+				try:
+					fcntl.ioctl(dstfile.fileno(), FICLONE, srcfile.fileno())
+					if progress:
+						progress(size)
+					return True
+				except IOError:
+					# not supported by this filesystem or platform
+					pass
+			
+			if sameDevice and link and hasattr(os, "link"):
+				dstfile.close()
+				try:
+					os.unlink(dst)
+					os.link(src, dst)
+					if progress:
+						progress(size)
+					return True
+				except OSError:
+					dstfile = open(dst, "wb")
+			
+			while not (cancelled and cancelled.isSet()):
+				data = srcfile.read(COPY_CHUNK_SIZE)
+				if not data:
+					return True
+				dstfile.write(data)
+				if progress:
+					progress(len(data))
+			return False
+		finally:
+			dstfile.close()
+	finally:
+		srcfile.close()
 
 #_____________________________________________________________________
 
@@ -222,7 +556,7 @@ def ImportCleanUpFiles(uris_to_delete, audio_path, levels_path, project_folder):
 			gio.File(path=path).delete()
 		except gio.Error, e:
 			Globals.debug("ImportCleanUpFiles: " + repr(e))
-			Gloabls.debug(path)
+			Globals.debug(path)
 
 #_____________________________________________________________________
 
@@ -253,13 +587,14 @@ def ValidateProject(project):
 	
 #_____________________________________________________________________
 
-def LoadProjectFile(uri):
+def LoadProjectFile(uri, engine=None):
 	"""
 	Loads a Project from a saved file on disk.
 
 	Parameters:
 		uri -- the filesystem location of the Project file to load. 
 				Currently only file:// URIs are considered valid.
+		engine -- the engine for the Project (see Project.__init__()).
 				
 	Returns:
 		the loaded Project object.
@@ -278,22 +613,14 @@ def LoadProjectFile(uri):
 		raise OpenProjectError(4, projectfile)
 
 	try:
-		try:
-			gzipfile = gzip.GzipFile(projectfile, "r")
-			doc = xml.parse(gzipfile)
-		except IOError, e:
-			if e.message == "Not a gzipped file":
-				# starting from 0.10, we accept both gzipped xml and plain xml
-				file_ = open(projectfile, "r")
-				doc = xml.parse(file_)
-			else:
-				raise e
+		parser = ElementTree.iterparse(OpenProjectFile(projectfile), events=("start", "end"))
+		event, root = parser.next()
 	except Exception, e:
 		Globals.debug(e.__class__, e)
 		# raise "This file doesn't unzip" message
 		raise OpenProjectError(2, projectfile)
 	
-	project = Project.Project()
+	project = Project.Project(engine)
 	project.projectfile = projectfile
 	projectdir = os.path.split(projectfile)[0]
 	project.audio_path = os.path.join(projectdir, "audio")
@@ -307,15 +634,20 @@ def LoadProjectFile(uri):
 		raise OpenProjectError(0)
 	
 	#only open projects with the proper version number
-	version = None
-	if doc and doc.firstChild:
-		version = doc.firstChild.getAttribute("version")
+	version = root.get("version")
 
 	if JOKOSHER_VERSION_FUNCTIONS.has_key(version):
 		loaderClass = JOKOSHER_VERSION_FUNCTIONS[version]
 		Globals.debug("Loading project file version", version)
 		try:
-			loaderClass(project, doc)
+			if issubclass(loaderClass, _LoadZPNFile):
+				loaderClass(project, parser, root)
+			else:
+				# files from 0.1 and 0.2 are still loaded through a DOM tree
+				loaderClass(project, xml.parse(OpenProjectFile(projectfile)))
+		except SyntaxError, e:
+			Globals.debug(e.__class__, e)
+			raise OpenProjectError(2, projectfile)
 		except:
 			tb = traceback.format_exc()
 			Globals.debug("Loading project failed", tb)
@@ -332,6 +664,74 @@ def LoadProjectFile(uri):
 		# raise a "this project was created in an incompatible version of Jokosher" message
 		raise OpenProjectError(3, version)
 
+def OpenProjectFile(projectfile):
+	"""
+	Opens a project file for reading.
+	
+	Considerations:
+		Starting from 0.10, both gzipped and plain XML project files are accepted.
+	
+	Parameters:
+		projectfile -- the path of the project file.
+	
+	Returns:
+		a file object with the uncompressed contents of the project file.
+	"""
+	file_ = open(projectfile, "rb")
+	if file_.read(2) == "\x1f\x8b":
+		file_.close()
+		return gzip.GzipFile(projectfile, "rb")
+	
+	file_.seek(0)
+	return file_
+
+def LoadHistoryFile(historyfile, size):
+	"""
+	Reads the undo and redo stacks of a Project from its history file.
+	
+	Considerations:
+		The history file is a log which is only ever appended to. Each line is
+		an XML element which either pushes an Action onto one of the stacks,
+		cuts a stack down to a given length, or gives the version of Jokosher
+		which wrote the lines after it.
+	
+	Parameters:
+		historyfile -- the path of the history file.
+		size -- the number of bytes of the file which belong to the saved
+				Project. Anything after that was left by a save which did not
+				complete, and is ignored.
+	
+	Returns:
+		a dictionary with the lists of AtomicUndoActions of the "Undo"
+		and "Redo" stacks, oldest first.
+	"""
+	stacks = {"Undo" : [], "Redo" : []}
+	version = Globals.VERSION
+	
+	file_ = open(historyfile, "rb")
+	try:
+		lines = file_.read(size).splitlines()
+	finally:
+		file_.close()
+	
+	for line in lines:
+		element = ElementTree.fromstring(line)
+		if element.tag == "Version":
+			version = element.get("value")
+		elif element.tag == "Truncate":
+			del stacks[element.get("stack")][int(element.get("length")):]
+		elif element.tag == "Action":
+			undoAction = UndoSystem.AtomicUndoAction()
+			for cmdNode in element:
+				objectString = str(cmdNode.get("object"))
+				functionString = str(cmdNode.get("function"))
+				paramList = Utils.LoadListFromElement(cmdNode)
+				functionString = ApplyUndoCompat(objectString, functionString, version)
+				undoAction.AddUndoCommand(objectString, functionString, paramList)
+			stacks[element.get("stack")].append(undoAction)
+	
+	return stacks
+
 #=========================================================================
 
 class _LoadZPOFile:
@@ -488,6 +888,8 @@ class _LoadZPTFile:
 			self.LoadInstrument(instr, instrElement)
 			self.project.graveyard.append(instr)
 			instr.RemoveAndUnlinkPlaybackbin()
+			for event in instr.events:
+				event.UpdateProjectLength(removed=True)
 	
 	#_____________________________________________________________________
 	
@@ -541,7 +943,7 @@ class _LoadZPTFile:
 			Globals.debug("Error, could not load image:", instr.instrType)
 		
 		# load pan level
-		instr.panElement.set_property("panorama", instr.pan)
+		instr.UpdatePan()
 		#check if instrument is muted and setup accordingly
 		instr.OnMute()
 		#update the volume element with the newly loaded value
@@ -578,20 +980,26 @@ class _LoadZPTFile:
 	#_____________________________________________________________________
 #=========================================================================
 
-class _LoadZPNFile(_LoadZPTFile):
+class _LoadZPNFile:
 	LOADING_VERSION = "0.9"
 	
-	def __init__(self, project, xmlDoc):
+	def __init__(self, project, parser, root):
 		"""
 		Loads a Jokosher version 0.9 (Zero Point Nine) Project file into
-		the given Project object using the given XML document.
+		the given Project object in a single streaming pass.
+		
+		Considerations:
+			Each Instrument, Event and undo Action is loaded as soon as its
+			element has been parsed, and is then removed from the tree, so
+			the whole document is never held in memory.
 		
 		Parameters:
 			project -- the Project instance to apply loaded properties to.
-			xmlDoc -- the XML file document to read data from.
+			parser -- the ElementTree iterparse() iterator of the file, with
+					"start" and "end" events, after the start of the root element.
+			root -- the root element of the file.
 		"""
 		self.project = project
-		self.xmlDoc = xmlDoc
 		
 		# A project being opened is either:
 		# --> A 0.11 or earlier project (all of which required a name on creation).
@@ -601,129 +1009,178 @@ class _LoadZPNFile(_LoadZPTFile):
 		# for the first case.
 		self.project.name_is_unset = False
 		
-		params = self.xmlDoc.getElementsByTagName("Parameters")[0]
-		
-		Utils.LoadParametersFromXML(self.project, params)
-		
-		notesNode = self.xmlDoc.getElementsByTagName("Notes")
-		if notesNode:
-			notes = notesNode[0].getAttribute("text")
-			# notes are encoded using repr() to preserver \n and \t.
-			self.project.notes = Utils.StringUnRepr(notes)
-		
-		# Hack to set the transport mode
-		self.project.transport.SetMode(self.project.transportMode)
-		
-		undoRedo = (("Undo", self.project._Project__savedUndoStack),
-				("Redo", self.project._Project__redoStack))
-		for tagName, stack in undoRedo:
-			try:
-				undo = self.xmlDoc.getElementsByTagName(tagName)[0]
-			except IndexError:
-				Globals.debug("No saved %s in project file" % tagName)
-			else:
-				for actionNode in undo.childNodes:
-					if actionNode.nodeName == "Action":
-						action = UndoSystem.AtomicUndoAction()
-						self.LoadUndoAction(action, actionNode)
-						stack.append(action)
-		
-		for instrElement in self.xmlDoc.getElementsByTagName("Instrument"):
-			try:
-				id = int(instrElement.getAttribute("id"))
-			except ValueError:
-				id = None
-			instr = Instrument.Instrument(self.project, None, None, None, id)
-			self.LoadInstrument(instr, instrElement)
-			self.project.instruments.append(instr)
-			if instr.isSolo:
-				self.project.soloInstrCount += 1
-		
-		for instrElement in self.xmlDoc.getElementsByTagName("DeadInstrument"):
-			try:
-				id = int(instrElement.getAttribute("id"))
-			except ValueError:
-				id = None
-			instr = Instrument.Instrument(self.project, None, None, None, id)
-			self.LoadInstrument(instr, instrElement)
-			self.project.graveyard.append(instr)
-			instr.RemoveAndUnlinkPlaybackbin()
+		undoStacks = {"Undo" : self.project._Project__savedUndoStack,
+				"Redo" : self.project._Project__redoStack}
+		
+		# the elements that are currently open, below the root
+		stack = []
+		instr = None
+		
+		for event, element in parser:
+			if event == "start":
+				if not stack and element.tag in ("Instrument", "DeadInstrument"):
+					try:
+						id = int(element.get("id"))
+					except (TypeError, ValueError):
+						id = None
+					instr = Instrument.Instrument(self.project, None, None, None, id)
+				stack.append(element)
+				continue
+			
+			if not stack:
+				# this is the end of the root element
+				break
+			stack.pop()
+			if len(stack) == 1:
+				parent = stack[0]
+				if instr is not None:
+					self.LoadInstrumentChild(instr, element)
+					parent.remove(element)
+				elif parent.tag in undoStacks and element.tag == "Action":
+					action = UndoSystem.AtomicUndoAction()
+					self.LoadUndoAction(action, element)
+					undoStacks[parent.tag].append(action)
+					parent.remove(element)
+				
+			elif not stack:
+				if element.tag == "Parameters":
+					Utils.LoadParametersFromElement(self.project, element)
+					# Hack to set the transport mode
+					self.project.transport.SetMode(self.project.transportMode)
+				elif element.tag == "Notes":
+					# notes are encoded using repr() to preserver \n and \t.
+					self.project.notes = Utils.StringUnRepr(element.get("text", ""))
+				elif element.tag == "History":
+					# the undo history is in a separate file, which is read on the first undo past it
+					self.project.SetSavedHistory(int(element.get("undo")),
+							int(element.get("redo")), int(element.get("size")))
+				elif element.tag == "Instrument":
+					self.FinishInstrument(instr)
+					self.project.instruments.append(instr)
+					if instr.isSolo:
+						self.project.soloInstrCount += 1
+					instr = None
+				elif element.tag == "DeadInstrument":
+					self.FinishInstrument(instr)
+					self.project.graveyard.append(instr)
+					instr.RemoveAndUnlinkPlaybackbin()
+					for ev in instr.events:
+						ev.UpdateProjectLength(removed=True)
+					# the levels files were written with the Project, so they can be reloaded from there
+					instr.ReleasePipeline(spillLevels=False)
+					instr = None
+				root.remove(element)
 	
 	#_____________________________________________________________________
 	
-	def LoadInstrument(self, instr, xmlNode):
+	def LoadInstrumentChild(self, instr, element):
 		"""
-		Restores an Instrument from version 0.2 XML representation.
+		Restores one part of an Instrument (its parameters, one of its effects
+		or one of its Events) from its XML representation.
 		
 		Parameters:
 			instr -- the Instrument instance to apply loaded properties to.
-			xmlNode -- the XML node to retreive data from.
+			element -- a child element of the Instrument's element.
 		"""
-		params = xmlNode.getElementsByTagName("Parameters")[0]
-		
-		Utils.LoadParametersFromXML(instr, params)
-		
-		globaleffect = xmlNode.getElementsByTagName("GlobalEffect")
-		
-		for effect in globaleffect:
-			elementname = str(effect.getAttribute("element"))
+		if element.tag == "Parameters":
+			Utils.LoadParametersFromElement(instr, element)
+			
+		elif element.tag == "GlobalEffect":
+			elementname = str(element.get("element"))
 			Globals.debug("Loading effect:", elementname)
 			gstElement = instr.AddEffect(elementname)
 			
-			propsdict = Utils.LoadDictionaryFromXML(effect)
+			propsdict = Utils.LoadDictionaryFromElement(element)
 			for key, value in propsdict.iteritems():
-				gstElement.set_property(key, value)		
+				gstElement.set_property(key, value)
 			
-		for ev in xmlNode.getElementsByTagName("Event"):
+		elif element.tag in ("Event", "DeadEvent"):
 			try:
-				id = int(ev.getAttribute("id"))
-			except ValueError:
+				id = int(element.get("id"))
+			except (TypeError, ValueError):
 				id = None
 			event = Event.Event(instr, None, id)
-			self.LoadEvent(event, ev)
-			instr.events.append(event)
+			if element.tag == "Event":
+				self.LoadEvent(event, element)
+				instr.events.append(event)
+			else:
+				self.LoadEvent(event, element, True)
+				instr.graveyard.append(event)
+	
+	#_____________________________________________________________________
+	
+	def FinishInstrument(self, instr):
+		"""
+		Sets up an Instrument once all of its parts have been loaded.
 		
-		for ev in xmlNode.getElementsByTagName("DeadEvent"):
-			try:
-				id = int(ev.getAttribute("id"))
-			except ValueError:
-				id = None
-			event = Event.Event(instr, None, id)
-			self.LoadEvent(event, ev, True)
-			instr.graveyard.append(event)
-
-
+		Parameters:
+			instr -- the loaded Instrument instance.
+		"""
 		#load image from file based on unique type
 		instr.pixbuf = Globals.getCachedInstrumentPixbuf(instr.instrType)
 		if not instr.pixbuf:
 			Globals.debug("Error, could not load image:", instr.instrType)
 		
 		# load pan level
-		instr.panElement.set_property("panorama", instr.pan)
+		instr.UpdatePan()
 		#check if instrument is muted and setup accordingly
 		instr.OnMute()
 		#update the volume element with the newly loaded value
 		instr.UpdateVolume()
+	
+	#_____________________________________________________________________
+	
+	def LoadEvent(self, event, element, isDead=False):
+		"""
+		Restores an Event from its version 0.9 XML representation.
+		
+		Parameters:
+			event -- the Event instance to apply loaded properties to.
+			element -- the XML element to retreive data from.
+			isDead -- True if the Event is in the graveyard.
+		"""
+		self.LoadEventParameters(event, element)
+		
+		if not isDead:
+			# we have to always generate waveform because 0.10 uses different levels format
+			event.GenerateWaveform()
+			event._Event__UpdateAudioFadePoints()
+			event.CreateFilesource()
+	
+	#_____________________________________________________________________
+	
+	def LoadEventParameters(self, event, element):
+		"""
+		Restores the parameters and fade points of an Event.
+		
+		Parameters:
+			event -- the Event instance to apply loaded properties to.
+			element -- the XML element to retreive data from.
+		"""
+		Utils.LoadParametersFromElement(event, element.find("Parameters"))
 		
+		xmlPoints = element.find("FadePoints")
+		if xmlPoints is None:
+			Globals.debug("Missing FadePoints in Event XML")
+		else:
+			event._Event__fadePointsDict = Utils.LoadDictionaryFromElement(xmlPoints)
+	
 	#_____________________________________________________________________
 
-	def LoadUndoAction(self, undoAction, xmlNode):
+	def LoadUndoAction(self, undoAction, element):
 		"""
-		Loads an AtomicUndoAction from an XML node.
+		Loads an AtomicUndoAction from an XML element.
 		
 		Parameters:
 			undoAction -- the AtomicUndoAction instance to save the loaded commands to.
-			node -- XML node from which the AtomicUndoAction is loaded.
-					Should be an "<Action>" node.
-			
-		Returns:
-			the loaded AtomicUndoAction object.
+			element -- XML element from which the AtomicUndoAction is loaded.
+					Should be an "<Action>" element.
 		"""
-		for cmdNode in xmlNode.childNodes:
-			if cmdNode.nodeName == "Command":
-				objectString = str(cmdNode.getAttribute("object"))
-				functionString = str(cmdNode.getAttribute("function"))
-				paramList = Utils.LoadListFromXML(cmdNode)
+		for cmdNode in element:
+			if cmdNode.tag == "Command":
+				objectString = str(cmdNode.get("object"))
+				functionString = str(cmdNode.get("function"))
+				paramList = Utils.LoadListFromElement(cmdNode)
 				
 				functionString = ApplyUndoCompat(objectString, functionString, self.LOADING_VERSION)
 				
@@ -735,24 +1192,16 @@ class _LoadZPNFile(_LoadZPTFile):
 class _LoadZPTenFile(_LoadZPNFile):
 	LOADING_VERSION = "0.10"
 	
-	def LoadEvent(self, event, xmlNode, isDead=False):
+	def LoadEvent(self, event, element, isDead=False):
 		"""
 		Restores an Event from its version 0.10 XML representation.
 		
 		Parameters:
 			event -- the Event instance to apply loaded properties to.
-			xmlNode -- the XML node to retreive data from.
+			element -- the XML element to retreive data from.
+			isDead -- True if the Event is in the graveyard.
 		"""
-		params = xmlNode.getElementsByTagName("Parameters")[0]
-		
-		Utils.LoadParametersFromXML(event, params)
-		
-		try:
-			xmlPoints = xmlNode.getElementsByTagName("FadePoints")[0]
-		except IndexError:
-			Globals.debug("Missing FadePoints in Event XML")
-		else:
-			event._Event__fadePointsDict = Utils.LoadDictionaryFromXML(xmlPoints)
+		self.LoadEventParameters(event, element)
 
 		if not isDead:
 			if event.isLoading or event.isRecording:  
@@ -833,6 +1282,28 @@ class CreateProjectError(Exception):
 
 #=========================================================================
 
+class SaveProjectError(EnvironmentError):
+	"""
+	This class will get created when a Project file cannot be written.
+	It's used for handling errors.
+	"""
+	
+	#_____________________________________________________________________
+	
+	def __init__(self, message):
+		"""
+		Creates a new instance of SaveProjectError.
+		
+		Parameters:
+			message -- a string describing why the file was not written.
+		"""
+		EnvironmentError.__init__(self, message)
+		self.message = message
+	
+	#_____________________________________________________________________
+
+#=========================================================================
+
 class InvalidProjectError(Exception):
 	"""
 	This class will get created when there's an invalid Project.
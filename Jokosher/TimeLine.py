@@ -483,7 +483,7 @@ class TimeLine(gtk.DrawingArea):
 			playhead = self.project.viewStart + (playhead_xpos / self.project.viewScale)
 			
 			self.project.SetViewStart(start)
-			self.project.transport.SeekTo(playhead)
+			self.project.transport.SeekTo(playhead, scrub=True)
 
 			return True
 		else:
@@ -503,6 +503,8 @@ class TimeLine(gtk.DrawingArea):
 			self.buttonDown = False
 			self.current_autoscroll_diff = 0
 			gtk.gdk.pointer_ungrab(event.time)
+			# the seeks while dragging may have been inexact
+			self.project.transport.SeekTo(self.project.transport.GetPosition())
 		
 		return True
 		
@@ -517,7 +519,7 @@ class TimeLine(gtk.DrawingArea):
 		"""
 		pos = self.project.viewStart + (xpos / self.project.viewScale)
 		pos = max(0., pos)
-		self.project.transport.SeekTo(pos)
+		self.project.transport.SeekTo(pos, scrub=self.buttonDown)
 		self.SetAccessibleName()
 		
 	#_____________________________________________________________________
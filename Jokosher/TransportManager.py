@@ -14,6 +14,8 @@ import pygst
 pygst.require("0.10")
 import gst
 import gobject
+import time
+import Globals
 
 #=========================================================================
 
@@ -38,16 +40,23 @@ class TransportManager(gobject.GObject):
 	""" Display mode in bars, beats and ticks. """
 	MODE_BARS_BEATS = 2
 	
+	""" Milliseconds after which a seek is given up waiting for, if the pipeline has not completed it. """
+	SEEK_TIMEOUT = 1000
+	
 	"""
 	Signals:
 		"position" -- The playhead position of the project has changed.
 				An optional string is also send which details why the position was changed.
 		"transport-mode" -- The mode of measurement for the transport time has changed.
+		"seek-latency" -- The pipeline has completed a seek. The number of seconds it took is also send.
+		"loop" -- The loop region has been set or cleared.
 	"""
 	
 	__gsignals__ = {
 		"position"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING,) ),
-		"transport-mode"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_INT,) )
+		"transport-mode"	: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_INT,) ),
+		"seek-latency"		: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_FLOAT,) ),
+		"loop"			: ( gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, () )
 	}
 
 	#_____________________________________________________________________
@@ -62,6 +71,9 @@ class TransportManager(gobject.GObject):
 						MODE_HOURS_MINS_SECS
 						MODE_BARS_BEATS
 			project -- reference to the current Project.
+		
+		Considerations:
+			The pipeline is None if the Project uses the Engine.NullEngine.
 		"""
 		gobject.GObject.__init__(self)
 		
@@ -76,13 +88,21 @@ class TransportManager(gobject.GObject):
 		self.UpdateTimeout = False
 		self.stopPosition = 0
 		self.mode = initialMode
+		self.seekStartTime = None	# The time the seek which the pipeline is completing was sent, or None
+		self.queuedSeek = None		# The (position, stop position, scrub) of the seek to send once the current one completes
+		self.seekCount = 0			# The number of seeks sent, to tell if a seek timeout is out of date
+		self.loopStart = 0.0		# The position in seconds where the loop region begins
+		self.loopEnd = 0.0			# The position in seconds where the loop region ends, or 0 if there is no loop
+		
+		if self.project.bus:
+			self.project.bus.connect("message::async-done", self.__PipelineAsyncDoneCb)
+			self.project.bus.connect("message::segment-done", self.__PipelineSegmentDoneCb)
 
 	#_____________________________________________________________________
 	
 	def Play(self, newAudioState):
 		"""
-		Called when play button has been pressed (or whilst exporting
-		in which case, newAudioState will be set to AUDIO_EXPORTING).
+		Called when play button has been pressed.
 		
 		Parameters:
 			newAudioState -- new audio state to set the Project to.
@@ -96,16 +116,14 @@ class TransportManager(gobject.GObject):
 		self.isPlaying = True
 		self.project.SetAudioState(newAudioState)
 		
-		if self.position > 0:
+		if self.position > 0 or self.loopEnd:
 			self.SeekTo(self.position, self.stopPosition)
 			#clear stopPosition in case it has been set by previous SeekTo()
 			self.stopPosition = 0
 		
 		self.pipeline.set_state(gst.STATE_PLAYING)
-		#for normal playback then we need to start the timeout that will 
-		#control the movement of the playhead
-		if not self.project.GetIsExporting():
-			self.StartUpdateTimeout()
+		#start the timeout that will control the movement of the playhead
+		self.StartUpdateTimeout()
 		
 	#_____________________________________________________________________
 		
@@ -116,7 +134,8 @@ class TransportManager(gobject.GObject):
 		self.isPlaying = False
 		self.isPaused = True
 		self.project.SetAudioState(self.project.AUDIO_PAUSED)
-		self.pipeline.set_state(gst.STATE_PAUSED)
+		if self.pipeline:
+			self.pipeline.set_state(gst.STATE_PAUSED)
 	
 	#_____________________________________________________________________
 		
@@ -128,7 +147,11 @@ class TransportManager(gobject.GObject):
 		self.isPaused = False
 		self.project.SetAudioState(self.project.AUDIO_STOPPED)
 		self.SetPosition(0.0, True)
-		self.pipeline.set_state(gst.STATE_READY)
+		# a stopped pipeline does not complete its seeks
+		self.seekStartTime = None
+		self.queuedSeek = None
+		if self.pipeline:
+			self.pipeline.set_state(gst.STATE_READY)
 		
 	#_____________________________________________________________________
 		
@@ -354,26 +377,90 @@ class TransportManager(gobject.GObject):
 		
 	#_____________________________________________________________________
 	
-	def SeekTo(self, pos, stopPos=0):
+	def SetLoop(self, start, end):
+		"""
+		Sets the loop region, which is played over and over, without gaps,
+		once the playhead is inside it.
+		
+		Parameters:
+			start -- the position in seconds where the loop region begins.
+			end -- the position in seconds where the loop region ends.
+		"""
+		start = max(0, start)
+		if end <= start:
+			self.ClearLoop()
+			return
+		
+		self.loopStart, self.loopEnd = start, end
+		self.emit("loop")
+		if self.isPlaying or self.isPaused:
+			# the stop position of the running segment has to change
+			self.SeekTo(self.GetPosition())
+	
+	#_____________________________________________________________________
+	
+	def ClearLoop(self):
+		"""
+		Clears the loop region, so that playback continues past its end.
+		"""
+		if not self.loopEnd:
+			return
+		
+		self.loopStart = self.loopEnd = 0.0
+		self.emit("loop")
+		if self.isPlaying or self.isPaused:
+			self.SeekTo(self.GetPosition())
+	
+	#_____________________________________________________________________
+	
+	def GetLoop(self):
+		"""
+		Returns:
+			a tuple with the start and end of the loop region in seconds,
+			or None if there is no loop region.
+		"""
+		if self.loopEnd:
+			return (self.loopStart, self.loopEnd)
+		return None
+	
+	#_____________________________________________________________________
+	
+	def __IsLooping(self, pos):
+		"""
+		Parameters:
+			pos -- a position in seconds.
+		
+		Returns:
+			True if playing from pos should loop.
+		"""
+		return self.loopEnd and pos < self.loopEnd and not self.project.GetIsRecording()
+	
+	#_____________________________________________________________________
+	
+	def SeekTo(self, pos, stopPos=0, scrub=False):
 		"""
 		Performs a pipeline seek to alter position of the playhead cursor.
 		
 		Parameters:
 			pos -- position to place the playhead cursor.
 			stopPos -- new stop position
+			scrub -- True if the playhead is being dragged, and more seeks
+					will follow. Depending on the "scrubseek" setting, the
+					pipeline may then seek to the nearest key unit instead of
+					the exact position, which is much faster for compressed files.
+					
+		Considerations:
+			Only one seek is sent to the pipeline at a time. The seeks asked for
+			while the pipeline is completing one are not sent, except for the
+			last one which is sent once the pipeline has completed its seek.
 		"""
 		#make sure we cant seek to before the beginning
 		pos = max(0, pos)
 		if self.isPlaying or self.isPaused:
-			#if stopPos is set then pass it to gstreamer here anc clear
-			if stopPos:
-				self.pipeline.seek( 1.0, gst.FORMAT_TIME, gst.SEEK_FLAG_FLUSH,
-						gst.SEEK_TYPE_SET, long(pos * gst.SECOND), 
-						gst.SEEK_TYPE_SET, long(stopPos * gst.SECOND))
+			if self.seekStartTime is not None:
+				self.queuedSeek = (pos, stopPos, scrub)
 			else:
-				self.pipeline.seek( 1.0, gst.FORMAT_TIME, gst.SEEK_FLAG_FLUSH,
-						gst.SEEK_TYPE_SET, long(pos * gst.SECOND), 
-						gst.SEEK_TYPE_NONE, 0)
+				self.__SendSeek(pos, stopPos, scrub)
 		else:
 			#if we haven't done the seek yet (because seek doesn't work while
 			#stopped) then we need to save the stop position until we play again
@@ -382,6 +469,113 @@ class TransportManager(gobject.GObject):
 		
 	#_____________________________________________________________________
 	
+	def __SendSeek(self, pos, stopPos, scrub):
+		"""
+		Sends a flushing seek to the pipeline, and waits for it to complete.
+		
+		Parameters:
+			pos -- position to seek to.
+			stopPos -- new stop position, or 0 to keep the current one.
+			scrub -- True if the playhead is being dragged.
+		"""
+		flags = gst.SEEK_FLAG_FLUSH
+		if scrub and Globals.settings.general["scrubseek"] == "keyunit":
+			flags |= gst.SEEK_FLAG_KEY_UNIT
+		else:
+			flags |= gst.SEEK_FLAG_ACCURATE
+		
+		if not stopPos and self.__IsLooping(pos):
+			# a segment seek posts segment-done at the end of the loop instead of eos
+			flags |= gst.SEEK_FLAG_SEGMENT
+			stopPos = self.loopEnd
+		
+		#if stopPos is set then pass it to gstreamer here
+		if stopPos:
+			stopType, stop = gst.SEEK_TYPE_SET, long(stopPos * gst.SECOND)
+		else:
+			stopType, stop = gst.SEEK_TYPE_NONE, 0
+		
+		if self.pipeline.seek(1.0, gst.FORMAT_TIME, flags,
+				gst.SEEK_TYPE_SET, long(pos * gst.SECOND), stopType, stop):
+			self.seekStartTime = time.time()
+			self.seekCount += 1
+			gobject.timeout_add(self.SEEK_TIMEOUT, self.__SeekTimeoutCb, self.seekCount)
+	
+	#_____________________________________________________________________
+	
+	def __SendQueuedSeek(self):
+		"""
+		Sends the last seek asked for while the previous one was being completed.
+		"""
+		self.seekStartTime = None
+		if self.queuedSeek:
+			pos, stopPos, scrub = self.queuedSeek
+			self.queuedSeek = None
+			if self.isPlaying or self.isPaused:
+				self.__SendSeek(pos, stopPos, scrub)
+	
+	#_____________________________________________________________________
+	
+	def __PipelineAsyncDoneCb(self, bus, message):
+		"""
+		Called when the pipeline has completed a state change or a seek.
+		
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		if self.seekStartTime is None:
+			return
+		
+		latency = time.time() - self.seekStartTime
+		Globals.debug("Seek completed in %.3f seconds" % latency)
+		self.emit("seek-latency", latency)
+		self.__SendQueuedSeek()
+	
+	#_____________________________________________________________________
+	
+	def __PipelineSegmentDoneCb(self, bus, message):
+		"""
+		Called when the pipeline has played to the end of the loop region,
+		to play the loop region again. The seek does not flush, so the start
+		of the loop region follows its end without a gap.
+		
+		Parameters:
+			bus -- reserved for GStreamer callbacks, don't use it explicitly.
+			message -- reserved for GStreamer callbacks, don't use it explicitly.
+		"""
+		if not (self.isPlaying or self.isPaused):
+			return
+		
+		if self.__IsLooping(self.loopStart):
+			self.pipeline.seek(1.0, gst.FORMAT_TIME, gst.SEEK_FLAG_SEGMENT | gst.SEEK_FLAG_ACCURATE,
+					gst.SEEK_TYPE_SET, long(self.loopStart * gst.SECOND),
+					gst.SEEK_TYPE_SET, long(self.loopEnd * gst.SECOND))
+		else:
+			# the loop was cleared before its end was reached
+			format, position = message.parse_segment_done()
+			self.SeekTo(float(position) / gst.SECOND)
+	
+	#_____________________________________________________________________
+	
+	def __SeekTimeoutCb(self, seekCount):
+		"""
+		Stops waiting for a seek which the pipeline has not completed in time,
+		so that the seeks after it are not held up.
+		
+		Parameters:
+			seekCount -- the number of the seek the timeout was added for.
+		
+		Returns:
+			False -- to stop the timeout from being called again.
+		"""
+		if seekCount == self.seekCount and self.seekStartTime is not None:
+			Globals.debug("Seek not completed after %d milliseconds" % self.SEEK_TIMEOUT)
+			self.__SendQueuedSeek()
+		return False
+		
+	#_____________________________________________________________________
+	
 	def QueryPosition(self):
 		"""
 		Reads the current playhead cursor position by querying pipeline.
@@ -16,7 +16,12 @@ def UndoCommand(*command, **command_options):
 	
 	Parameters:
 		command -- the undo command list of strings.
-		command_options -- key-value parameters to change options.
+		command_options -- key-value parameters to change options:
+				incremental_save -- False if the call should not be
+						written to the .incremental file.
+				merge -- True if the undo command sets a value back, rather than
+						changing it, so that a call right after another one on the
+						same object can share its undo action (see Project.MergeUndoAction()).
 		
 	Returns:
 		an UndoFunction which decorates the original function.
@@ -73,6 +78,8 @@ def UndoCommand(*command, **command_options):
 			if command_options.has_key("incremental_save"):
 				do_incremental_save = command_options["incremental_save"]
 			
+			merge = False
+			
 			
 			try:
 				result = func(funcSelf, *args, **kwargs)
@@ -93,11 +100,14 @@ def UndoCommand(*command, **command_options):
 			if do_incremental_save:
 				inc = IncrementalSave.Action(objectString, func.__name__, args, kwargs)
 				project.SaveIncrementalAction(inc)
-				# testing: make sure loading produces an identical result
-				assert inc.StoreToString() == IncrementalSave.Action.LoadFromString(inc.StoreToString()).StoreToString()
+				if Globals.DEBUG_STDOUT or Globals.DEBUG_GST:
+					# testing: make sure loading produces an identical result
+					assert inc.StoreToString() == IncrementalSave.Action.LoadFromString(inc.StoreToString()).StoreToString()
 			
 			if not atomicUndoObject and project:
 				atomicUndoObject = project.NewAtomicUndoAction()
+				# only merge actions holding just this command
+				merge = command_options.get("merge", False)
 				
 			if atomicUndoObject:
 				paramList = []
@@ -110,6 +120,8 @@ def UndoCommand(*command, **command_options):
 						paramList.append(value)
 				
 				atomicUndoObject.AddUndoCommand(objectString, command[0], paramList)
+				if merge:
+					project.MergeUndoAction(atomicUndoObject)
 			
 			return result
 		
@@ -137,6 +149,7 @@ import ProjectManager, Globals, Utils
 import Project, Event, Instrument
 import IncrementalSave
 import xml.dom.minidom as xml
+import time, tempfile, cPickle
 
 #=========================================================================
 
@@ -182,6 +195,8 @@ class AtomicUndoAction:
 		Creates a new AtomicUndoAction instance.
 		"""
 		self.commandList = []
+		self.time = time.time()	#when the last command was added, to merge consecutive actions
+		self.size = None		#estimated memory used by the commands, or None if it has to be recalculated
 	
 	#_____________________________________________________________________
 	
@@ -204,6 +219,8 @@ class AtomicUndoAction:
 		"""
 		newTuple = (objectString, function, paramList)
 		self.commandList.append(newTuple)
+		self.time = time.time()
+		self.size = None
 		Globals.debug("LOG COMMAND: ", newTuple, "from", id(self))
 	
 	#_____________________________________________________________________
@@ -219,6 +236,19 @@ class AtomicUndoAction:
 	
 	#_____________________________________________________________________
 	
+	def GetSize(self):
+		"""
+		Estimates how much memory the undo commands of this AtomicUndoAction use.
+		
+		Returns:
+			the approximate size of the commands in bytes.
+		"""
+		if self.size is None:
+			self.size = sum([len(repr(cmd)) for cmd in self.commandList])
+		return self.size
+	
+	#_____________________________________________________________________
+	
 	def StoreToXML(self, doc, node):
 		"""
 		Stores this instance of AtomicUndoAction into an XML node.
@@ -246,3 +276,239 @@ class AtomicUndoAction:
 	#_____________________________________________________________________
 	
 #=========================================================================
+
+class SavedActionStack(list):
+	"""
+	A stack of AtomicUndoActions which are kept in the history file of a Project.
+	
+	Considerations:
+		The history file is only read when it is needed, so the actions at the
+		bottom of the stack may not be loaded yet. The stack also remembers how
+		much of it is already in the history file, so that a save only has to
+		append the actions which have changed since.
+	"""
+	
+	#_____________________________________________________________________
+	
+	def __init__(self):
+		"""
+		Creates a new, empty SavedActionStack.
+		"""
+		list.__init__(self)
+		self.unloaded = 0	#number of actions at the bottom of the stack which are still only in the history file
+		self.synced = 0		#number of actions at the bottom of the stack which are the same as in the history file
+		self.saved = 0		#number of actions in this stack in the history file
+	
+	#_____________________________________________________________________
+	
+	def Count(self):
+		"""
+		Obtains the number of actions in the stack, whether they are loaded or not.
+		
+		Returns:
+			the number of actions in the stack.
+		"""
+		return self.unloaded + len(self)
+	
+	#_____________________________________________________________________
+	
+	def SetUnloaded(self, count):
+		"""
+		Empties the stack and marks it as having the given number of actions
+		in the history file, which have not been loaded.
+		
+		Parameters:
+			count -- the number of actions in this stack in the history file.
+		"""
+		del self[:]
+		self.unloaded = self.synced = self.saved = count
+	
+	#_____________________________________________________________________
+	
+	def SetLoaded(self, actions):
+		"""
+		Puts the actions loaded from the history file below the ones in memory.
+		
+		Parameters:
+			actions -- the AtomicUndoActions at the bottom of the stack, oldest first.
+		"""
+		self[:0] = actions[:self.unloaded]
+		self.unloaded = 0
+	
+	#_____________________________________________________________________
+	
+	def Unload(self, count):
+		"""
+		Drops actions at the bottom of the stack from memory, as long
+		as they are already in the history file.
+		
+		Parameters:
+			count -- the number of actions to drop.
+			
+		Returns:
+			the number of actions dropped, which may be less than count.
+		"""
+		count = max(0, min(count, self.synced - self.unloaded, len(self)))
+		del self[:count]
+		self.unloaded += count
+		return count
+	
+	#_____________________________________________________________________
+	
+	def pop(self):
+		"""
+		Removes the action on top of the stack.
+		
+		Considerations:
+			The top of the stack must be loaded.
+			
+		Returns:
+			the removed AtomicUndoAction.
+		"""
+		action = list.pop(self)
+		self.synced = min(self.synced, self.Count())
+		return action
+	
+	#_____________________________________________________________________
+	
+	def Clear(self):
+		"""
+		Removes all the actions from the stack, including the unloaded ones.
+		"""
+		del self[:]
+		self.unloaded = self.synced = 0
+	
+	#_____________________________________________________________________
+	
+	def GetChanges(self):
+		"""
+		Obtains what has to be written to the history file to bring it
+		up to date with this stack.
+		
+		Returns:
+			a tuple with the number of actions the stack in the history file
+			has to be cut down to (or None if it is not cut) and the list
+			of actions to push onto it afterwards.
+		"""
+		if self.synced < self.saved:
+			length = self.synced
+		else:
+			length = None
+		return length, self[self.synced - self.unloaded:]
+	
+	#_____________________________________________________________________
+	
+	def MarkSaved(self):
+		"""
+		Records that the history file now contains the whole stack.
+		"""
+		self.synced = self.saved = self.Count()
+	
+	#_____________________________________________________________________
+	
+	def MarkUnsaved(self):
+		"""
+		Records that nothing in this stack is in the history file,
+		for example because the Project is saved to a new location.
+		"""
+		self.synced = self.saved = 0
+	
+	#_____________________________________________________________________
+	
+#=========================================================================
+
+class SpilledActionStack:
+	"""
+	Keeps the oldest unsaved AtomicUndoActions of a Project in a temporary
+	file, when there are too many of them to keep in memory.
+	"""
+	
+	#_____________________________________________________________________
+	
+	def __init__(self):
+		"""
+		Creates a new, empty SpilledActionStack. The file is only
+		created when the first action is pushed onto the stack.
+		"""
+		self.file = None
+		self.records = []		#(offset, length) of every action in the file, oldest first
+		self.size = 0			#number of bytes in use at the start of the file
+	
+	#_____________________________________________________________________
+	
+	def Count(self):
+		"""
+		Obtains the number of actions in the stack.
+		
+		Returns:
+			the number of actions in the stack.
+		"""
+		return len(self.records)
+	
+	#_____________________________________________________________________
+	
+	def Push(self, actions):
+		"""
+		Writes actions onto the top of the stack.
+		
+		Parameters:
+			actions -- the AtomicUndoActions to write, oldest first.
+		"""
+		if self.file is None:
+			self.file = tempfile.TemporaryFile(prefix="jokosher-undo-")
+		self.file.seek(self.size)
+		for action in actions:
+			data = cPickle.dumps(action.GetUndoCommands(), cPickle.HIGHEST_PROTOCOL)
+			self.file.write(data)
+			self.records.append((self.size, len(data)))
+			self.size += len(data)
+	
+	#_____________________________________________________________________
+	
+	def Pop(self, count=None):
+		"""
+		Reads actions back from the top of the stack, and removes them from it.
+		
+		Parameters:
+			count -- the number of actions to read, or None to read all of them.
+			
+		Returns:
+			a list of the AtomicUndoActions read, oldest first.
+		"""
+		if count is None or count > len(self.records):
+			count = len(self.records)
+		if not count:
+			return []
+		
+		records = self.records[-count:]
+		del self.records[-count:]
+		self.size = records[0][0]
+		self.file.seek(self.size)
+		data = self.file.read(sum([length for offset, length in records]))
+		
+		actions = []
+		position = 0
+		for offset, length in records:
+			action = AtomicUndoAction()
+			action.commandList = cPickle.loads(data[position:position + length])
+			actions.append(action)
+			position += length
+		
+		self.file.truncate(self.size)
+		return actions
+	
+	#_____________________________________________________________________
+	
+	def Clear(self):
+		"""
+		Removes all the actions from the stack and deletes the file.
+		"""
+		if self.file:
+			self.file.close()
+			self.file = None
+		self.records = []
+		self.size = 0
+	
+	#_____________________________________________________________________
+	
+#=========================================================================
@@ -197,9 +197,37 @@ def StoreParametersToXML(self, doc, parent, parameters):
 		parent -- XML parent tag to use in doc.
 		parameters -- list of variable names whose value, save in doc.
 	"""	   
-	for param in parameters:
+	StoreParameterValuesToXML(doc, parent, CopyParameters(self, parameters))
+
+#_____________________________________________________________________
+
+def CopyParameters(self, parameters):
+	"""
+	Copies the values of the variables indicated by the parameters, so that
+	they can be saved later with StoreParameterValuesToXML().
+	
+	Parameters:
+		parameters -- list of variable names whose value to copy.
+		
+	Returns:
+		a list of (name, value) tuples.
+	"""
+	return [(param, getattr(self, param)) for param in parameters]
+
+#_____________________________________________________________________
+
+def StoreParameterValuesToXML(doc, parent, values):
+	"""
+	Saves the variables copied by CopyParameters() in an XML document.
+	
+	Parameters:
+		doc -- name of the XML document to save the settings into.
+		parent -- XML parent tag to use in doc.
+		values -- list of (name, value) tuples to save in doc.
+	"""
+	for param, value in values:
 		node = doc.createElement(param)
-		StoreVariableToNode(getattr(self, param), node)
+		StoreVariableToNode(value, node)
 		parent.appendChild(node)
 
 #_____________________________________________________________________
@@ -347,6 +375,89 @@ def LoadVariableFromNode(node, typeAttr="type", valueAttr="value"):
 
 #_____________________________________________________________________
 
+def LoadParametersFromElement(self, parentElement):
+	"""
+	Same as LoadParametersFromXML(), but for an ElementTree element
+	instead of a DOM node.
+	
+	Parameters:
+		parentElement -- ElementTree element with the parameters.
+	"""
+	for element in parentElement:
+		setattr(self, element.tag, LoadVariableFromElement(element))
+
+#_____________________________________________________________________
+
+def LoadDictionaryFromElement(parentElement):
+	"""
+	Same as LoadDictionaryFromXML(), but for an ElementTree element
+	instead of a DOM node.
+	
+	Parameters:
+		parentElement -- ElementTree element from which the dictionary is loaded.
+	
+	Returns:
+		a dictionary with the loaded values in (type, value) format.
+	"""
+	dictionary = {}
+	
+	for element in parentElement:
+		if "keytype" in element.attrib and "keyvalue" in element.attrib:
+			key = LoadVariableFromElement(element, "keytype", "keyvalue")
+		else:
+			key = element.tag
+		dictionary[key] = LoadVariableFromElement(element, "type", "value")
+	
+	return dictionary
+
+#_____________________________________________________________________
+
+def LoadListFromElement(parentElement):
+	"""
+	Same as LoadListFromXML(), but for an ElementTree element
+	instead of a DOM node.
+	
+	Parameters:
+		parentElement -- ElementTree element with the list nodes.
+		
+	Returns:
+		a list with the loaded values.
+	"""
+	return [LoadVariableFromElement(element) for element in parentElement]
+
+#_____________________________________________________________________
+
+def LoadVariableFromElement(element, typeAttr="type", valueAttr="value"):
+	"""
+	Same as LoadVariableFromNode(), but for an ElementTree element
+	instead of a DOM node.
+	
+	Parameters:
+		element -- ElementTree element from which the variable is loaded.
+		typeAttr -- string of the attribute name that the
+					variable's type will be saved under.
+		valueAttr -- string of the attribute name that the
+					variable's value will be saved under.
+	
+	Returns:
+		the loaded variable.
+	"""
+	type = element.get(typeAttr)
+	value = element.get(valueAttr, "")
+	
+	if type == "int":
+		return int(value)
+	elif type == "float":
+		return float(value)
+	elif type == "bool":
+		return (value == "True")
+	elif type == "NoneType":
+		return None
+	else:
+		return value
+
+#_____________________________________________________________________
+
 def StoreVariableToNode(value, node, typeAttr="type", valueAttr="value"):
 	"""
 	Saves a variable to an specific XML node.
@@ -4,12 +4,13 @@ import sys, os
 basedir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(basedir)
 
-from tests import TemplateTest
+from tests import TemplateTest, EditModelTest
 import unittest
 
 suite = unittest.TestSuite()
 testList = [
 	TemplateTest.TestCase,
+	EditModelTest.TestCase,
 ]
 
 for i in testList:
@@ -0,0 +1,414 @@
+#
+#	THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL.
+#	SEE THE 'COPYING' FILE FOR DETAILS
+#
+#	EditModelTest.py
+
+import unittest
+import os, shutil, tempfile
+from Jokosher.Project import Project
+from Jokosher.Instrument import Instrument
+from Jokosher.Event import Event
+from Jokosher.Engine import NullEngine
+from Jokosher import ProjectManager, IncrementalSave, AudioPool, DecodeCache, Globals
+
+def WriteFile(path, data, mode="wb"):
+	f = open(path, mode)
+	try:
+		f.write(data)
+	finally:
+		f.close()
+
+class TestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.project = Project(NullEngine())
+		self.project.projectfile = os.path.join(self.folder, "project.jokosher")
+		self.project.audio_path = os.path.join(self.folder, "audio")
+		self.project.levels_path = os.path.join(self.folder, "levels")
+
+		self.instr = Instrument(self.project, "Drums", "drums", None)
+		self.project.instruments.append(self.instr)
+		self.events = []
+		for start in (0.0, 2.0, 4.0):
+			event = Event(self.instr, "hit.wav")
+			event.start = start
+			event.duration = 1.0
+			self.instr.events.append(event)
+			self.events.append(event)
+
+	def testNullEngine(self):
+		self.project.Play()
+		self.assertEqual(self.project.mainpipeline, None)
+		self.assertEqual(self.project.pipelineBuilt, False)
+		self.assertEqual(self.instr.playbackbin, None)
+
+	def testTransactionCoalescesSignals(self):
+		emitted = []
+		self.events[0].connect("position", lambda event: emitted.append(event))
+		self.project.BeginUpdate()
+		try:
+			self.events[0].Move(0.5)
+			self.events[0].Move(1.0)
+			self.assertEqual(emitted, [])
+		finally:
+			self.project.EndUpdate()
+		self.assertEqual(emitted, [self.events[0]])
+
+	def testMoveEvents(self):
+		ids = [self.events[0].id, self.events[1].id]
+		self.assertTrue(self.project.MoveEvents(ids, 0.5))
+		self.assertEqual([e.start for e in self.events], [0.5, 2.5, 4.0])
+
+		self.project.Undo()
+		self.assertEqual([e.start for e in self.events], [0.0, 2.0, 4.0])
+
+	def testEventIndex(self):
+		self.assertEqual(self.instr.GetEventsInRange(1.5, 4.5), self.events[1:])
+		
+		# the index follows the Events as they move, and are added and removed
+		self.events[0].Move(6.0)
+		event = Event(self.instr, "hit.wav")
+		event.start, event.duration = 8.0, 1.0
+		self.instr.events.append(event)
+		self.project.DeleteEvents([self.events[1].id])
+		self.assertEqual(self.instr.GetEventsInRange(0.0, 10.0), [self.events[2], self.events[0], event])
+		self.assertEqual(self.instr.GetEventsInRange(6.5, 8.5), [self.events[0], event])
+		
+		self.project.Undo()
+		self.assertEqual(self.instr.GetEventsInRange(1.5, 2.5), [self.events[1]])
+	
+	def testMoveEventsDoesNotOverlap(self):
+		self.assertFalse(self.project.MoveEvents([self.events[0].id], 1.5))
+		self.assertEqual(self.events[0].start, 0.0)
+
+	def testDeleteEvents(self):
+		self.project.DeleteEvents([e.id for e in self.events[:2]])
+		self.assertEqual(self.instr.events, [self.events[2]])
+		self.assertEqual(self.instr.graveyard, self.events[:2])
+		self.assertEqual(self.instr.GetEventsInRange(0.0, 5.0), [self.events[2]])
+
+		self.project.Undo()
+		self.assertEqual(len(self.instr.events), 3)
+		self.assertEqual(self.instr.GetEventsInRange(0.0, 5.0), self.events)
+		self.project.Redo()
+		self.assertEqual(self.instr.events, [self.events[2]])
+
+	def testSplitEventsAt(self):
+		self.events[2].duration = 4.0
+		self.project.SplitEventsAt([5.0, 6.0, 7.0], [self.events[2].id])
+		pieces = self.instr.GetEventsInRange(4.0, 8.0)
+		self.assertEqual([(e.start, e.duration) for e in pieces],
+				[(4.0, 1.0), (5.0, 1.0), (6.0, 1.0), (7.0, 1.0)])
+
+		self.project.Undo()
+		self.assertEqual(len(self.instr.events), 3)
+		self.assertEqual(self.events[2].duration, 4.0)
+
+	def testSaveProjectFile(self):
+		self.project.MoveEvents([self.events[0].id], 0.5)
+		self.project.SaveProjectFile(background=True)
+		# the thread serializes a copy, so later edits do not reach the file
+		self.events[1].start = 3.0
+		self.project.WaitForSave()
+		self.assertFalse(os.path.exists(self.project.projectfile + "~"))
+		
+		loaded = ProjectManager.LoadProjectFile(self.project.projectfile, NullEngine())
+		self.assertEqual([i.name for i in loaded.instruments], ["Drums"])
+		self.assertEqual([e.start for e in loaded.instruments[0].events], [0.5, 2.0, 4.0])
+		self.assertTrue(loaded.CanPerformUndo())
+		
+		# the history is only read from its own file when it is needed
+		self.assertEqual(loaded._Project__savedUndoStack.unloaded, 1)
+		loaded.Undo()
+		self.assertEqual(loaded.instruments[0].events[0].start, 0.0)
+		self.assertTrue(loaded.CanPerformRedo())
+
+	def testFailedSaveKeepsChanges(self):
+		self.project.MoveEvents([self.events[0].id], 0.5)
+		self.project.FlushIncrementalSave()
+		# the Project file cannot be moved into place over a folder
+		os.mkdir(self.project.projectfile)
+		self.assertRaises(ProjectManager.SaveProjectError, self.project.SaveProjectFile)
+		self.assertTrue(self.project.CheckUnsavedChanges())
+		self.assertTrue(self.project.CanDoIncrementalRestore())
+		
+		filename = os.path.join(self.folder, "project" + self.project.INCREMENTAL_SAVE_EXT)
+		self.assertEqual(len(IncrementalSave.Journal.ReadRecords(filename)), 1)
+	
+	def testIncrementalSave(self):
+		self.project.MoveEvents([self.events[0].id], 0.5)
+		self.project.FlushIncrementalSave()
+		
+		filename = os.path.join(self.folder, "project" + self.project.INCREMENTAL_SAVE_EXT)
+		records = IncrementalSave.Journal.ReadRecords(filename)
+		self.assertEqual(len(records), 1)
+		action = IncrementalSave.LoadFromString(records[0])
+		self.assertEqual((action.objectString, action.func_name), ("E%d" % self.events[0].id, "Move"))
+
+	def testCompactJournal(self):
+		actions = [IncrementalSave.InstrumentSetVolume(1, 0.5),
+				IncrementalSave.Action("E1", "Move", (1.0,), {}),
+				IncrementalSave.Undo(), IncrementalSave.Undo(),
+				IncrementalSave.Redo(), IncrementalSave.Redo(),
+				IncrementalSave.InstrumentSetVolume(2, 0.2),
+				IncrementalSave.InstrumentSetVolume(1, 0.8)]
+		records = [(action.StoreToString(), action) for action in actions]
+		kept = [action for string, action in IncrementalSave.Compact(records)]
+		self.assertEqual(kept, [actions[1], actions[6], actions[7]])
+
+	def testMergeUndoActions(self):
+		self.events[0].Move(0.5)
+		self.events[0].Move(1.0)
+		self.events[1].Move(2.5)
+		
+		self.project.Undo()
+		self.assertEqual([e.start for e in self.events], [1.0, 2.0, 4.0])
+		self.project.Undo()
+		self.assertEqual([e.start for e in self.events], [0.0, 2.0, 4.0])
+		self.assertFalse(self.project.CanPerformUndo())
+
+	def testRestoreMergedUndoActions(self):
+		self.project.SaveProjectFile()
+		self.events[0].Move(0.5)
+		# the next moves come minutes later, and only they are merged
+		self.project._Project__undoStack[-1].time -= 600
+		self.events[0].Move(1.0)
+		self.events[0].Move(1.5)
+		self.project.Undo()
+		self.assertEqual(self.events[0].start, 0.5)
+		self.project.FlushIncrementalSave()
+		
+		loaded = ProjectManager.LoadProjectFile(self.project.projectfile, NullEngine())
+		self.assertTrue(loaded.CanDoIncrementalRestore())
+		loaded.DoIncrementalRestore()
+		event = loaded.instruments[0].events[0]
+		self.assertEqual(event.start, 0.5)
+		loaded.Undo()
+		self.assertEqual(event.start, 0.0)
+		self.assertFalse(loaded.CanPerformUndo())
+
+	def testSpillUndoHistory(self):
+		limit = Globals.settings.general["undolimit"]
+		Globals.settings.general["undolimit"] = 2
+		try:
+			for i in range(3):
+				for event in self.events:
+					event.Move(event.start + 0.1 * (i + 1))
+			self.assertEqual(len(self.project._Project__undoStack), 2)
+			
+			while self.project.CanPerformUndo():
+				self.project.Undo()
+			self.assertEqual([e.start for e in self.events], [0.0, 2.0, 4.0])
+		finally:
+			Globals.settings.general["undolimit"] = limit
+
+	def testGraveyardReleasesLevels(self):
+		os.mkdir(self.project.levels_path)
+		event = self.events[0]
+		for i in range(1, 11):
+			event.levels_list.append(i * 100, [i * 1000, i * 1000])
+		
+		self.project.DeleteEvents([event.id])
+		self.assertEqual(len(event.levels_list), 0)
+		self.assertTrue(os.path.exists(event.releasedLevelsFile))
+		
+		self.project.Undo()
+		self.assertEqual(len(event.levels_list), 10)
+		self.assertEqual(event.releasedLevelsFile, None)
+
+	def testCloneFile(self):
+		src = os.path.join(self.folder, "hit.wav")
+		f = open(src, "wb")
+		try:
+			f.write("RIFF" * 1000)
+		finally:
+			f.close()
+		
+		progress = []
+		for name, link in (("copy.wav", False), ("link.wav", True)):
+			dst = os.path.join(self.folder, name)
+			self.assertTrue(ProjectManager.CloneFile(src, dst, link, progress.append))
+			self.assertEqual(open(dst, "rb").read(), "RIFF" * 1000)
+		self.assertEqual(sum(progress), 8000)
+
+	def testAudioPool(self):
+		poolPath = AudioPool.POOL_PATH, AudioPool.MANIFEST_PATH
+		AudioPool.POOL_PATH = os.path.join(self.folder, "pool")
+		AudioPool.MANIFEST_PATH = os.path.join(AudioPool.POOL_PATH, "manifest")
+		AudioPool._manifest = None
+		try:
+			src = os.path.join(self.folder, "loop.wav")
+			f = open(src, "wb")
+			try:
+				f.write("RIFF" * 1000)
+			finally:
+				f.close()
+			
+			first, second = os.path.join(self.folder, "a.wav"), os.path.join(self.folder, "b.wav")
+			self.assertTrue(AudioPool.AddFile(src, first))
+			self.assertTrue(AudioPool.AddFile(src, second))
+			self.assertTrue(AudioPool.IsPooled(second))
+			self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+			self.assertEqual(AudioPool.GetReferenceCount(first), 2)
+			
+			# a sample saved over with the same size and time is hashed again
+			stat = os.stat(src)
+			f = open(src + "~", "wb")
+			try:
+				f.write("WAVE" * 1000)
+			finally:
+				f.close()
+			os.utime(src + "~", (stat.st_atime, stat.st_mtime))
+			os.rename(src + "~", src)
+			third = os.path.join(self.folder, "c.wav")
+			self.assertTrue(AudioPool.AddFile(src, third))
+			self.assertEqual(open(third, "rb").read(), "WAVE" * 1000)
+			
+			os.remove(first)
+			self.assertEqual(AudioPool.Collect(), 0)
+			os.remove(second)
+			self.assertEqual(AudioPool.Collect(), 4000)
+		finally:
+			AudioPool.POOL_PATH, AudioPool.MANIFEST_PATH = poolPath
+			AudioPool._manifest = None
+
+	def testCompactProject(self):
+		os.mkdir(self.project.audio_path)
+		os.mkdir(self.project.levels_path)
+		for name in ("hit.wav", "old.wav"):
+			f = open(os.path.join(self.project.audio_path, name), "wb")
+			try:
+				f.write("RIFF" * 100)
+			finally:
+				f.close()
+		
+		self.assertEqual(self.project.CompactProject(), 400)
+		self.assertEqual(os.listdir(self.project.audio_path), ["hit.wav"])
+		
+		self.project.DeleteEvents([self.events[0].id])
+		self.project.MoveEvents([self.events[1].id], 0.5)
+		self.project.CompactProject(keepHistory=1)
+		self.assertEqual(self.instr.graveyard, [])
+		self.project.Undo()
+		self.assertFalse(self.project.CanPerformUndo())
+
+	def testCompactProjectFailedSave(self):
+		os.mkdir(self.project.audio_path)
+		open(os.path.join(self.project.audio_path, "old.wav"), "wb").close()
+		self.project.DeleteEvents([self.events[0].id])
+		self.project.MoveEvents([self.events[1].id], 0.5)
+		
+		# the Project file cannot be moved into place over a folder
+		os.mkdir(self.project.projectfile)
+		self.assertRaises(ProjectManager.SaveProjectError, self.project.CompactProject, keepHistory=1)
+		self.assertTrue(os.path.exists(os.path.join(self.project.audio_path, "old.wav")))
+	
+	def testFreezeSignature(self):
+		os.mkdir(self.project.audio_path)
+		open(os.path.join(self.project.audio_path, "frozen.wav"), "wb").close()
+		self.instr.frozenFile = "frozen.wav"
+		self.instr.frozenSignature = self.instr.GetFreezeSignature()
+		self.assertTrue(self.instr.IsFrozen())
+		
+		self.events[0].Move(0.5)
+		self.assertFalse(self.instr.IsFrozen())
+		self.project.Undo()
+		self.assertTrue(self.instr.IsFrozen())
+
+	def testFrozenInstrumentKeepsEventsOut(self):
+		project = Project()
+		project.audio_path = self.project.audio_path
+		os.mkdir(project.audio_path)
+		open(os.path.join(project.audio_path, "frozen.wav"), "wb").close()
+		instr = Instrument(project, "Bass", "bass", None)
+		project.instruments.append(instr)
+		event = Event(instr, "hit.wav")
+		event.duration = 1.0
+		event.levels_list.append(1000, [1000, 1000])
+		instr.events.append(event)
+		project.BuildPipeline()
+		
+		instr.frozenFile = "frozen.wav"
+		instr.frozenLength = 1.0
+		instr.frozenSignature = instr.GetFreezeSignature()
+		instr.PrepareController()
+		self.assertEqual(event.gnlsrc.get_parent(), None)
+		
+		# undoing the deletion brings back the Event and the signature
+		project.DeleteEvents([event.id])
+		project.Undo()
+		self.assertTrue(instr.IsFrozen())
+		self.assertEqual(event.gnlsrc.get_parent(), None)
+		self.assertEqual(instr.frozenSource.get_parent(), instr.composition)
+		project.CloseProject()
+	
+	def testStemFilenames(self):
+		self.project.instruments.append(Instrument(self.project, "Drums", "drums", None))
+		open(os.path.join(self.folder, "Drums.wav"), "wb").close()
+		
+		stems = self.project.GetStemFilenames(self.folder, "wav")
+		self.assertEqual([os.path.basename(x[1]) for x in stems], ["Drums.wav", "Drums (2).wav"])
+		# existing files are only replaced when asked to
+		stems = self.project.GetStemFilenames(self.folder, "wav", overwrite=False)
+		self.assertEqual([os.path.basename(x[1]) for x in stems], ["Drums (2).wav", "Drums (3).wav"])
+	
+	def testDecodeCache(self):
+		cachePath, setting = DecodeCache.CACHE_PATH, Globals.settings.general["decodecache"]
+		DecodeCache.CACHE_PATH = os.path.join(self.folder, "cache")
+		Globals.settings.general["decodecache"] = "enabled"
+		try:
+			os.mkdir(DecodeCache.CACHE_PATH)
+			src = os.path.join(self.folder, "take.ogg")
+			WriteFile(src, "OggS" * 100)
+			cached = DecodeCache.GetCachePath(src)
+			WriteFile(cached, "RIFF" * 1000)
+			self.assertEqual(DecodeCache.GetCachedFile(src), cached)
+			
+			wav = os.path.join(self.folder, "take.wav")
+			WriteFile(wav, "RIFF" * 100)
+			self.assertEqual(DecodeCache.GetCachedFile(wav), wav)
+			self.assertEqual(DecodeCache.GetCachedFile(wav, rate=48000, fileRate=48000), wav)
+			# copies resampled to another rate are kept apart
+			self.assertNotEqual(DecodeCache.GetCachePath(src, 48000), cached)
+			
+			# a changed file does not use the copy of its old content
+			WriteFile(src, "OggS", "ab")
+			self.assertNotEqual(DecodeCache.GetCachePath(src), cached)
+			
+			# a copy which a source has been set up to play is kept
+			DecodeCache.SetUsedFile(self.events[0], cached)
+			self.assertEqual(DecodeCache.Trim(0), 0)
+			self.events[0].ReleaseResources(spillLevels=False)
+			self.assertEqual(DecodeCache.Trim(0), 4000)
+		finally:
+			DecodeCache.CACHE_PATH = cachePath
+			Globals.settings.general["decodecache"] = setting
+	
+	def testSampleRate(self):
+		self.assertEqual(self.project.sampleRate, Globals.DEFAULT_SAMPLE_RATE)
+		self.project.SetSampleRate(48000)
+		self.events[0].sampleRate = 48000
+		self.assertEqual(self.events[0].GetPlaybackRate(), 48000)
+		self.project.SaveProjectFile()
+		
+		loaded = ProjectManager.LoadProjectFile(self.project.projectfile, NullEngine())
+		self.assertEqual(loaded.sampleRate, 48000)
+		self.assertEqual(loaded.instruments[0].events[0].sampleRate, 48000)
+		
+		self.project.Undo()
+		self.assertEqual(self.project.sampleRate, Globals.DEFAULT_SAMPLE_RATE)
+	
+	def testLoopRegion(self):
+		transport = self.project.transport
+		transport.SetLoop(4.0, 2.0)
+		self.assertEqual(transport.GetLoop(), None)
+		transport.SetLoop(2.0, 4.0)
+		self.assertEqual(transport.GetLoop(), (2.0, 4.0))
+		transport.ClearLoop()
+		self.assertEqual(transport.GetLoop(), None)
+	
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+